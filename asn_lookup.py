@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+ASN Lookup - 离线 IP -> ASN/前缀/组织 查询
+将 routeviews/CAIDA prefix2as 数据编译为紧凑的二进制索引：
+嵌套前缀展开为互不重叠的地址区间并按起始地址排序，
+查询时 mmap 索引文件并二分查找（最长前缀匹配），无需网络访问
+"""
+
+import gzip
+import json
+import mmap
+import os
+import socket
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+from functools import lru_cache
+
+
+INDEX_MAGIC = b'PFX2AS1\x00'
+# 魔数(8) + 字节序(1) + 保留(3) + 区间数(4) + 组织名JSON长度(4)
+INDEX_HEADER = struct.Struct('<8sB3xII')
+
+
+def _open_text(path):
+    """打开文本文件（支持 .gz）"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='ignore')
+    return open(path, encoding='utf-8', errors='ignore')
+
+
+def ip_to_int(ip):
+    """IPv4 地址字符串转整数"""
+    return struct.unpack('!I', socket.inet_aton(ip))[0]
+
+
+def int_to_ip(value):
+    """整数转 IPv4 地址字符串"""
+    return socket.inet_ntoa(struct.pack('!I', value))
+
+
+def read_prefix2as(path):
+    """
+    读取 prefix2as 文件
+
+    每行格式: "<前缀>\\t<长度>\\t<ASN>"，多源 AS（"1_2" 或 "1,2"）取第一个，
+    AS 集合（"{1,2}"）取第一个
+
+    Yields:
+        (网络地址整数, 前缀长度, ASN)
+    """
+    with _open_text(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 3 or ':' in fields[0]:
+                continue  # 跳过 IPv6 和格式错误的行
+            try:
+                network = ip_to_int(fields[0])
+                length = int(fields[1])
+                asn = int(fields[2].strip('{}').replace(',', '_').split('_')[0])
+            except (OSError, ValueError):
+                continue
+            if not 0 <= length <= 32:
+                continue
+            mask = (0xFFFFFFFF << (32 - length)) & 0xFFFFFFFF
+            yield network & mask, length, asn
+
+
+def read_as2org(path):
+    """
+    读取 AS 组织名文件
+
+    支持 CAIDA as2org 格式（aut 与 org 两段，以 '|' 分隔）
+    以及简单的 "ASN|名称" / "ASN<TAB>名称" 格式
+
+    Returns:
+        {asn: 组织名}
+    """
+    aut_org = {}    # asn -> org_id
+    aut_name = {}   # asn -> aut_name
+    org_names = {}  # org_id -> name
+    with _open_text(path) as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split('|') if '|' in line else line.split('\t')
+            if len(fields) == 2 and fields[0].isdigit():
+                aut_name[int(fields[0])] = fields[1].strip()
+            elif len(fields) >= 6 and fields[0].isdigit():
+                # aut_num|changed|aut_name|org_id|opaque_id|source
+                asn = int(fields[0])
+                aut_name[asn] = fields[2]
+                aut_org[asn] = fields[3]
+            elif len(fields) == 5:
+                # org_id|changed|name|country|source
+                org_names[fields[0]] = fields[2]
+    names = {}
+    for asn, name in aut_name.items():
+        names[asn] = org_names.get(aut_org.get(asn), name)
+    return names
+
+
+def flatten_prefixes(prefixes):
+    """
+    将可能嵌套的前缀展开为互不重叠的区间，每个区间对应最长匹配前缀
+
+    Args:
+        prefixes: (网络地址, 长度, ASN) 可迭代对象
+
+    Returns:
+        (starts, ends, asns, networks, lengths) 五个 array
+    """
+    # 起始地址升序，同起点时短前缀（大范围）在前
+    entries = sorted(set(prefixes), key=lambda p: (p[0], p[1]))
+
+    starts = array('I')
+    ends = array('I')
+    asns = array('I')
+    networks = array('I')
+    lengths = array('B')
+
+    def emit(start, end, entry):
+        if start > end:
+            return
+        if (asns and ends[-1] + 1 == start and networks[-1] == entry[0]
+                and lengths[-1] == entry[1]):
+            ends[-1] = end  # 与上一区间属于同一前缀，合并
+            return
+        starts.append(start)
+        ends.append(end)
+        asns.append(entry[2])
+        networks.append(entry[0])
+        lengths.append(entry[1])
+
+    stack = []   # 当前包含游标位置的前缀栈: (end, entry)
+    cursor = 0   # 下一个尚未输出的地址
+    for entry in entries:
+        network, length, _ = entry
+        end = network + (1 << (32 - length)) - 1
+        # 弹出不再覆盖当前前缀起点的外层前缀
+        while stack and stack[-1][0] < network:
+            outer_end, outer = stack.pop()
+            emit(cursor, outer_end, outer)
+            cursor = outer_end + 1
+        if stack:
+            if stack[-1][0] < end:
+                continue  # 不合法的部分重叠（CIDR 不会出现），忽略
+            emit(cursor, network - 1, stack[-1][1])
+        cursor = max(cursor, network)
+        stack.append((end, entry))
+    while stack:
+        outer_end, outer = stack.pop()
+        emit(cursor, outer_end, outer)
+        cursor = outer_end + 1
+
+    return starts, ends, asns, networks, lengths
+
+
+def build_index(prefix2as_path, output_path, as2org_path=None):
+    """
+    编译 prefix2as 文件为二进制索引
+
+    Args:
+        prefix2as_path: prefix2as 文件路径（支持 .gz）
+        output_path: 输出索引文件路径
+        as2org_path: AS 组织名文件路径（可选）
+
+    Returns:
+        区间数
+    """
+    starts, ends, asns, networks, lengths = flatten_prefixes(read_prefix2as(prefix2as_path))
+
+    names = {}
+    if as2org_path:
+        used = set(asns)
+        names = {str(asn): name for asn, name in read_as2org(as2org_path).items()
+                 if asn in used}
+    org_blob = json.dumps(names, ensure_ascii=False).encode('utf-8')
+
+    byteorder = 0 if sys.byteorder == 'little' else 1
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, byteorder, len(starts), len(org_blob)))
+        for column in (starts, ends, asns, networks):
+            column.tofile(f)
+        lengths.tofile(f)
+        f.write(org_blob)
+    os.replace(tmp_path, output_path)
+    return len(starts)
+
+
+class PrefixIndex:
+    """mmap 的最长前缀匹配索引（首次查询时才加载）"""
+
+    def __init__(self, path):
+        """
+        初始化
+
+        Args:
+            path: build_index 生成的索引文件
+        """
+        self.path = path
+        self._file = None
+        self._mmap = None
+        self._orgs = None
+        self.starts = None
+        self.ends = None
+        self.asns = None
+        self.networks = None
+        self.lengths = None
+
+    def _load(self):
+        if self._mmap is not None:
+            return
+        self._file = open(self.path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, byteorder, count, org_size = INDEX_HEADER.unpack_from(self._mmap, 0)
+        if magic != INDEX_MAGIC:
+            self.close()
+            raise ValueError(f"无效的索引文件: {self.path}")
+        if byteorder != (0 if sys.byteorder == 'little' else 1):
+            self.close()
+            raise ValueError("索引文件字节序与本机不一致，请重新编译索引")
+
+        view = memoryview(self._mmap)
+        offset = INDEX_HEADER.size
+        columns = []
+        for _ in range(4):
+            columns.append(view[offset:offset + count * 4].cast('I'))
+            offset += count * 4
+        self.starts, self.ends, self.asns, self.networks = columns
+        self.lengths = view[offset:offset + count]
+        self._org_range = (offset + count, offset + count + org_size)
+
+    def __len__(self):
+        self._load()
+        return len(self.starts)
+
+    def org(self, asn):
+        """返回 ASN 对应的组织名（首次调用时加载组织名表）"""
+        if self._orgs is None:
+            self._load()
+            start, end = self._org_range
+            self._orgs = json.loads(bytes(self._mmap[start:end]) or b'{}')
+        return self._orgs.get(str(asn))
+
+    def lookup_int(self, value):
+        """
+        按整数地址查询
+
+        Returns:
+            区间下标或 -1
+        """
+        self._load()
+        i = bisect_right(self.starts, value) - 1
+        if i >= 0 and value <= self.ends[i]:
+            return i
+        return -1
+
+    def lookup(self, ip):
+        """
+        查询 IP 所属的 ASN 和前缀
+
+        Args:
+            ip: IPv4 地址字符串
+
+        Returns:
+            (ASN, 前缀字符串, 组织名) 或 None
+        """
+        try:
+            value = ip_to_int(ip)
+        except (OSError, TypeError):
+            return None
+        i = self.lookup_int(value)
+        if i < 0:
+            return None
+        asn = self.asns[i]
+        prefix = f"{int_to_ip(self.networks[i])}/{self.lengths[i]}"
+        return asn, prefix, self.org(asn)
+
+    def close(self):
+        """释放 mmap"""
+        for name in ('starts', 'ends', 'asns', 'networks', 'lengths'):
+            view = getattr(self, name)
+            if view is not None:
+                view.release()
+                setattr(self, name, None)
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class HopEnricher:
+    """跳信息富化：为 IP 标注 ASN、前缀和组织名"""
+
+    def __init__(self, index_path, cache_size=65536):
+        """
+        初始化
+
+        Args:
+            index_path: 索引文件路径
+            cache_size: 查询结果 LRU 缓存大小（同一路由器会反复出现）
+        """
+        self.index = PrefixIndex(index_path)
+        self.annotate = lru_cache(maxsize=cache_size)(self.index.lookup)
+
+    def enrich_route_hops(self, route_hops):
+        """
+        为 TracerouteNoAdmin.route_hops 中的每一跳添加 'asn'、'prefix'、'org'
+
+        Returns:
+            route_hops（原地修改）
+        """
+        for entry in route_hops.values():
+            info = self.annotate(entry['ip']) if entry.get('ip') else None
+            if info:
+                entry['asn'], entry['prefix'], entry['org'] = info
+        return route_hops
+
+    def format(self, ip):
+        """返回用于显示的标注，如 "[AS4134 CHINANET]"，无结果时返回空串"""
+        info = self.annotate(ip)
+        if not info:
+            return ""
+        asn, _, org = info
+        return f"[AS{asn} {org}]" if org else f"[AS{asn}]"
+
+
+def print_usage():
+    """打印使用说明"""
+    print("ASN Lookup - 离线 IP -> ASN 查询")
+    print("\n用法:")
+    print("  python asn_lookup.py build <prefix2as文件> <索引文件> [--org <as2org文件>]")
+    print("  python asn_lookup.py lookup <索引文件> <IP> ...")
+    print("\n说明:")
+    print("  prefix2as 文件可从 CAIDA / routeviews 下载（支持 .gz）")
+    print("  编译后的索引可通过 trace.py --asn <索引文件> 使用")
+    print("\n示例:")
+    print("  python asn_lookup.py build routeviews-rv2-20240101-1200.pfx2as.gz asn.idx")
+    print("  python asn_lookup.py lookup asn.idx 8.8.8.8 110.242.68.66")
+
+
+def main():
+    """主函数"""
+    if len(sys.argv) < 2 or sys.argv[1] in ['-h', '--help']:
+        print_usage()
+        sys.exit(0 if len(sys.argv) >= 2 else 1)
+
+    command = sys.argv[1]
+    args = sys.argv[2:]
+
+    if command == 'build':
+        org_path = None
+        if '--org' in args:
+            pos = args.index('--org')
+            if pos + 1 >= len(args):
+                print("错误: --org 需要一个参数")
+                sys.exit(1)
+            org_path = args[pos + 1]
+            del args[pos:pos + 2]
+        if len(args) != 2:
+            print_usage()
+            sys.exit(1)
+        try:
+            count = build_index(args[0], args[1], org_path)
+        except OSError as e:
+            print(f"错误: {e}")
+            sys.exit(1)
+        print(f"✓ 已生成索引 {args[1]}，共 {count} 个地址区间")
+    elif command == 'lookup':
+        if len(args) < 2:
+            print_usage()
+            sys.exit(1)
+        index = PrefixIndex(args[0])
+        try:
+            for ip in args[1:]:
+                info = index.lookup(ip)
+                if info:
+                    asn, prefix, org = info
+                    print(f"{ip:15s}  AS{asn:<8d} {prefix:18s}  {org or ''}")
+                else:
+                    print(f"{ip:15s}  -")
+        except (OSError, ValueError) as e:
+            print(f"错误: {e}")
+            sys.exit(1)
+        finally:
+            index.close()
+    else:
+        print(f"错误: 未知命令 '{command}'")
+        print_usage()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Async Traceroute - 基于 asyncio 的系统 traceroute 并发执行器
+在单个事件循环中启动多个系统 traceroute/tracert 子进程（并发数受限），
+通过事件循环读取所有子进程的输出管道，逐行交给解析器处理，无需轮询。
+Linux 上 Python 3.9–3.11 默认的子进程监视器为每个子进程启动一个等待线程，
+run_traceroutes 在支持 pidfd 时改用 PidfdChildWatcher，由事件循环本身等待
+子进程退出（3.12 起默认即如此）；其他平台仍可能使用等待线程
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+from trace import TracerouteNoAdmin
+from traceroute import MAX_TTL
+
+
+class AsyncTracerouteRunner:
+    """系统 traceroute 子进程池"""
+
+    def __init__(self, concurrency=32, max_hops=30, timeout=2, on_hop=None):
+        """
+        初始化
+
+        Args:
+            concurrency: 同时运行的子进程数上限
+            max_hops: 最大跳数
+            timeout: 每次查询超时时间（秒）
+            on_hop: 每解析出一跳时的回调 on_hop(destination, hop_num, entry)
+        """
+        self.concurrency = concurrency
+        self.max_hops = max_hops
+        self.timeout = timeout
+        self.on_hop = on_hop
+
+    async def run_one(self, destination, semaphore=None):
+        """
+        运行单个 traceroute 子进程并增量解析输出
+
+        Args:
+            destination: 目标主机
+            semaphore: 并发控制信号量（可选）
+
+        Returns:
+            route_hops 字典，格式与 TracerouteNoAdmin.route_hops 相同
+        """
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(1)
+
+        tracer = TracerouteNoAdmin(destination, max_hops=self.max_hops,
+                                   timeout=self.timeout, enable_tcp_check=False)
+        cmd = tracer.build_command()
+
+        async with semaphore:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+            try:
+                async for raw in process.stdout:
+                    line = raw.decode('utf-8', errors='ignore')
+                    parsed = tracer.parse_traceroute_line(line)
+                    if not parsed:
+                        continue
+                    hop_num, ips, rtts = parsed
+                    entry = {'ip': ips[0] if ips else None,
+                             'rtts': rtts if ips else []}
+                    tracer.route_hops[hop_num] = entry
+                    if self.on_hop:
+                        self.on_hop(destination, hop_num, entry)
+                await process.wait()
+            except asyncio.CancelledError:
+                process.kill()
+                await process.wait()
+                raise
+
+        return tracer.route_hops
+
+    async def run_all(self, destinations):
+        """
+        并发运行多个 traceroute
+
+        Args:
+            destinations: 目标主机列表
+
+        Returns:
+            [(destination, route_hops)]，与输入顺序一致（重复的目标各占一项），
+            启动失败的目标值为异常对象
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        destinations = list(destinations)
+        results = await asyncio.gather(
+            *(self.run_one(dest, semaphore) for dest in destinations),
+            return_exceptions=True,
+        )
+        return list(zip(destinations, results))
+
+
+def run_traceroutes(destinations, concurrency=32, max_hops=30, timeout=2,
+                    on_hop=None):
+    """
+    同步接口：并发运行多个系统 traceroute
+
+    Returns:
+        [(destination, route_hops 或异常)]，与输入顺序一致
+    """
+    runner = AsyncTracerouteRunner(concurrency=concurrency, max_hops=max_hops,
+                                   timeout=timeout, on_hop=on_hop)
+    if _pidfd_watcher_needed():
+        asyncio.get_event_loop_policy().set_child_watcher(asyncio.PidfdChildWatcher())
+    return asyncio.run(runner.run_all(destinations))
+
+
+def _pidfd_watcher_needed():
+    """Python 3.9–3.11 的 Linux 上是否需要（且可以）改用 PidfdChildWatcher"""
+    if (sys.platform != 'linux' or sys.version_info >= (3, 12) or
+            not hasattr(asyncio, 'PidfdChildWatcher')):
+        return False
+    # pidfd_open 需要 Linux 5.3+
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except (AttributeError, OSError):
+        return False
+    return True
+
+
+def read_destinations(stream):
+    """读取目标列表（每行一个，忽略空行和 # 注释）"""
+    return [line.strip() for line in stream
+            if line.strip() and not line.startswith('#')]
+
+
+def print_usage():
+    """打印使用说明"""
+    print("Async Traceroute - 并发运行系统 traceroute")
+    print("\n用法: python async_traceroute.py <目标主机> ... [选项]")
+    print("\n选项:")
+    print("  -f, --file <文件|->       从文件或标准输入读取目标（每行一个）")
+    print("  -c, --concurrency <数字>  同时运行的 traceroute 数 (默认: 32)")
+    print("  -m, --max-hops <数字>     最大跳数 (默认: 30)")
+    print("  -t, --timeout <秒数>      超时时间 (默认: 2)")
+    print("  -h, --help                显示此帮助信息")
+    print("\n示例:")
+    print("  python async_traceroute.py www.baidu.com github.com 8.8.8.8")
+    print("  python async_traceroute.py -f hosts.txt -c 100")
+
+
+def main():
+    """主函数"""
+    if len(sys.argv) < 2:
+        print_usage()
+        sys.exit(1)
+
+    destinations = []
+    concurrency = 32
+    max_hops = 30
+    timeout = 2
+
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+
+        if arg in ['-h', '--help']:
+            print_usage()
+            sys.exit(0)
+        elif arg in ['-f', '--file']:
+            if i + 1 < len(sys.argv):
+                source = sys.argv[i + 1]
+                try:
+                    if source == '-':
+                        destinations.extend(read_destinations(sys.stdin))
+                    else:
+                        with open(source, encoding='utf-8') as stream:
+                            destinations.extend(read_destinations(stream))
+                except OSError as e:
+                    print(f"错误: 无法读取目标文件 '{source}': {e}")
+                    sys.exit(1)
+                i += 2
+            else:
+                print("错误: -f/--file 需要一个参数")
+                sys.exit(1)
+        elif arg in ['-c', '--concurrency']:
+            if i + 1 < len(sys.argv):
+                try:
+                    concurrency = int(sys.argv[i + 1])
+                    if concurrency < 1:
+                        raise ValueError
+                    i += 2
+                except ValueError:
+                    print(f"错误: 无效的并发数 '{sys.argv[i + 1]}'")
+                    sys.exit(1)
+            else:
+                print("错误: -c/--concurrency 需要一个参数")
+                sys.exit(1)
+        elif arg in ['-m', '--max-hops']:
+            if i + 1 < len(sys.argv):
+                try:
+                    max_hops = int(sys.argv[i + 1])
+                    if not 1 <= max_hops <= MAX_TTL:
+                        raise ValueError
+                    i += 2
+                except ValueError:
+                    print(f"错误: 无效的最大跳数值 '{sys.argv[i + 1]}' (1-{MAX_TTL})")
+                    sys.exit(1)
+            else:
+                print("错误: -m/--max-hops 需要一个参数")
+                sys.exit(1)
+        elif arg in ['-t', '--timeout']:
+            if i + 1 < len(sys.argv):
+                try:
+                    timeout = float(sys.argv[i + 1])
+                    i += 2
+                except ValueError:
+                    print(f"错误: 无效的超时值 '{sys.argv[i + 1]}'")
+                    sys.exit(1)
+            else:
+                print("错误: -t/--timeout 需要一个参数")
+                sys.exit(1)
+        elif arg.startswith('-'):
+            print(f"错误: 未知选项 '{arg}'")
+            print_usage()
+            sys.exit(1)
+        else:
+            destinations.append(arg)
+            i += 1
+
+    if not destinations:
+        print("错误: 未指定目标主机")
+        print_usage()
+        sys.exit(1)
+
+    def on_hop(destination, hop_num, entry):
+        if entry['ip']:
+            rtt_str = '  '.join('*' if r is None else f"{r} ms" for r in entry['rtts'][:3])
+            print(f"{destination:25s} {hop_num:2d}  {entry['ip']:15s}  {rtt_str}", flush=True)
+        else:
+            print(f"{destination:25s} {hop_num:2d}  *  *  *  (请求超时)", flush=True)
+
+    start = time.monotonic()
+    try:
+        results = run_traceroutes(destinations, concurrency=concurrency,
+                                  max_hops=max_hops, timeout=timeout, on_hop=on_hop)
+    except KeyboardInterrupt:
+        print("\n\n⚠️  用户中断操作")
+        sys.exit(0)
+
+    print()
+    print("=" * 80)
+    for destination, route_hops in results:
+        if isinstance(route_hops, FileNotFoundError):
+            print(f"❌ {destination}: 找不到系统 traceroute 命令")
+        elif isinstance(route_hops, Exception):
+            print(f"❌ {destination}: {route_hops}")
+        else:
+            print(f"✓ {destination}: {len(route_hops)} 跳")
+    print(f"📊 共 {len(destinations)} 个目标, 用时 {time.monotonic() - start:.2f} 秒")
+
+
+if __name__ == "__main__":
+    main()
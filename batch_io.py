@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Batch I/O - 批量收发探测包
+接收端使用预分配的缓冲池，每次唤醒后用 recvmsg_into 一次性读空套接字，
+通过 memoryview 访问数据，不为每个包分配新的 bytes；
+发送端按 TTL 分组连续发送，减少 setsockopt/select 等系统调用
+（Python 标准库没有 recvmmsg/sendmmsg，这是在其约束下的批量化）
+"""
+
+import select
+import socket
+import time
+
+
+class BatchReceiver:
+    """预分配缓冲池的批量接收器"""
+
+    def __init__(self, sock, slots=256, slot_size=2048, ancbufsize=0, flags=0):
+        """
+        初始化
+
+        Args:
+            sock: 接收套接字（会被设置为非阻塞）
+            slots: 缓冲池槽位数，即单次唤醒最多读取的包数
+            slot_size: 每个槽位字节数
+            ancbufsize: 辅助数据缓冲区大小（读取错误队列时需要）
+            flags: recvmsg 标志（如 MSG_ERRQUEUE）
+        """
+        self.sock = sock
+        self.slot_size = slot_size
+        self.ancbufsize = ancbufsize
+        self.flags = flags
+        self._pool = bytearray(slots * slot_size)
+        view = memoryview(self._pool)
+        self._slots = [view[i * slot_size:(i + 1) * slot_size] for i in range(slots)]
+        self.lengths = [0] * slots
+        self.addrs = [None] * slots
+        self.ancdata = [None] * slots
+        self.times = [0.0] * slots
+        sock.setblocking(False)
+
+    def drain(self):
+        """
+        非阻塞读取，直到套接字为空或缓冲池满
+
+        Returns:
+            本次读取的包数
+        """
+        sock = self.sock
+        slots = self._slots
+        # Windows 没有 recvmsg_into，退化为 recvfrom_into（无辅助数据）
+        has_recvmsg = hasattr(sock, 'recvmsg_into')
+        count = 0
+        errors = 0
+        while count < len(slots):
+            try:
+                if has_recvmsg:
+                    size, ancdata, _, addr = sock.recvmsg_into(
+                        [slots[count]], self.ancbufsize, self.flags)
+                else:
+                    size, addr = sock.recvfrom_into(slots[count])
+                    ancdata = None
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                # 数据报套接字上挂起的 ICMP 差错会使普通读取失败一次
+                errors += 1
+                if errors > len(slots):
+                    break
+                continue
+            self.lengths[count] = size
+            self.addrs[count] = addr
+            self.ancdata[count] = ancdata
+            self.times[count] = time.monotonic()
+            count += 1
+        return count
+
+    def wait(self, timeout):
+        """
+        等待可读并读取一批
+
+        Returns:
+            读取的包数，超时返回 0
+        """
+        ready, _, _ = select.select([self.sock], [], [], max(0.0, timeout))
+        if not ready:
+            return 0
+        return self.drain()
+
+    def packets(self, count):
+        """
+        遍历最近一次读取的包
+
+        Yields:
+            (memoryview 数据, 地址, 接收时间)；memoryview 在下一次 drain 前有效
+        """
+        for i in range(count):
+            yield self._slots[i][:self.lengths[i]], self.addrs[i], self.times[i]
+
+
+class BatchSender:
+    """按 TTL 分组的批量发送器"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._ttl = None
+
+    def set_ttl(self, ttl):
+        if ttl != self._ttl:
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+            self._ttl = ttl
+
+    def send_all(self, probes):
+        """
+        连续发送一批探测包
+
+        Args:
+            probes: (ttl, packet, addr, key) 列表
+
+        Returns:
+            {key: 发送时间}，发送失败的探测不在其中
+        """
+        sent = {}
+        sendto = self.sock.sendto
+        for ttl, packet, addr, key in sorted(probes, key=lambda p: p[0]):
+            self.set_ttl(ttl)
+            try:
+                sendto(packet, addr)
+            except (BlockingIOError, InterruptedError):
+                # 发送缓冲区满，等待可写后重试一次
+                select.select([], [self.sock], [], 0.1)
+                try:
+                    sendto(packet, addr)
+                except OSError:
+                    continue
+            except OSError:
+                continue
+            sent[key] = time.monotonic()
+        return sent
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+CLI 启动时间基准测试
+多次运行 trace.py / traceroute.py 的帮助命令，测量相对于空解释器的启动开销，
+超过预算时返回非零退出码（可用于 CI 防止启动时间回退）
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# 被测命令: (名称, 参数)
+COMMANDS = [
+    ('trace.py -h', [os.path.join(HERE, 'trace.py'), '-h']),
+    ('traceroute.py -h', [os.path.join(HERE, 'traceroute.py'), '-h']),
+    ('import trace', ['-c', 'import trace']),
+]
+
+
+def measure(args, runs):
+    """
+    多次运行并返回耗时中位数（毫秒）
+
+    Args:
+        args: 传给 Python 解释器的参数
+        runs: 运行次数
+    """
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=HERE,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def main():
+    """主函数"""
+    runs = 20
+    budget = 30.0
+
+    args = sys.argv[1:]
+    for i, arg in enumerate(args):
+        if arg in ['-n', '--runs'] and i + 1 < len(args):
+            runs = int(args[i + 1])
+        elif arg in ['-b', '--budget'] and i + 1 < len(args):
+            budget = float(args[i + 1])
+        elif arg in ['-h', '--help']:
+            print("用法: python bench_startup.py [-n 运行次数] [-b 启动开销预算ms]")
+            sys.exit(0)
+
+    baseline = measure(['-c', 'pass'], runs)
+    print(f"空解释器: {baseline:.1f} ms (中位数, {runs} 次)")
+    print("=" * 60)
+
+    over_budget = False
+    for name, cmd in COMMANDS:
+        elapsed = measure(cmd, runs)
+        overhead = elapsed - baseline
+        status = "✓" if overhead <= budget else "✗ 超出预算"
+        if overhead > budget:
+            over_budget = True
+        print(f"{name:20s} {elapsed:7.1f} ms  开销 {overhead:6.1f} ms  {status}")
+
+    print("=" * 60)
+    print(f"预算: {budget:.1f} ms")
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Deadline - 限时追踪
+为一次追踪设定总时限：按剩余时间把探测预算分摊到剩余的跳上
+（必要时减少每跳查询次数、缩短单次超时），时间用完时返回已得到的
+结构化部分结果，并标记每一跳是否完整
+"""
+
+import socket
+import threading
+import time
+
+
+class TraceBudget:
+    """追踪时间预算"""
+
+    def __init__(self, deadline, timeout, queries=3, min_timeout=0.1):
+        """
+        初始化
+
+        Args:
+            deadline: 总时限（秒）
+            timeout: 单次查询的正常超时时间（秒）
+            queries: 每跳的正常查询次数
+            min_timeout: 分摊后单次查询超时的下限（秒）
+        """
+        self.deadline = deadline
+        self.timeout = timeout
+        self.queries = queries
+        self.min_timeout = min_timeout
+        self.started = time.monotonic()
+        self.expires = self.started + deadline
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def share(self, parts):
+        """
+        将剩余时间平均分成 parts 份后每份的超时时间
+
+        Returns:
+            不超过正常超时和剩余时间的超时值（秒），时间用完返回 0
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            return 0.0
+        value = max(remaining / max(1, parts), self.min_timeout)
+        return min(self.timeout, value, remaining)
+
+    def plan_hop(self, hops_left):
+        """
+        为下一跳分配查询次数和单次超时
+
+        Args:
+            hops_left: 包括本跳在内还可能探测的跳数
+
+        Returns:
+            (查询次数, 单次超时秒数)，时间已用完返回 None
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            return None
+        per_hop = remaining / max(1, hops_left)
+        queries = self.queries
+        if per_hop < queries * self.min_timeout:
+            queries = max(1, int(per_hop / self.min_timeout))
+        return queries, self.share(hops_left * queries)
+
+
+def resolve(hostname, budget):
+    """
+    在剩余时限内解析主机名
+
+    gethostbyname 本身没有超时，放到后台线程中执行，时间用完时不再等待
+    （线程在解析结束后自行退出）
+
+    Args:
+        hostname: 目标主机名或 IP 地址
+        budget: TraceBudget
+
+    Returns:
+        IP 地址；解析失败或超过时限返回 None
+    """
+    answer = []
+
+    def lookup():
+        try:
+            answer.append(socket.gethostbyname(hostname))
+        except (socket.gaierror, UnicodeError):
+            pass
+
+    thread = threading.Thread(target=lookup, daemon=True)
+    thread.start()
+    thread.join(budget.remaining())
+    return answer[0] if answer else None
+
+
+class PartialTrace:
+    """限时追踪的结果（可能不完整）"""
+
+    def __init__(self, destination, dest_ip=None, deadline=None):
+        """
+        初始化
+
+        Args:
+            destination: 目标主机
+            dest_ip: 解析后的目标 IP
+            deadline: 总时限（秒）
+        """
+        self.destination = destination
+        self.dest_ip = dest_ip
+        self.deadline = deadline
+        self.hops = []          # HopRecord 列表，按跳数排序
+        self.complete = {}      # 跳数 -> 是否以完整的查询次数和超时完成
+        self.reached = False    # 是否到达目标
+        self.expired = False    # 是否因时限用完而提前结束
+        self.elapsed = 0.0
+        self.tcp = None         # 目标 TCP 检测结果 (是否可达, 响应时间ms, 状态描述)
+        self.error = None       # 中途无法继续探测时的错误描述
+
+    def add(self, hop, complete):
+        """
+        添加一跳
+
+        Args:
+            hop: HopRecord
+            complete: 该跳是否完整
+        """
+        self.hops.append(hop)
+        self.complete[hop.hop] = complete
+
+    @property
+    def incomplete_hops(self):
+        return [hop.hop for hop in self.hops if not self.complete.get(hop.hop)]
+
+    def to_dict(self):
+        """导出为可 JSON 序列化的字典"""
+        hops = []
+        for hop in self.hops:
+            hops.append({
+                'hop': hop.hop,
+                'ip': hop.ip,
+                'rtts': [None if r != r else round(r, 3) for r in hop.rtts],
+                'tcp_status': hop.tcp_status,
+                'tcp_rtt': hop.tcp_rtt,
+                'complete': self.complete.get(hop.hop, False),
+            })
+        return {
+            'destination': self.destination,
+            'dest_ip': self.dest_ip,
+            'deadline': self.deadline,
+            'elapsed': round(self.elapsed, 3),
+            'reached': self.reached,
+            'expired': self.expired,
+            'error': self.error,
+            'hops': hops,
+            'tcp': self._tcp_dict(),
+        }
+
+    def _tcp_dict(self):
+        if self.tcp is None:
+            return None
+        reachable, rtt, status = self.tcp
+        return {
+            'reachable': reachable,
+            'rtt': None if rtt is None else round(rtt, 3),
+            'status': status,
+        }
+
+
+def format_partial(result):
+    """
+    格式化限时追踪结果
+
+    Returns:
+        多行文本
+    """
+    lines = [f"限时追踪 {result.destination} ({result.dest_ip or '未解析'}), "
+             f"时限 {result.deadline:g} 秒, 用时 {result.elapsed:.2f} 秒", ""]
+    for hop in result.hops:
+        mark = '' if result.complete.get(hop.hop) else '  (不完整)'
+        if hop.ip:
+            rtt_str = '  '.join(f"{r:.2f} ms" if r == r else '*' for r in hop.rtts)
+            lines.append(f"{hop.hop:2d}  {hop.ip:15s}  {rtt_str}{mark}")
+        else:
+            lines.append(f"{hop.hop:2d}  *  *  *{mark}")
+    lines.append("")
+    if result.error:
+        lines.append(f"错误: {result.error}")
+    if result.reached:
+        lines.append(f"到达目标: {result.destination} ({result.dest_ip})")
+    elif result.dest_ip is None:
+        lines.append("⏱️  时限已到，域名解析未完成" if result.expired else "无法解析目标主机名")
+    elif result.expired:
+        lines.append(f"⏱️  时限已到，已探测 {len(result.hops)} 跳（部分结果）")
+    else:
+        lines.append("未能到达目标")
+    if result.tcp is not None:
+        reachable, rtt, status = result.tcp
+        detail = f" {rtt:.2f} ms" if reachable and rtt is not None else ''
+        lines.append(f"目标 TCP 端口: {status}{detail}")
+    return '\n'.join(lines)
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""
+Doubletree - 多目标追踪的冗余消除
+从同一台主机追踪大量目标时，前几跳（网关、机房核心、上游边缘）对所有目标都相同。
+每次追踪从路径中段（起始 TTL）开始：
+  - 向前探测直到目标，遇到该目标此前已发现的接口时停止
+  - 向后探测直到遇到已从本机发现过的 (接口, TTL)，其前缀直接复用已知路径
+共享的已发现集合使整批追踪的探测次数大幅减少，而拓扑信息不丢失
+"""
+
+import socket
+import sys
+import time
+
+from trace_store import HopRecord, TraceStore
+from traceroute import MAX_TTL
+
+
+class RawHopProber:
+    """原始 ICMP 逐跳探测（需要 root）"""
+
+    def __init__(self, timeout=2, queries=3):
+        self.timeout = timeout
+        self.queries = queries
+        self.probes = 0
+        self._tracers = {}
+
+    def probe_hop(self, dest_ip, ttl):
+        """
+        探测某个 TTL
+
+        Returns:
+            (HopRecord, 是否到达目标)
+        """
+        from traceroute import Traceroute, probe_sequence
+
+        tracer = self._tracers.get(dest_ip)
+        if tracer is None:
+            tracer = self._tracers[dest_ip] = Traceroute(dest_ip, timeout=self.timeout,
+                                                         queries=self.queries)
+            tracer.dest_ip = dest_ip
+        rtts = []
+        hop_ip = None
+        reached = False
+        for query in range(self.queries):
+            rtt, ip, is_destination = tracer.send_probe(ttl, probe_sequence(ttl, query))
+            self.probes += 1
+            rtts.append(rtt if ip else None)
+            if ip and hop_ip is None:
+                hop_ip = ip
+            reached = reached or is_destination
+        return HopRecord(ttl, hop_ip, rtts if hop_ip else []), reached
+
+
+class SystemHopProber:
+    """系统 traceroute 逐跳探测（-f/-m 指定单个 TTL，无需权限，不支持 Windows tracert）"""
+
+    def __init__(self, timeout=2, queries=3):
+        if sys.platform.startswith('win'):
+            raise ValueError("tracert 不支持指定起始跳数，请使用原始套接字探测")
+        from trace import TracerouteNoAdmin
+        self.timeout = timeout
+        self.queries = queries
+        self.probes = 0
+        self._parser = TracerouteNoAdmin('', enable_tcp_check=False)
+
+    def probe_hop(self, dest_ip, ttl):
+        import subprocess
+
+        cmd = ['traceroute', '-n', '-f', str(ttl), '-m', str(ttl),
+               '-q', str(self.queries), '-w', f"{self.timeout:g}", dest_ip]
+        output = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                text=True, errors='ignore').stdout
+        self.probes += self.queries
+        for line in output.splitlines():
+            parsed = self._parser.parse_traceroute_line(line)
+            if not parsed or parsed[0] != ttl:
+                continue
+            _, ips, rtts = parsed
+            ip = ips[0] if ips else None
+            values = []
+            for rtt in rtts:
+                try:
+                    values.append(float(rtt))
+                except (TypeError, ValueError):
+                    values.append(None)
+            return HopRecord(ttl, ip, values if ip else []), ip == dest_ip
+        return HopRecord(ttl), False
+
+
+class SimulatedHopProber:
+    """基于 replay.SyntheticTopology 的模拟探测，用于评估节省的探测次数"""
+
+    def __init__(self, topology, queries=3):
+        self.topology = topology
+        self.queries = queries
+        self.probes = 0
+        self._paths = {entry[0]: entry for entry in topology.paths}
+
+    @property
+    def destinations(self):
+        return list(self._paths)
+
+    def probe_hop(self, dest_ip, ttl):
+        self.probes += self.queries
+        _, path, base, silent_hops = self._paths[dest_ip]
+        index = min(ttl, len(path)) - 1
+        if index in silent_hops:
+            return HopRecord(ttl), False
+        ip = path[index]
+        return HopRecord(ttl, ip, [base[index]] * self.queries), ip == dest_ip
+
+
+class DoubletreeTrace:
+    """一个目标的追踪结果"""
+
+    def __init__(self, destination, dest_ip):
+        self.destination = destination
+        self.dest_ip = dest_ip
+        self.hops = []          # HopRecord 列表（跳数 1..N）
+        self.inferred = set()   # 复用已知前缀/后缀、未实际探测的跳数
+        self.reached = False
+        self.start_ttl = None
+        self.probes = 0
+
+
+class DoubletreeSweep:
+    """共享已发现集合的多目标追踪"""
+
+    def __init__(self, prober, start_ttl=8, max_hops=30, gap_limit=5):
+        """
+        初始化
+
+        Args:
+            prober: 逐跳探测器（RawHopProber / SystemHopProber / SimulatedHopProber）
+            start_ttl: 每次追踪的起始 TTL（路径中段）
+            max_hops: 最大跳数
+            gap_limit: 向前探测时连续多少跳无响应后停止
+
+        Raises:
+            ValueError: 起始 TTL 或最大跳数超出范围 (1-255)
+        """
+        if not 1 <= max_hops <= MAX_TTL:
+            raise ValueError(f"最大跳数 {max_hops} 超出范围 (1-{MAX_TTL})")
+        if not 1 <= start_ttl <= MAX_TTL:
+            raise ValueError(f"起始 TTL {start_ttl} 超出范围 (1-{MAX_TTL})")
+        self.prober = prober
+        self.start_ttl = start_ttl
+        self.max_hops = max_hops
+        self.gap_limit = gap_limit
+        self.local_stop = {}    # (接口, TTL) -> 首次发现它的路径（HopRecord 列表）
+        self.global_stop = {}   # (接口, 目标) -> 该目标上次的路径
+        self.traces = 0
+        self.full_probes = 0    # 不做冗余消除时需要的探测次数（按探测到的路径长度估算）
+
+    def trace(self, destination):
+        """
+        追踪一个目标
+
+        Returns:
+            DoubletreeTrace，目标无法解析时 dest_ip 为 None
+        """
+        try:
+            dest_ip = socket.gethostbyname(destination)
+        except socket.gaierror:
+            return DoubletreeTrace(destination, None)
+
+        result = DoubletreeTrace(destination, dest_ip)
+        probes_before = self.prober.probes
+        hops = {}
+        dest_ttl = None
+        start = min(self.start_ttl, self.max_hops)
+        result.start_ttl = start
+
+        # 向前：从起始 TTL 开始直到目标
+        suffix = None
+        gap = 0
+        for ttl in range(start, self.max_hops + 1):
+            hop, reached = self.prober.probe_hop(dest_ip, ttl)
+            hops[ttl] = hop
+            if reached:
+                dest_ttl = ttl
+                break
+            if hop.ip:
+                gap = 0
+                previous = self.global_stop.get((hop.ip, dest_ip))
+                if previous is not None and ttl <= len(previous) and \
+                        previous[ttl - 1].ip == hop.ip:
+                    # 此后的路径与该目标上次的结果相同
+                    suffix = previous[ttl:]
+                    break
+            else:
+                gap += 1
+                if gap >= self.gap_limit:
+                    break
+
+        # 向后：直到遇到已发现的 (接口, TTL)
+        prefix = None
+        for ttl in range(start - 1, 0, -1):
+            hop, reached = self.prober.probe_hop(dest_ip, ttl)
+            if reached:
+                # 目标比起始 TTL 更近
+                dest_ttl = ttl
+                hops[ttl] = hop
+                continue
+            hops[ttl] = hop
+            if hop.ip:
+                known = self.local_stop.get((hop.ip, ttl))
+                if known is not None:
+                    prefix = known[:ttl - 1]
+                    break
+
+        # 拼接完整路径
+        path = []
+        if prefix is not None:
+            for hop in prefix:
+                path.append(hop)
+                result.inferred.add(hop.hop)
+        last = dest_ttl if dest_ttl is not None else max(hops)
+        for ttl in range(len(path) + 1, last + 1):
+            path.append(hops.get(ttl) or HopRecord(ttl))
+        if suffix is not None and dest_ttl is None:
+            for hop in suffix:
+                path.append(hop)
+                result.inferred.add(hop.hop)
+            result.reached = bool(path) and path[-1].ip == dest_ip
+        else:
+            result.reached = dest_ttl is not None
+        result.hops = path
+
+        # 登记已发现的接口
+        for hop in path:
+            if hop.ip:
+                self.local_stop.setdefault((hop.ip, hop.hop), path)
+                self.global_stop[(hop.ip, dest_ip)] = path
+
+        result.probes = self.prober.probes - probes_before
+        self.full_probes += len(path) * self.prober.queries
+        self.traces += 1
+        return result
+
+    def sweep(self, destinations, callback=None):
+        """
+        依次追踪多个目标
+
+        Args:
+            destinations: 目标列表
+            callback: 每个结果的回调（可选）
+
+        Returns:
+            DoubletreeTrace 列表
+        """
+        results = []
+        for destination in destinations:
+            result = self.trace(destination)
+            if callback:
+                callback(result)
+            results.append(result)
+        return results
+
+    def summary(self):
+        saved = 1 - self.prober.probes / self.full_probes if self.full_probes else 0.0
+        return (f"{self.traces} 个目标, 实际探测 {self.prober.probes} 次, "
+                f"逐跳完整追踪约需 {self.full_probes} 次, 节省 {saved:.0%}")
+
+
+def print_trace(result):
+    """打印一个目标的追踪结果"""
+    if result.dest_ip is None:
+        print(f"\n{result.destination}: 无法解析")
+        return
+    print(f"\n{result.destination} ({result.dest_ip})  起始 TTL {result.start_ttl}, "
+          f"探测 {result.probes} 次")
+    for hop in result.hops:
+        mark = '  (已知)' if hop.hop in result.inferred else ''
+        if hop.ip:
+            rtt_str = '  '.join(f"{r:.2f} ms" if r == r else '*' for r in hop.rtts)
+            print(f"{hop.hop:2d}  {hop.ip:15s}  {rtt_str}{mark}")
+        else:
+            print(f"{hop.hop:2d}  *  *  *{mark}")
+    if not result.reached:
+        print("未能到达目标")
+
+
+def print_usage():
+    """打印使用说明"""
+    print("用法: python doubletree.py <目标1> [目标2 ...] [选项]")
+    print("\n选项:")
+    print("  -f, --file <文件>        从文件读取目标（每行一个）")
+    print("  -s, --start <TTL>        起始 TTL (默认: 8)")
+    print("  -m, --max-hops <数字>    最大跳数 (默认: 30)")
+    print("  -t, --timeout <秒数>     超时时间 (默认: 2)")
+    print("  -q, --queries <数字>     每跳查询次数 (默认: 3)")
+    print("  --system                 使用系统 traceroute（无需 root）")
+    print("  --store <目录>           将结果追加写入历史存储目录")
+    print("  --simulate <目标数>      在合成拓扑上模拟，只统计探测次数")
+    print("  -h, --help               显示此帮助信息")
+    print("\n示例:")
+    print("  sudo python doubletree.py -f targets.txt")
+    print("  python doubletree.py -f targets.txt --system -q 1")
+    print("  python doubletree.py --simulate 1000")
+
+
+def main():
+    """主函数"""
+    if len(sys.argv) < 2:
+        print_usage()
+        sys.exit(1)
+
+    destinations = []
+    start_ttl = 8
+    max_hops = 30
+    timeout = 2
+    queries = 3
+    use_system = False
+    store_path = None
+    simulate = None
+
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+        if arg in ['-h', '--help']:
+            print_usage()
+            sys.exit(0)
+        elif arg == '--system':
+            use_system = True
+            i += 1
+        elif arg in ['-f', '--file', '--store']:
+            if i + 1 >= len(sys.argv):
+                print(f"错误: {arg} 需要一个参数")
+                sys.exit(1)
+            if arg == '--store':
+                store_path = sys.argv[i + 1]
+            else:
+                with open(sys.argv[i + 1], encoding='utf-8') as f:
+                    destinations.extend(line.strip() for line in f
+                                        if line.strip() and not line.startswith('#'))
+            i += 2
+        elif arg in ['-s', '--start', '-m', '--max-hops', '-q', '--queries',
+                     '--simulate', '-t', '--timeout']:
+            if i + 1 >= len(sys.argv):
+                print(f"错误: {arg} 需要一个参数")
+                sys.exit(1)
+            try:
+                if arg in ['-t', '--timeout']:
+                    timeout = float(sys.argv[i + 1])
+                else:
+                    value = int(sys.argv[i + 1])
+                    if value < 1:
+                        raise ValueError
+                    if arg in ['-s', '--start', '-m', '--max-hops'] and value > MAX_TTL:
+                        print(f"错误: 无效的参数值 '{value}' (1-{MAX_TTL})")
+                        sys.exit(1)
+                    if arg in ['-s', '--start']:
+                        start_ttl = value
+                    elif arg in ['-m', '--max-hops']:
+                        max_hops = value
+                    elif arg in ['-q', '--queries']:
+                        queries = value
+                    else:
+                        simulate = value
+            except ValueError:
+                print(f"错误: 无效的参数值 '{sys.argv[i + 1]}'")
+                sys.exit(1)
+            i += 2
+        elif arg.startswith('-'):
+            print(f"错误: 未知选项 '{arg}'")
+            print_usage()
+            sys.exit(1)
+        else:
+            destinations.append(arg)
+            i += 1
+
+    if simulate is not None:
+        from replay import SyntheticTopology
+        prober = SimulatedHopProber(SyntheticTopology(simulate, silent=0.0), queries)
+        sweep = DoubletreeSweep(prober, start_ttl=start_ttl, max_hops=max_hops)
+        start = time.perf_counter()
+        sweep.sweep(prober.destinations)
+        print(sweep.summary())
+        print(f"用时 {time.perf_counter() - start:.2f} 秒")
+        return
+
+    if not destinations:
+        print("错误: 未指定目标主机")
+        sys.exit(1)
+
+    try:
+        prober = (SystemHopProber(timeout, queries) if use_system
+                  else RawHopProber(timeout, queries))
+    except ValueError as e:
+        print(f"错误: {e}")
+        sys.exit(1)
+
+    sweep = DoubletreeSweep(prober, start_ttl=start_ttl, max_hops=max_hops)
+    store = TraceStore(store_path) if store_path else None
+    try:
+        for result in sweep.sweep(destinations, callback=print_trace):
+            if store is not None and result.dest_ip:
+                store.append(result.dest_ip, result.hops)
+    except KeyboardInterrupt:
+        print("\n\n中断: 用户取消操作")
+        sys.exit(0)
+    finally:
+        if store is not None:
+            store.close()
+
+    print()
+    print(sweep.summary())
+    if store_path:
+        print(f"💾 结果已保存到: {store_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+"""
+ICMP Session - 多路复用的 ICMP 探测会话
+整个进程共用一个原始 ICMP 接收套接字和一个监听线程：每个追踪会话分配
+唯一的 ICMP 标识符，监听线程批量读取响应后按标识符分发给所属会话
+（同步会话使用 SimpleQueue，asyncio 会话使用 Future），
+数百个并发追踪也只需要一个接收套接字，响应不会串到别的追踪上（需要 root 权限）
+"""
+
+import asyncio
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+
+from batch_io import BatchReceiver
+from trace_store import HopRecord
+from traceroute import MAX_QUERIES, MAX_TTL, Traceroute, probe_sequence
+
+
+class IcmpListener:
+    """进程级 ICMP 监听器"""
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self):
+        """
+        初始化：创建共享的收发套接字并启动监听线程
+
+        Raises:
+            PermissionError: 没有创建原始套接字的权限
+        """
+        self.recv_socket = socket.socket(socket.AF_INET, socket.SOCK_RAW,
+                                         socket.IPPROTO_ICMP)
+        self.send_socket = socket.socket(socket.AF_INET, socket.SOCK_RAW,
+                                         socket.IPPROTO_ICMP)
+        # 数百个会话同时发出探测时响应会成批到达，加大接收缓冲区避免丢包
+        try:
+            self.recv_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        except OSError:
+            pass
+        self.sessions = {}        # 标识符 -> 会话
+        self.received = 0         # 分发给会话的响应数
+        self.dropped = 0          # 不属于任何会话的响应数
+        self._parser = Traceroute('')
+        self._receiver = BatchReceiver(self.recv_socket)
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._ttl = None
+        self._next_id = os.getpid() & 0xFFFF
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='icmp-listener',
+                                        daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def shared(cls):
+        """获取（必要时创建）进程共享的监听器"""
+        with cls._shared_lock:
+            if cls._shared is None or cls._shared._closed:
+                cls._shared = cls()
+            return cls._shared
+
+    def register(self, session):
+        """
+        为会话分配唯一的 ICMP 标识符
+
+        Raises:
+            RuntimeError: 65536 个标识符均已占用
+        """
+        with self._lock:
+            for _ in range(0x10000):
+                identifier = self._next_id
+                self._next_id = (self._next_id + 1) & 0xFFFF
+                if identifier not in self.sessions:
+                    self.sessions[identifier] = session
+                    return identifier
+        raise RuntimeError("ICMP 标识符已用尽")
+
+    def unregister(self, identifier):
+        with self._lock:
+            self.sessions.pop(identifier, None)
+
+    def send(self, packet, dest_ip, ttl):
+        """
+        用共享套接字发送探测包
+
+        Returns:
+            发送时间（time.monotonic），发送失败返回 None
+        """
+        # 设置 TTL 与发送必须原子完成，否则并发会话会互相改写 TTL
+        with self._send_lock:
+            try:
+                if ttl != self._ttl:
+                    self.send_socket.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+                    self._ttl = ttl
+                # 在发送前取时间：回环地址的响应可能在 sendto 返回前就已被监听线程收到
+                send_time = time.monotonic()
+                self.send_socket.sendto(packet, (dest_ip, 1))
+            except OSError:
+                return None
+            return send_time
+
+    def _run(self):
+        parse = self._parser.parse_icmp_response
+        sessions = self.sessions
+        while not self._closed:
+            try:
+                count = self._receiver.wait(0.5)
+            except (OSError, ValueError):
+                break
+            for data, addr, received in self._receiver.packets(count):
+                info = parse(data)
+                # 与 Traceroute.send_probe 一致，只处理 Echo Reply 和 Time Exceeded
+                if not info or info[0] not in (0, 11):
+                    continue
+                icmp_type, icmp_code, identifier, sequence, _ = info
+                session = sessions.get(identifier)
+                if session is None:
+                    self.dropped += 1
+                    continue
+                self.received += 1
+                session.deliver(icmp_type, sequence, addr[0], received)
+
+    def close(self):
+        """停止监听线程并关闭套接字"""
+        self._closed = True
+        self._thread.join(timeout=1)
+        self.recv_socket.close()
+        self.send_socket.close()
+
+
+def _probe_result(icmp_type, ip, send_time, recv_time):
+    """转换为 (响应时间ms, 响应IP, 是否到达目标)"""
+    return (recv_time - send_time) * 1000, ip, icmp_type == 0
+
+
+class IcmpSession:
+    """同步探测会话（可在线程中使用）"""
+
+    def __init__(self, listener=None):
+        """
+        初始化
+
+        Args:
+            listener: IcmpListener（默认使用进程共享的监听器）
+        """
+        self.listener = listener or IcmpListener.shared()
+        self.identifier = self.listener.register(self)
+        self._replies = queue.SimpleQueue()
+
+    def deliver(self, icmp_type, sequence, ip, recv_time):
+        """由监听线程调用"""
+        self._replies.put((icmp_type, sequence, ip, recv_time))
+
+    def probe(self, packet, dest_ip, ttl, sequence, timeout):
+        """
+        发送一个探测包并等待对应序列号的响应
+
+        Returns:
+            (响应时间ms, 响应IP, 是否到达目标) 或 (None, None, False)
+        """
+        send_time = self.listener.send(packet, dest_ip, ttl)
+        if send_time is None:
+            return None, None, False
+        deadline = send_time + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None, None, False
+            try:
+                icmp_type, reply_seq, ip, recv_time = self._replies.get(timeout=remaining)
+            except queue.Empty:
+                return None, None, False
+            # 之前已超时的探测迟到的响应直接丢弃
+            if reply_seq == sequence:
+                return _probe_result(icmp_type, ip, send_time, recv_time)
+
+    def close(self):
+        self.listener.unregister(self.identifier)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncIcmpSession:
+    """asyncio 探测会话"""
+
+    def __init__(self, listener=None, loop=None):
+        """
+        初始化
+
+        Args:
+            listener: IcmpListener（默认使用进程共享的监听器）
+            loop: 事件循环（默认为当前运行的循环）
+        """
+        self.listener = listener or IcmpListener.shared()
+        self.loop = loop or asyncio.get_running_loop()
+        self.identifier = self.listener.register(self)
+        self._pending = {}  # 序列号 -> (Future, 发送时间)
+        self._packer = Traceroute('')
+        self._packer.identifier = self.identifier
+
+    def deliver(self, icmp_type, sequence, ip, recv_time):
+        """由监听线程调用，转交给事件循环"""
+        try:
+            self.loop.call_soon_threadsafe(self._resolve, icmp_type, sequence, ip, recv_time)
+        except RuntimeError:
+            pass  # 事件循环已关闭
+
+    def _resolve(self, icmp_type, sequence, ip, recv_time):
+        pending = self._pending.pop(sequence, None)
+        if pending is None:
+            return
+        future, send_time = pending
+        if not future.done():
+            future.set_result(_probe_result(icmp_type, ip, send_time, recv_time))
+
+    async def probe(self, dest_ip, ttl, sequence, timeout):
+        """
+        发送一个探测包并等待响应
+
+        Returns:
+            (响应时间ms, 响应IP, 是否到达目标) 或 (None, None, False)
+        """
+        future = self.loop.create_future()
+        packet = self._packer.create_icmp_packet(sequence)
+        send_time = self.listener.send(packet, dest_ip, ttl)
+        if send_time is None:
+            return None, None, False
+        self._pending[sequence] = (future, send_time)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None, None, False
+        finally:
+            self._pending.pop(sequence, None)
+
+    async def trace(self, dest_ip, max_hops=30, timeout=2, queries=3):
+        """
+        追踪到 dest_ip 的路径（每跳的查询并行发出）
+
+        Returns:
+            HopRecord 列表
+
+        Raises:
+            ValueError: 跳数或查询次数超出序列号能表示的范围
+        """
+        if not 1 <= max_hops <= MAX_TTL:
+            raise ValueError(f"最大跳数 {max_hops} 超出范围 (1-{MAX_TTL})")
+        if not 1 <= queries <= MAX_QUERIES:
+            raise ValueError(f"查询次数 {queries} 超出范围 (1-{MAX_QUERIES})")
+        hops = []
+        for ttl in range(1, max_hops + 1):
+            results = await asyncio.gather(*[
+                self.probe(dest_ip, ttl, probe_sequence(ttl, query), timeout)
+                for query in range(queries)])
+            hop_ip = next((ip for _, ip, _ in results if ip), None)
+            rtts = [rtt if ip else None for rtt, ip, _ in results]
+            hops.append(HopRecord(ttl, hop_ip, rtts if hop_ip else []))
+            if any(reached for _, ip, reached in results if ip):
+                break
+        return hops
+
+    def close(self):
+        self.listener.unregister(self.identifier)
+
+
+class SessionTraceroute(Traceroute):
+    """通过共享监听器收发的 Traceroute，可在多个线程中同时运行"""
+
+    def __init__(self, destination, max_hops=30, timeout=2, queries=3, session=None):
+        """
+        初始化
+
+        Args:
+            destination: 目标主机名或IP地址
+            max_hops: 最大跳数
+            timeout: 每次查询超时时间（秒）
+            queries: 每一跳的查询次数
+            session: IcmpSession（默认新建）
+        """
+        super().__init__(destination, max_hops=max_hops, timeout=timeout, queries=queries)
+        self.session = session or IcmpSession()
+        self.identifier = self.session.identifier
+
+    def send_probe(self, ttl, sequence, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        packet = self.create_icmp_packet(sequence)
+        return self.session.probe(packet, self.dest_ip, ttl, sequence, timeout)
+
+    def close(self):
+        self.session.close()
+
+
+def trace_many(destinations, max_hops=30, timeout=2, queries=3, concurrency=64):
+    """
+    用线程池并发追踪多个目标，共用一个接收套接字
+
+    Returns:
+        {目标: deadline.PartialTrace}
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    # 不限时：时限取最坏情况下的总耗时
+    deadline = max_hops * queries * timeout + 5
+
+    def run(destination):
+        tracer = SessionTraceroute(destination, max_hops=max_hops,
+                                   timeout=timeout, queries=queries)
+        try:
+            return tracer.trace_deadline(deadline)
+        finally:
+            tracer.close()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return dict(zip(destinations, executor.map(run, destinations)))
+
+
+async def async_trace_many(destinations, max_hops=30, timeout=2, queries=3,
+                           concurrency=256):
+    """
+    用 asyncio 并发追踪多个目标，共用一个接收套接字
+
+    Returns:
+        {目标: HopRecord 列表}（无法解析的目标为空列表）
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(destination):
+        async with semaphore:
+            try:
+                infos = await loop.getaddrinfo(destination, None, family=socket.AF_INET)
+            except socket.gaierror:
+                return []
+            session = AsyncIcmpSession()
+            try:
+                return await session.trace(infos[0][4][0], max_hops, timeout, queries)
+            finally:
+                session.close()
+
+    results = await asyncio.gather(*[run(d) for d in destinations])
+    return dict(zip(destinations, results))
+
+
+def print_usage():
+    """打印使用说明"""
+    print("用法: python icmp_session.py <目标1> [目标2 ...] [选项]")
+    print("\n选项:")
+    print("  -m, --max-hops <数字>    最大跳数 (默认: 30, 最大 255)")
+    print("  -t, --timeout <秒数>     超时时间 (默认: 2)")
+    print("  -q, --queries <数字>     每跳查询次数 (默认: 3, 最大 256)")
+    print("  -c, --concurrency <数字> 并发追踪数 (默认: 64)")
+    print("  -f, --file <文件>        从文件读取目标（每行一个）")
+    print("  --async                  使用 asyncio 而不是线程")
+    print("  -h, --help               显示此帮助信息")
+    print("\n说明:")
+    print("  所有追踪共用一个 ICMP 接收套接字，需要 root/管理员权限")
+    print("\n示例:")
+    print("  sudo python icmp_session.py 8.8.8.8 1.1.1.1 www.baidu.com")
+    print("  sudo python icmp_session.py -f targets.txt -c 200 --async")
+
+
+def main():
+    """主函数"""
+    if len(sys.argv) < 2:
+        print_usage()
+        sys.exit(1)
+
+    destinations = []
+    max_hops = 30
+    timeout = 2
+    queries = 3
+    concurrency = 64
+    use_async = False
+
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+        if arg in ['-h', '--help']:
+            print_usage()
+            sys.exit(0)
+        elif arg == '--async':
+            use_async = True
+            i += 1
+        elif arg in ['-f', '--file']:
+            if i + 1 >= len(sys.argv):
+                print(f"错误: {arg} 需要一个参数")
+                sys.exit(1)
+            with open(sys.argv[i + 1], encoding='utf-8') as f:
+                destinations.extend(line.strip() for line in f
+                                    if line.strip() and not line.startswith('#'))
+            i += 2
+        elif arg in ['-m', '--max-hops', '-q', '--queries', '-c', '--concurrency',
+                     '-t', '--timeout']:
+            if i + 1 >= len(sys.argv):
+                print(f"错误: {arg} 需要一个参数")
+                sys.exit(1)
+            try:
+                if arg in ['-t', '--timeout']:
+                    timeout = float(sys.argv[i + 1])
+                else:
+                    value = int(sys.argv[i + 1])
+                    if value < 1:
+                        raise ValueError
+                    if arg in ['-m', '--max-hops']:
+                        if value > MAX_TTL:
+                            raise ValueError
+                        max_hops = value
+                    elif arg in ['-q', '--queries']:
+                        if value > MAX_QUERIES:
+                            raise ValueError
+                        queries = value
+                    else:
+                        concurrency = value
+            except ValueError:
+                print(f"错误: 无效的参数值 '{sys.argv[i + 1]}'")
+                sys.exit(1)
+            i += 2
+        elif arg.startswith('-'):
+            print(f"错误: 未知选项 '{arg}'")
+            print_usage()
+            sys.exit(1)
+        else:
+            destinations.append(arg)
+            i += 1
+
+    if not destinations:
+        print("错误: 未指定目标主机")
+        sys.exit(1)
+
+    try:
+        listener = IcmpListener.shared()
+    except PermissionError:
+        print("错误: 需要管理员/root权限来创建原始套接字")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    try:
+        if use_async:
+            results = asyncio.run(async_trace_many(destinations, max_hops, timeout,
+                                                   queries, concurrency))
+            for destination, hops in results.items():
+                print(f"\n{destination}:")
+                for hop in hops:
+                    if hop.ip:
+                        rtt_str = '  '.join(f"{r:.2f} ms" if r == r else '*' for r in hop.rtts)
+                        print(f"{hop.hop:2d}  {hop.ip:15s}  {rtt_str}")
+                    else:
+                        print(f"{hop.hop:2d}  *  *  *")
+        else:
+            from deadline import format_partial
+            results = trace_many(destinations, max_hops, timeout, queries, concurrency)
+            for destination, result in results.items():
+                print()
+                print(format_partial(result))
+    except KeyboardInterrupt:
+        print("\n\n中断: 用户取消操作")
+        sys.exit(0)
+
+    print(f"\n{len(destinations)} 个目标, 用时 {time.perf_counter() - start:.2f} 秒, "
+          f"分发 {listener.received} 个响应, 丢弃 {listener.dropped} 个")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+Latency Anomaly - 逐跳时延异常检测
+为每个 (目标, 跳数) 维护流式统计：Welford 均值/方差、P² 分位数估计
+（中位数与 P95）以及丢包率，内存占用与样本数无关。
+实时标记 RTT 尖峰与连续丢包，并区分两类情况：
+  - 中间路由器对 ICMP 降低优先级（只在该跳出现，后续跳和目标正常）
+  - 真实劣化（从某一跳开始一直延续到目标）
+"""
+
+import math
+import sys
+import time
+
+from trace_store import TraceStore, hops_from_route_hops
+
+
+# 异常类型
+ANOMALY_LATENCY = 'latency'              # 延续到目标的时延尖峰
+ANOMALY_LATENCY_LOCAL = 'latency_local'  # 仅出现在中间跳的时延尖峰
+ANOMALY_LOSS = 'loss'                    # 延续到目标的连续丢包
+ANOMALY_LOSS_LOCAL = 'loss_local'        # 仅出现在中间跳的连续丢包
+
+ANOMALY_LABELS = {
+    ANOMALY_LATENCY: "时延劣化",
+    ANOMALY_LATENCY_LOCAL: "中间跳时延尖峰（ICMP 降级）",
+    ANOMALY_LOSS: "丢包劣化",
+    ANOMALY_LOSS_LOCAL: "中间跳连续丢包（ICMP 限速）",
+}
+
+
+class RunningStats:
+    """Welford 在线均值/方差"""
+
+    __slots__ = ('count', 'mean', 'm2')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def stddev(self):
+        return math.sqrt(self.variance)
+
+
+class P2Quantile:
+    """
+    P² 分位数估计（Jain & Chlamtac, 1985）
+
+    只保存 5 个标记点，按抛物线插值调整，内存与样本数无关
+    """
+
+    __slots__ = ('p', 'count', 'heights', 'positions', 'desired', 'increments')
+
+    def __init__(self, p):
+        """
+        初始化
+
+        Args:
+            p: 分位数（0~1，如 0.5 为中位数）
+        """
+        self.p = p
+        self.count = 0
+        self.heights = []
+        self.positions = [0, 1, 2, 3, 4]
+        self.desired = [0, 2 * p, 4 * p, 2 + 2 * p, 4]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, value):
+        self.count += 1
+        q = self.heights
+        if self.count <= 5:
+            q.append(value)
+            if self.count == 5:
+                q.sort()
+            return
+
+        # 找到所在区间并更新极值
+        if value < q[0]:
+            q[0] = value
+            k = 0
+        elif value >= q[4]:
+            q[4] = value
+            k = 3
+        else:
+            k = 0
+            while value >= q[k + 1]:
+                k += 1
+
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # 调整中间三个标记点
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def _parabolic(self, i, d):
+        q = self.heights
+        n = self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+            (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+    @property
+    def value(self):
+        """当前估计值，无样本时为 None"""
+        if self.count == 0:
+            return None
+        if self.count < 5:
+            ordered = sorted(self.heights)
+            return ordered[int(round((len(ordered) - 1) * self.p))]
+        return self.heights[2]
+
+
+class HopStats:
+    """单个 (目标, 跳数) 的流式统计"""
+
+    __slots__ = ('rtt', 'median', 'p95', 'loss', 'loss_run', 'loss_before',
+                 'loss_reported', 'samples')
+
+    def __init__(self):
+        self.rtt = RunningStats()
+        self.median = P2Quantile(0.5)
+        self.p95 = P2Quantile(0.95)
+        self.loss = None        # 丢包率的指数平滑值
+        self.loss_run = 0       # 连续出现丢包的追踪次数
+        self.loss_before = 0.0  # 本轮连续丢包开始前的平滑丢包率
+        self.loss_reported = False  # 本轮连续丢包已作为劣化起点报告过
+        self.samples = 0
+
+    def add_rtt(self, rtt):
+        self.rtt.add(rtt)
+        self.median.add(rtt)
+        self.p95.add(rtt)
+
+
+class AnomalyEvent:
+    """时延/丢包异常事件"""
+
+    __slots__ = ('kind', 'destination', 'hop', 'value', 'baseline', 'timestamp')
+
+    def __init__(self, kind, destination, hop, value, baseline, timestamp=None):
+        """
+        初始化
+
+        Args:
+            kind: 异常类型（ANOMALY_*）
+            destination: 目标
+            hop: 异常所在跳数（延续到目标时为起始跳）
+            value: 当前值（RTT 毫秒或丢包率）
+            baseline: 基线值（RTT 中位数或丢包前的平滑丢包率）
+            timestamp: 追踪时间戳
+        """
+        self.kind = kind
+        self.destination = destination
+        self.hop = hop
+        self.value = value
+        self.baseline = baseline
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return (f"AnomalyEvent({self.kind}, dest={self.destination!r}, "
+                f"hop={self.hop}, value={self.value!r}, baseline={self.baseline!r})")
+
+    def describe(self):
+        """返回可读的描述"""
+        label = ANOMALY_LABELS.get(self.kind, self.kind)
+        if self.kind in (ANOMALY_LATENCY, ANOMALY_LATENCY_LOCAL):
+            return (f"{label}: 第 {self.hop} 跳 {self.value:.1f}ms "
+                    f"(中位数 {self.baseline:.1f}ms)")
+        return (f"{label}: 第 {self.hop} 跳丢包率 {self.value:.0%} "
+                f"(此前 {self.baseline:.0%})")
+
+
+def _onset(flagged, responding):
+    """
+    从最后一个响应跳往前，找出连续异常的起始跳
+
+    Args:
+        flagged: 异常跳数集合
+        responding: 有响应的跳数列表（升序）
+
+    Returns:
+        起始跳数，最后一个响应跳无异常时返回 None
+    """
+    if not responding or responding[-1] not in flagged:
+        return None
+    onset = responding[-1]
+    for hop in reversed(responding[:-1]):
+        if hop not in flagged:
+            break
+        onset = hop
+    return onset
+
+
+class LatencyAnomalyDetector:
+    """逐跳时延/丢包异常检测引擎"""
+
+    def __init__(self, z_threshold=3.0, spike_min=5.0, min_samples=20,
+                 loss_threshold=0.5, loss_burst=3, smoothing=0.1, callback=None):
+        """
+        初始化
+
+        Args:
+            z_threshold: 时延尖峰的 z 分数阈值
+            spike_min: 时延尖峰高出中位数的最小值（毫秒）
+            min_samples: 开始检测前每跳需要的样本数
+            loss_threshold: 单次追踪判定为丢包的丢包率
+            loss_burst: 连续丢包多少次追踪视为丢包突发
+            smoothing: 丢包率的指数平滑系数
+            callback: 每个事件的回调函数（可选）
+        """
+        self.z_threshold = z_threshold
+        self.spike_min = spike_min
+        self.min_samples = min_samples
+        self.loss_threshold = loss_threshold
+        self.loss_burst = loss_burst
+        self.smoothing = smoothing
+        self.callback = callback
+        self.stats = {}  # (destination, hop) -> HopStats
+
+    def reset(self, destination=None):
+        """清除某个目标（或全部）的统计"""
+        if destination is None:
+            self.stats = {}
+        else:
+            for key in [k for k in self.stats if k[0] == destination]:
+                del self.stats[key]
+
+    def hop_stats(self, destination, hop):
+        """获取某一跳的统计，未出现过返回 None"""
+        return self.stats.get((destination, hop))
+
+    def process_route_hops(self, destination, route_hops, timestamp=None):
+        """处理 TracerouteNoAdmin.route_hops 格式的结果"""
+        return self.process(destination, hops_from_route_hops(route_hops), timestamp)
+
+    def process(self, destination, hops, timestamp=None):
+        """
+        处理一次追踪结果
+
+        Args:
+            destination: 目标
+            hops: 按跳数排序的 HopRecord 列表
+            timestamp: 追踪时间戳
+
+        Returns:
+            AnomalyEvent 列表
+        """
+        spikes = {}   # 跳数 -> (RTT, 中位数)
+        bursts = {}   # 跳数 -> (丢包率, 此前丢包率)
+        lossy = {}    # 本次丢包率超过阈值的跳，跳数 -> (丢包率, 此前丢包率)
+        responding = []
+
+        for hop in hops:
+            key = (destination, hop.hop)
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = HopStats()
+
+            valid = sorted(r for r in hop.rtts if r == r)
+            total = len(hop.rtts)
+            if hop.ip:
+                responding.append(hop.hop)
+                loss = (total - len(valid)) / total if total else 0.0
+            else:
+                loss = 1.0
+
+            # 连续丢包：本轮开始前该跳基本不丢包才算突发
+            if loss >= self.loss_threshold:
+                if stats.loss_run == 0:
+                    stats.loss_before = stats.loss if stats.loss is not None else 0.0
+                stats.loss_run += 1
+                lossy[hop.hop] = (loss, stats.loss_before)
+                if (stats.loss_run == self.loss_burst and
+                        stats.loss_before < self.loss_threshold and
+                        stats.samples >= self.min_samples):
+                    bursts[hop.hop] = (loss, stats.loss_before)
+            else:
+                stats.loss_run = 0
+                stats.loss_reported = False
+            if stats.loss is None:
+                stats.loss = loss
+            else:
+                stats.loss += self.smoothing * (loss - stats.loss)
+            stats.samples += 1
+
+            if not valid:
+                continue
+            rtt = valid[len(valid) // 2]
+
+            # 时延尖峰：同时超过 P95、z 分数阈值和绝对阈值
+            if stats.rtt.count >= self.min_samples:
+                median = stats.median.value
+                stddev = stats.rtt.stddev
+                if (rtt > stats.p95.value and rtt - median >= self.spike_min and
+                        stddev > 0 and (rtt - stats.rtt.mean) / stddev >= self.z_threshold):
+                    spikes[hop.hop] = (rtt, median)
+            stats.add_rtt(rtt)
+
+        events = []
+        events.extend(self._classify(destination, spikes, responding, timestamp,
+                                     ANOMALY_LATENCY, ANOMALY_LATENCY_LOCAL))
+        # 整跳超时的跳也可能是丢包起点，用全部跳参与判断
+        all_hops = [hop.hop for hop in hops]
+        for event in self._classify(destination, bursts, all_hops, timestamp,
+                                    ANOMALY_LOSS, ANOMALY_LOSS_LOCAL, lossy):
+            if event.kind == ANOMALY_LOSS:
+                # 下游各跳先后达到连续次数时，同一劣化只报告一次
+                stats = self.stats[(destination, event.hop)]
+                if stats.loss_reported:
+                    continue
+                stats.loss_reported = True
+            events.append(event)
+
+        if self.callback:
+            for event in events:
+                self.callback(event)
+        return events
+
+    def _classify(self, destination, flagged, hop_order, timestamp, real_kind, local_kind,
+                  degraded=None):
+        """
+        区分延续到目标的劣化与仅出现在中间跳的异常
+
+        Args:
+            flagged: {跳数: (当前值, 基线)} 本次触发异常的跳
+            hop_order: 参与判断的跳数列表（升序）
+            degraded: {跳数: (当前值, 基线)} 本次处于异常状态的跳（默认同 flagged）。
+                      连续丢包在各跳触发的时间可能相差一两次追踪，
+                      按当前状态判断异常是否延续到目标
+        """
+        if not flagged:
+            return []
+        if degraded is None:
+            degraded = flagged
+        events = []
+        onset = _onset(degraded, hop_order)
+        reported = False
+        for hop in sorted(flagged):
+            value, baseline = flagged[hop]
+            if onset is not None and hop >= onset:
+                if not reported:
+                    last_value, _ = degraded[hop_order[-1]]
+                    events.append(AnomalyEvent(real_kind, destination, onset,
+                                               last_value, degraded[onset][1], timestamp))
+                    reported = True
+                continue
+            events.append(AnomalyEvent(local_kind, destination, hop,
+                                       value, baseline, timestamp))
+        return events
+
+
+def detect_store_anomalies(store, destination=None, start=None, end=None,
+                           detector=None):
+    """
+    按时间顺序回放存储中的历史结果并检测异常
+
+    Args:
+        store: TraceStore
+        destination: 目标 IP（None 表示所有目标）
+        start: 起始时间戳
+        end: 结束时间戳
+        detector: LatencyAnomalyDetector（默认新建）
+
+    Returns:
+        AnomalyEvent 列表
+    """
+    if detector is None:
+        detector = LatencyAnomalyDetector()
+    events = []
+    for record in store.query(destination, start, end):
+        events.extend(detector.process(record.dest_ip, record.hops, record.timestamp))
+    return events
+
+
+def print_usage():
+    """打印使用说明"""
+    print("用法: python latency_anomaly.py <存储目录> [目标IP]")
+    print("\n说明:")
+    print("  回放 trace.py --store 保存的历史结果，输出逐跳时延/丢包异常，")
+    print("  并区分中间跳 ICMP 降级与延续到目标的真实劣化")
+    print("\n示例:")
+    print("  python latency_anomaly.py ./traces")
+    print("  python latency_anomaly.py ./traces 110.242.68.66")
+
+
+def main():
+    """主函数"""
+    if len(sys.argv) < 2 or sys.argv[1] in ['-h', '--help']:
+        print_usage()
+        sys.exit(0 if len(sys.argv) >= 2 else 1)
+
+    store = TraceStore(sys.argv[1])
+    destination = sys.argv[2] if len(sys.argv) > 2 else None
+
+    for event in detect_store_anomalies(store, destination):
+        when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(event.timestamp))
+        print(f"[{when}] {event.destination}  {event.describe()}")
+
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
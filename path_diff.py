@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Path Diff - 历史追踪路径变化检测
+对同一目标的连续追踪结果进行比较，将变化分类为：
+跳替换、新绕行、RTT 阶跃、新丢包点，并以事件形式输出
+每个目标只保留最近一条路径的索引，单次处理与历史长度无关
+"""
+
+import sys
+import time
+
+from trace_store import HOP_TIMEOUT, TraceStore, hops_from_route_hops
+
+
+# 变化类型
+CHANGE_HOP_REPLACED = 'hop_replaced'   # 某一跳的路由器被替换
+CHANGE_DETOUR = 'detour'               # 路径中出现长度不同的新路段
+CHANGE_RTT_STEP = 'rtt_step'           # 某一跳 RTT 阶跃上升
+CHANGE_LOSS = 'loss'                   # 出现新的丢包点
+
+CHANGE_LABELS = {
+    CHANGE_HOP_REPLACED: "跳替换",
+    CHANGE_DETOUR: "新绕行",
+    CHANGE_RTT_STEP: "RTT 阶跃",
+    CHANGE_LOSS: "新丢包点",
+}
+
+
+class ChangeEvent:
+    """路径变化事件"""
+
+    __slots__ = ('kind', 'destination', 'hop', 'old', 'new', 'timestamp')
+
+    def __init__(self, kind, destination, hop, old, new, timestamp=None):
+        """
+        初始化
+
+        Args:
+            kind: 变化类型（CHANGE_*）
+            destination: 目标
+            hop: 发生变化的跳数（路段变化时为起始跳）
+            old: 变化前的值（IP、IP 元组、RTT 或丢包率）
+            new: 变化后的值
+            timestamp: 追踪时间戳
+        """
+        self.kind = kind
+        self.destination = destination
+        self.hop = hop
+        self.old = old
+        self.new = new
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return (f"ChangeEvent({self.kind}, dest={self.destination!r}, "
+                f"hop={self.hop}, old={self.old!r}, new={self.new!r})")
+
+    def describe(self):
+        """返回可读的描述"""
+        label = CHANGE_LABELS.get(self.kind, self.kind)
+        if self.kind == CHANGE_RTT_STEP:
+            return f"{label}: 第 {self.hop} 跳 {self.old:.1f}ms -> {self.new:.1f}ms"
+        if self.kind == CHANGE_LOSS:
+            return f"{label}: 第 {self.hop} 跳丢包率 {self.old:.0%} -> {self.new:.0%}"
+        return f"{label}: 第 {self.hop} 跳 {self.old} -> {self.new}"
+
+
+class _PathState:
+    """单个目标的最近路径索引"""
+
+    __slots__ = ('key', 'ips', 'loss', 'baseline')
+
+    def __init__(self, key, ips, loss, baseline):
+        self.key = key            # 跳 IP 元组的哈希
+        self.ips = ips            # 跳 IP 元组（超时跳为 None）
+        self.loss = loss          # 每跳丢包率元组
+        self.baseline = baseline  # {ip: RTT 基线(ms)}
+
+
+def _hop_summary(hop):
+    """
+    提取单跳的 (IP, RTT 中位数, 丢包率)
+
+    丢包率按该跳的查询次数计算（rtts 中 NaN 为丢失的查询），
+    整跳超时记为 1.0
+
+    Args:
+        hop: HopRecord
+    """
+    if hop.status == HOP_TIMEOUT or not hop.ip:
+        return None, None, 1.0
+    valid = sorted(r for r in hop.rtts if r == r)
+    total = len(hop.rtts)
+    loss = (total - len(valid)) / total if total else 0.0
+    median = valid[len(valid) // 2] if valid else None
+    return hop.ip, median, loss
+
+
+def _match(a, b):
+    """超时跳视为通配"""
+    return a is None or b is None or a == b
+
+
+class PathChangeDetector:
+    """路径变化检测引擎"""
+
+    def __init__(self, rtt_step_ratio=0.5, rtt_step_min=5.0,
+                 loss_threshold=0.5, smoothing=0.2, callback=None):
+        """
+        初始化
+
+        Args:
+            rtt_step_ratio: RTT 相对基线上升比例阈值
+            rtt_step_min: RTT 上升绝对值阈值（毫秒）
+            loss_threshold: 判定为丢包点的丢包率阈值（默认每跳 3 次查询中
+                            至少丢失 2 次，单次丢失多为 ICMP 限速）
+            smoothing: RTT 基线的指数平滑系数
+            callback: 每个事件的回调函数（可选）
+        """
+        self.rtt_step_ratio = rtt_step_ratio
+        self.rtt_step_min = rtt_step_min
+        self.loss_threshold = loss_threshold
+        self.smoothing = smoothing
+        self.callback = callback
+        self.paths = {}  # destination -> _PathState
+
+    def reset(self, destination=None):
+        """清除某个目标（或全部）的路径索引"""
+        if destination is None:
+            self.paths = {}
+        else:
+            self.paths.pop(destination, None)
+
+    def process_route_hops(self, destination, route_hops, timestamp=None):
+        """处理 TracerouteNoAdmin.route_hops 格式的结果"""
+        return self.process(destination, hops_from_route_hops(route_hops), timestamp)
+
+    def process(self, destination, hops, timestamp=None):
+        """
+        处理一次追踪结果并与该目标的上一次路径比较
+
+        Args:
+            destination: 目标
+            hops: 按跳数排序的 HopRecord 列表
+            timestamp: 追踪时间戳
+
+        Returns:
+            ChangeEvent 列表
+        """
+        hop_nums = []
+        ips = []
+        rtts = []
+        loss = []
+        for hop in hops:
+            ip, rtt, hop_loss = _hop_summary(hop)
+            hop_nums.append(hop.hop)
+            ips.append(ip)
+            rtts.append(rtt)
+            loss.append(hop_loss)
+        ips = tuple(ips)
+        key = hash(ips)
+
+        previous = self.paths.get(destination)
+        events = []
+
+        if previous is None:
+            baseline = {ip: rtt for ip, rtt in zip(ips, rtts)
+                        if ip is not None and rtt is not None}
+            self.paths[destination] = _PathState(key, ips, tuple(loss), baseline)
+            return events
+
+        # 路径哈希不同时才进行逐跳比较
+        if key != previous.key or ips != previous.ips:
+            events.extend(self._diff_path(destination, previous.ips, ips,
+                                          hop_nums, timestamp))
+
+        # 丢包点：上一次该位置同一路由器无明显丢包
+        old_loss = {ip: l for ip, l in zip(previous.ips, previous.loss) if ip}
+        for i, ip in enumerate(ips):
+            hop_loss = loss[i]
+            if hop_loss < self.loss_threshold:
+                continue
+            if ip is None:
+                old_ip = previous.ips[i] if i < len(previous.ips) else None
+                if old_ip is not None and old_loss.get(old_ip, 1.0) < self.loss_threshold:
+                    events.append(ChangeEvent(CHANGE_LOSS, destination, hop_nums[i],
+                                              old_loss[old_ip], hop_loss, timestamp))
+            elif old_loss.get(ip, 0.0) < self.loss_threshold:
+                events.append(ChangeEvent(CHANGE_LOSS, destination, hop_nums[i],
+                                          old_loss.get(ip, 0.0), hop_loss, timestamp))
+
+        # RTT 阶跃：与每个路由器的平滑基线比较
+        baseline = previous.baseline
+        alpha = self.smoothing
+        for i, ip in enumerate(ips):
+            rtt = rtts[i]
+            if ip is None or rtt is None:
+                continue
+            base = baseline.get(ip)
+            if base is None:
+                baseline[ip] = rtt
+                continue
+            if rtt - base >= self.rtt_step_min and rtt >= base * (1 + self.rtt_step_ratio):
+                events.append(ChangeEvent(CHANGE_RTT_STEP, destination, hop_nums[i],
+                                          base, rtt, timestamp))
+                baseline[ip] = rtt  # 阶跃后以新水平为基线，避免重复告警
+            else:
+                baseline[ip] = base + alpha * (rtt - base)
+
+        # 只保留当前路径上的路由器基线
+        current = set(ips)
+        for ip in [ip for ip in baseline if ip not in current]:
+            del baseline[ip]
+
+        self.paths[destination] = _PathState(key, ips, tuple(loss), baseline)
+
+        if self.callback:
+            for event in events:
+                self.callback(event)
+        return events
+
+    def _diff_path(self, destination, old, new, hop_nums, timestamp):
+        """比较两条跳序列，找出替换和绕行"""
+        # 公共前缀与公共后缀（超时跳视为通配）
+        prefix = 0
+        limit = min(len(old), len(new))
+        while prefix < limit and _match(old[prefix], new[prefix]):
+            prefix += 1
+        suffix = 0
+        while (suffix < limit - prefix and
+               _match(old[len(old) - 1 - suffix], new[len(new) - 1 - suffix])):
+            suffix += 1
+
+        old_mid = old[prefix:len(old) - suffix]
+        new_mid = new[prefix:len(new) - suffix]
+        if not old_mid and not new_mid:
+            return []
+
+        start_hop = hop_nums[prefix] if prefix < len(hop_nums) else prefix + 1
+        if len(old_mid) == len(new_mid):
+            events = []
+            for offset, (a, b) in enumerate(zip(old_mid, new_mid)):
+                if not _match(a, b):
+                    events.append(ChangeEvent(CHANGE_HOP_REPLACED, destination,
+                                              hop_nums[prefix + offset], a, b,
+                                              timestamp))
+            return events
+        return [ChangeEvent(CHANGE_DETOUR, destination, start_hop,
+                            old_mid, new_mid, timestamp)]
+
+
+def detect_store_changes(store, destination=None, start=None, end=None,
+                         detector=None):
+    """
+    按时间顺序回放存储中的历史结果并检测变化
+
+    Args:
+        store: TraceStore
+        destination: 目标 IP（None 表示所有目标）
+        start: 起始时间戳
+        end: 结束时间戳
+        detector: PathChangeDetector（默认新建）
+
+    Returns:
+        ChangeEvent 列表
+    """
+    if detector is None:
+        detector = PathChangeDetector()
+    events = []
+    for record in store.query(destination, start, end):
+        events.extend(detector.process(record.dest_ip, record.hops, record.timestamp))
+    return events
+
+
+def print_usage():
+    """打印使用说明"""
+    print("用法: python path_diff.py <存储目录> [目标IP]")
+    print("\n说明:")
+    print("  回放 trace.py --store 保存的历史结果，输出路径变化事件")
+    print("\n示例:")
+    print("  python path_diff.py ./traces")
+    print("  python path_diff.py ./traces 110.242.68.66")
+
+
+def main():
+    """主函数"""
+    if len(sys.argv) < 2 or sys.argv[1] in ['-h', '--help']:
+        print_usage()
+        sys.exit(0 if len(sys.argv) >= 2 else 1)
+
+    store = TraceStore(sys.argv[1])
+    destination = sys.argv[2] if len(sys.argv) > 2 else None
+
+    for event in detect_store_changes(store, destination):
+        when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(event.timestamp))
+        print(f"[{when}] {event.destination}  {event.describe()}")
+
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,467 @@
+#!/usr/bin/env python3
+"""
+Path MTU Discovery - 逐跳路径 MTU 探测
+设置 DF 位发送不同大小的 ICMP Echo 探测包，对每一跳并行进行二分查找，
+并利用 ICMP Fragmentation Needed 报文中的下一跳 MTU 缩小搜索范围，
+输出每一跳的路径 MTU 以及瓶颈所在的跳（需要管理员/root权限）
+"""
+
+import errno
+import select
+import socket
+import sys
+import time
+
+from traceroute import MAX_TTL, Traceroute
+
+
+# IP(20) + ICMP(8) 头部
+HEADER_SIZE = 28
+# IPv4 最小 MTU
+MIN_MTU = 68
+
+# Linux: IP_MTU_DISCOVER / IP_PMTUDISC_PROBE（设置 DF 且忽略内核 PMTU 缓存）
+IP_MTU_DISCOVER = getattr(socket, 'IP_MTU_DISCOVER', 10)
+IP_PMTUDISC_DO = getattr(socket, 'IP_PMTUDISC_DO', 2)
+IP_PMTUDISC_PROBE = getattr(socket, 'IP_PMTUDISC_PROBE', 3)
+IP_MTU = getattr(socket, 'IP_MTU', 14)
+# Windows: IP_DONTFRAGMENT，macOS: IP_DONTFRAG
+IP_DONTFRAGMENT = 14
+IP_DONTFRAG = 28
+
+
+class HopMTU:
+    """单跳的 MTU 搜索状态"""
+
+    __slots__ = ('ttl', 'ip', 'low', 'high', 'misses', 'silent', 'check',
+                 'unknown', 'reporter')
+
+    def __init__(self, ttl, ip, low, high):
+        self.ttl = ttl
+        self.ip = ip
+        self.low = low          # 已确认可通过的最大包大小
+        self.high = high        # 可能通过的最大包大小上界
+        self.misses = 0         # 小包有响应、当前大小无响应的次数（黑洞）
+        self.silent = 0         # 大小包均无响应的次数（ICMP 限速）
+        self.check = False      # 下一轮是否同时发送已知可通过大小的对照包
+        self.unknown = False    # 该跳持续无响应，MTU 未知
+        self.reporter = None    # 发送 Fragmentation Needed 的路由器
+
+    @property
+    def done(self):
+        return self.unknown or self.low >= self.high
+
+    @property
+    def mtu(self):
+        return self.low
+
+
+class PathMTUDiscovery(Traceroute):
+    """路径 MTU 探测"""
+
+    def __init__(self, destination, max_hops=30, timeout=2, retries=2,
+                 max_size=None):
+        """
+        初始化
+
+        Args:
+            destination: 目标主机名或IP地址
+            max_hops: 最大跳数
+            timeout: 每轮探测的等待时间（秒）
+            retries: 对照小包有响应而当前大小无响应多少次后视为被丢弃（黑洞）；
+                     对照包也无响应达到其两倍次数时该跳视为未知
+            max_size: 最大探测包大小（默认使用本地出接口 MTU）
+        """
+        super().__init__(destination, max_hops=max_hops, timeout=timeout, queries=1)
+        self.retries = retries
+        self.max_size = max_size
+        self.hops = []
+        self._sequence = 0
+        self.rounds = 0
+
+    def local_mtu(self):
+        """查询到目标的本地路由 MTU（仅 Linux 支持，其他平台返回 1500）"""
+        probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            probe.connect((self.dest_ip, 9))
+            return probe.getsockopt(socket.IPPROTO_IP, IP_MTU)
+        except OSError:
+            return 1500
+        finally:
+            probe.close()
+
+    def set_dont_fragment(self, sock):
+        """在发送套接字上设置 DF 位"""
+        if sys.platform.startswith('win'):
+            sock.setsockopt(socket.IPPROTO_IP, IP_DONTFRAGMENT, 1)
+        elif sys.platform == 'darwin':
+            sock.setsockopt(socket.IPPROTO_IP, IP_DONTFRAG, 1)
+        else:
+            try:
+                sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_PROBE)
+            except OSError:
+                sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+
+    def _next_sequence(self):
+        self._sequence = (self._sequence + 1) & 0xFFFF
+        return self._sequence
+
+    def _send(self, send_socket, ttl, size):
+        """
+        发送指定大小的探测包
+
+        Returns:
+            序列号，本地因超过 MTU 拒绝发送时返回 None
+        """
+        sequence = self._next_sequence()
+        packet = self.create_icmp_packet(sequence, size - HEADER_SIZE)
+        send_socket.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+        try:
+            send_socket.sendto(packet, (self.dest_ip, 1))
+        except OSError as e:
+            if e.errno == errno.EMSGSIZE:
+                return None
+            raise
+        return sequence
+
+    def _collect(self, recv_socket, expected):
+        """
+        接收本轮所有响应
+
+        Args:
+            recv_socket: 接收套接字
+            expected: {sequence: (HopMTU, size)}
+
+        Returns:
+            {sequence: (icmp_type, icmp_code, 响应IP, 下一跳MTU)}
+        """
+        replies = {}
+        deadline = time.monotonic() + self.timeout
+        while len(replies) < len(expected):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            ready, _, _ = select.select([recv_socket], [], [], remaining)
+            if not ready:
+                break
+            data, addr = recv_socket.recvfrom(2048)
+            info = self.parse_icmp_response(data)
+            if not info:
+                continue
+            icmp_type, icmp_code, packet_id, sequence, next_hop_mtu = info
+            if packet_id != self.identifier or sequence not in expected:
+                continue
+            replies[sequence] = (icmp_type, icmp_code, addr[0], next_hop_mtu)
+        return replies
+
+    def _discover_path(self, send_socket, recv_socket):
+        """用最小包并行探测所有 TTL，确定各跳地址和目标跳数"""
+        expected = {}
+        for ttl in range(1, self.max_hops + 1):
+            sequence = self._send(send_socket, ttl, MIN_MTU)
+            if sequence is not None:
+                expected[sequence] = ttl
+        replies = self._collect(recv_socket, expected)
+
+        hop_ips = {}
+        dest_ttl = None
+        for sequence, (icmp_type, _, ip, _) in replies.items():
+            ttl = expected[sequence]
+            hop_ips[ttl] = ip
+            if icmp_type == 0 or ip == self.dest_ip:
+                dest_ttl = ttl if dest_ttl is None else min(dest_ttl, ttl)
+        last = dest_ttl or self.max_hops
+        return [(ttl, hop_ips.get(ttl)) for ttl in range(1, last + 1)], dest_ttl is not None
+
+    def _constrain(self):
+        """路径 MTU 沿路径单调不增：传播上下界"""
+        previous_high = None
+        for hop in self.hops:
+            if previous_high is not None and hop.high > previous_high:
+                hop.high = previous_high
+            if hop.low > hop.high:
+                hop.low = hop.high
+            previous_high = hop.high
+        next_low = None
+        for hop in reversed(self.hops):
+            if next_low is not None and hop.low < next_low:
+                hop.low = next_low
+            next_low = hop.low
+
+    def _record_miss(self, hop, size, control, replies):
+        """
+        处理未得到有效响应的探测
+
+        对照小包有响应时才计为黑洞丢弃并降低上界；对照包也无响应说明该跳
+        暂时不回应（常见于 ICMP 限速），不改变上下界，多次后该跳记为未知
+        """
+        if control is None:
+            hop.check = True
+        elif control in replies:
+            hop.silent = 0
+            hop.misses += 1
+            if hop.misses >= self.retries:
+                # 多次无响应，视为大包被静默丢弃
+                hop.high = size - 1
+                hop.misses = 0
+                hop.check = False
+        else:
+            self._record_silent(hop)
+
+    def _record_silent(self, hop):
+        """该跳本轮没有给出与包大小有关的信息，多次后记为未知"""
+        hop.silent += 1
+        if hop.silent >= self.retries * 2:
+            hop.unknown = True
+
+    def discover(self):
+        """
+        执行 PMTU 探测
+
+        Returns:
+            HopMTU 列表（无响应的跳 ip 为 None），失败时返回 None
+        """
+        try:
+            send_socket = socket.socket(socket.AF_INET, socket.SOCK_RAW,
+                                        socket.IPPROTO_ICMP)
+            recv_socket = socket.socket(socket.AF_INET, socket.SOCK_RAW,
+                                        socket.IPPROTO_ICMP)
+        except PermissionError:
+            print("\n错误: 需要管理员/root权限来创建原始套接字")
+            print("Windows: 请以管理员身份运行")
+            print("Linux/Mac: 请使用 sudo 运行")
+            return None
+
+        try:
+            self.set_dont_fragment(send_socket)
+            max_size = self.max_size or self.local_mtu()
+
+            path, reached = self._discover_path(send_socket, recv_socket)
+            self.hops = [HopMTU(ttl, ip, MIN_MTU, max_size) for ttl, ip in path]
+            responsive = [hop for hop in self.hops if hop.ip]
+            if not reached:
+                print(f"警告: 未能在 {self.max_hops} 跳内到达目标，仅探测已响应的跳")
+
+            rounds = 0
+            while True:
+                self._constrain()
+                active = [hop for hop in responsive if not hop.done]
+                if not active:
+                    break
+                rounds += 1
+
+                # 所有未完成的跳同时发送本轮探测包；上一轮无响应的跳
+                # 同时发送已知可通过大小的对照包，区分大包被丢弃与 ICMP 限速
+                expected = {}
+                controls = {}   # 跳 -> 对照包序列号
+                for hop in active:
+                    size = (hop.low + hop.high + 1) // 2
+                    sequence = self._send(send_socket, hop.ttl, size)
+                    if sequence is None:
+                        # 本地出接口即无法发送
+                        hop.high = size - 1
+                        continue
+                    expected[sequence] = (hop, size)
+                    if hop.check:
+                        control = self._send(send_socket, hop.ttl, hop.low)
+                        if control is not None:
+                            expected[control] = (hop, hop.low)
+                            controls[hop] = control
+
+                replies = self._collect(recv_socket, expected)
+
+                for sequence, (hop, size) in expected.items():
+                    if controls.get(hop) == sequence:
+                        continue
+                    reply = replies.get(sequence)
+                    if reply is None:
+                        self._record_miss(hop, size, controls.get(hop), replies)
+                        continue
+                    icmp_type, icmp_code, ip, next_hop_mtu = reply
+                    if icmp_type == 3 and icmp_code == 4:
+                        hop.high = size - 1
+                        hop.reporter = ip
+                        if MIN_MTU <= next_hop_mtu < size:
+                            hop.high = next_hop_mtu
+                    elif icmp_type in (0, 11) or ip == self.dest_ip:
+                        # 超时报文、回显应答或目标本身的不可达报文：该大小已到达
+                        hop.low = size
+                    else:
+                        # 中间路由器的其他不可达报文（如管理禁止）不说明包大小
+                        self._record_silent(hop)
+                        continue
+                    hop.misses = 0
+                    hop.silent = 0
+                    hop.check = False
+
+            self.rounds = rounds
+            return self.hops
+        finally:
+            send_socket.close()
+            recv_socket.close()
+
+    def bottleneck(self):
+        """
+        返回瓶颈跳：路径 MTU 首次降到最终值的跳
+
+        Returns:
+            HopMTU 或 None
+        """
+        known = [hop for hop in self.hops if hop.ip and not hop.unknown]
+        if not known:
+            return None
+        final = known[-1].mtu
+        for hop in known:
+            if hop.mtu == final:
+                return hop
+        return None
+
+    def trace(self):
+        """执行 PMTU 探测并输出结果"""
+        if not self.resolve_destination():
+            return
+
+        start = time.monotonic()
+        hops = self.discover()
+        if hops is None:
+            return
+        elapsed = time.monotonic() - start
+
+        previous = None
+        for hop in hops:
+            if not hop.ip:
+                print(f"{hop.ttl:2d}  *")
+                continue
+            if hop.unknown:
+                print(f"{hop.ttl:2d}  {hop.ip:15s}  MTU 未知（持续无响应，可能被 ICMP 限速）")
+                continue
+            marker = ""
+            if previous is not None and hop.mtu < previous:
+                marker = "  <-- MTU 下降"
+                if hop.reporter:
+                    marker += f" (报告者: {hop.reporter})"
+            print(f"{hop.ttl:2d}  {hop.ip:15s}  MTU {hop.mtu}{marker}")
+            previous = hop.mtu
+
+        bottleneck = self.bottleneck()
+        if bottleneck:
+            print(f"\n路径 MTU: {bottleneck.mtu}，瓶颈位于第 {bottleneck.ttl} 跳 "
+                  f"({bottleneck.ip})")
+        print(f"共 {self.rounds} 轮探测, 用时 {elapsed:.2f} 秒")
+
+
+def print_usage():
+    """打印使用说明"""
+    print("用法: python pmtu.py <目标主机> [选项]")
+    print("\n选项:")
+    print("  -m, --max-hops <数字>    最大跳数 (默认: 30)")
+    print("  -t, --timeout <秒数>     每轮等待时间 (默认: 2)")
+    print("  -r, --retries <数字>     判定大包被丢弃所需的无响应次数 (默认: 2)")
+    print("  -s, --max-size <字节>    最大探测包大小 (默认: 本地接口 MTU)")
+    print("  -h, --help               显示此帮助信息")
+    print("\n示例:")
+    print("  sudo python pmtu.py www.google.com")
+    print("  sudo python pmtu.py 8.8.8.8 -s 9000 -t 1")
+
+
+def main():
+    """主函数"""
+    if len(sys.argv) < 2:
+        print_usage()
+        sys.exit(1)
+
+    destination = None
+    max_hops = 30
+    timeout = 2
+    retries = 2
+    max_size = None
+
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+
+        if arg in ['-h', '--help']:
+            print_usage()
+            sys.exit(0)
+        elif arg in ['-m', '--max-hops']:
+            if i + 1 < len(sys.argv):
+                try:
+                    max_hops = int(sys.argv[i + 1])
+                    if not 1 <= max_hops <= MAX_TTL:
+                        raise ValueError
+                    i += 2
+                except ValueError:
+                    print(f"错误: 无效的最大跳数值 '{sys.argv[i + 1]}' (1-{MAX_TTL})")
+                    sys.exit(1)
+            else:
+                print("错误: -m/--max-hops 需要一个参数")
+                sys.exit(1)
+        elif arg in ['-t', '--timeout']:
+            if i + 1 < len(sys.argv):
+                try:
+                    timeout = float(sys.argv[i + 1])
+                    i += 2
+                except ValueError:
+                    print(f"错误: 无效的超时值 '{sys.argv[i + 1]}'")
+                    sys.exit(1)
+            else:
+                print("错误: -t/--timeout 需要一个参数")
+                sys.exit(1)
+        elif arg in ['-r', '--retries']:
+            if i + 1 < len(sys.argv):
+                try:
+                    retries = int(sys.argv[i + 1])
+                    if retries < 1:
+                        raise ValueError
+                    i += 2
+                except ValueError:
+                    print(f"错误: 无效的重试次数 '{sys.argv[i + 1]}'")
+                    sys.exit(1)
+            else:
+                print("错误: -r/--retries 需要一个参数")
+                sys.exit(1)
+        elif arg in ['-s', '--max-size']:
+            if i + 1 < len(sys.argv):
+                try:
+                    max_size = int(sys.argv[i + 1])
+                    if max_size < MIN_MTU:
+                        raise ValueError
+                    i += 2
+                except ValueError:
+                    print(f"错误: 无效的包大小 '{sys.argv[i + 1]}'")
+                    sys.exit(1)
+            else:
+                print("错误: -s/--max-size 需要一个参数")
+                sys.exit(1)
+        elif arg.startswith('-'):
+            print(f"错误: 未知选项 '{arg}'")
+            print_usage()
+            sys.exit(1)
+        else:
+            if destination is None:
+                destination = arg
+                i += 1
+            else:
+                print(f"错误: 多余的参数 '{arg}'")
+                print_usage()
+                sys.exit(1)
+
+    if destination is None:
+        print("错误: 未指定目标主机")
+        print_usage()
+        sys.exit(1)
+
+    try:
+        tracer = PathMTUDiscovery(destination, max_hops=max_hops, timeout=timeout,
+                                  retries=retries, max_size=max_size)
+        tracer.trace()
+    except KeyboardInterrupt:
+        print("\n\n中断: 用户取消操作")
+        sys.exit(0)
+    except Exception as e:
+        print(f"\n错误: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1142 @@
+#!/usr/bin/env python3
+"""
+Probe Engine - 统一的路由探测引擎
+将原始 ICMP、非特权 ICMP/UDP 数据报、系统 traceroute 命令和 TCP connect
+封装为可插拔的探测后端，启动时检测当前权限下可用的后端并自动选择最快的一个；
+所有后端输出相同的结构化跳记录（trace_store.HopRecord）
+
+ProbeEngine 在后端之上统一处理 ASN 标注、TCP 端口检测（含共享缓存）、输出、
+限时追踪和历史存储；trace.py（默认系统命令后端）、traceroute.py（原始 ICMP）
+和 traceroute_nonadmin.py（系统命令）都经由它执行追踪
+"""
+
+import abc
+import errno
+import os
+import select
+import shutil
+import socket
+import struct
+import sys
+import time
+
+from batch_io import BatchReceiver, BatchSender
+from trace import TracerouteNoAdmin
+from trace_store import TCP_STATUS_CODES, TCP_UNREACHABLE, HopRecord, TraceStore
+from traceroute import MAX_QUERIES, MAX_TTL, Traceroute, probe_sequence
+
+
+# Linux 错误队列（非特权套接字通过它接收 ICMP 差错报文）
+IP_RECVERR = getattr(socket, 'IP_RECVERR', 11)
+MSG_ERRQUEUE = getattr(socket, 'MSG_ERRQUEUE', 0x2000)
+SO_EE_ORIGIN_ICMP = 2
+# struct sock_extended_err: errno, origin, type, code, pad, info, data
+SOCK_EXTENDED_ERR = struct.Struct('=IBBBBII')
+
+CAP_NET_RAW = 13
+UDP_BASE_PORT = 33434
+
+
+def has_cap_net_raw():
+    """当前进程是否具有 CAP_NET_RAW（Linux），其他平台返回 None"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('CapEff:'):
+                    return bool(int(line.split()[1], 16) & (1 << CAP_NET_RAW))
+    except OSError:
+        pass
+    return None
+
+
+def ping_group_range():
+    """读取 Linux net.ipv4.ping_group_range，返回 (最小gid, 最大gid) 或 None"""
+    try:
+        with open('/proc/sys/net/ipv4/ping_group_range') as f:
+            low, high = f.read().split()
+            return int(low), int(high)
+    except (OSError, ValueError):
+        return None
+
+
+def parse_recverr(ancdata):
+    """
+    从 IP_RECVERR 辅助数据中提取 ICMP 差错信息
+
+    Returns:
+        (响应IP, icmp_type, icmp_code) 或 None
+    """
+    for level, kind, data in ancdata or ():
+        if level != socket.IPPROTO_IP or kind != IP_RECVERR:
+            continue
+        if len(data) < SOCK_EXTENDED_ERR.size:
+            continue
+        _, origin, icmp_type, icmp_code, _, _, _ = SOCK_EXTENDED_ERR.unpack_from(data)
+        if origin != SO_EE_ORIGIN_ICMP:
+            continue
+        offender = None
+        # 紧随其后的是 sockaddr_in（family 2 + port 2 + addr 4）
+        if len(data) >= SOCK_EXTENDED_ERR.size + 8:
+            offender = socket.inet_ntoa(
+                data[SOCK_EXTENDED_ERR.size + 4:SOCK_EXTENDED_ERR.size + 8])
+        return offender, icmp_type, icmp_code
+    return None
+
+
+def _try_socket(family, kind, proto):
+    """尝试创建套接字，判断当前权限是否允许"""
+    try:
+        sock = socket.socket(family, kind, proto)
+    except OSError:
+        return False
+    sock.close()
+    return True
+
+
+def _make_hop(ttl, ip, rtts):
+    """构造跳记录，rtts 中 None 表示该次查询超时"""
+    return HopRecord(ttl, ip, rtts)
+
+
+class ProbeBackend(abc.ABC):
+    """探测后端基类"""
+
+    name = 'base'
+    description = ''
+    # 速度排序，数值越小越快
+    rank = 100
+
+    # 是否支持并行批量收发
+    supports_batch = False
+
+    # 不可用时提示用户的条件
+    requirement = ''
+
+    def __init__(self, max_hops=30, timeout=2, queries=3, batch=False):
+        """
+        初始化
+
+        Args:
+            max_hops: 最大跳数
+            timeout: 每次查询超时时间（秒）
+            queries: 每一跳的查询次数
+            batch: 一次性发出所有 TTL 的探测包并批量接收（仅部分后端支持）
+
+        Raises:
+            ValueError: 跳数超过 255，或查询次数超过 256
+        """
+        if not 1 <= max_hops <= MAX_TTL:
+            raise ValueError(f"最大跳数 {max_hops} 超出范围 (1-{MAX_TTL})")
+        if not 1 <= queries <= MAX_QUERIES:
+            raise ValueError(f"每跳查询次数 {queries} 超出范围 (1-{MAX_QUERIES})")
+        self.max_hops = max_hops
+        self.timeout = timeout
+        self.queries = queries
+        self.batch = batch and self.supports_batch
+        # 总时限（time.monotonic 时刻），由 ProbeEngine.trace_deadline 设置
+        self.expires = None
+
+    @classmethod
+    def available(cls):
+        """当前环境下是否可用"""
+        return False
+
+    def probe_timeout(self):
+        """单次探测的超时：不超过 self.timeout，也不超过距总时限的剩余时间"""
+        if self.expires is None:
+            return self.timeout
+        return max(0.0, min(self.timeout, self.expires - time.monotonic()))
+
+    def expired(self):
+        """总时限是否已到"""
+        return self.expires is not None and time.monotonic() >= self.expires
+
+    def plan_rounds(self):
+        """
+        限时追踪时的超时分摊方式
+
+        Returns:
+            一次性发出所有探测的后端返回需要分摊剩余时间的轮数；逐跳探测的
+            后端返回 None，由引擎在每跳开始前重新分配查询次数和超时
+        """
+        return 1 if self.batch else None
+
+    @abc.abstractmethod
+    def trace(self, destination, dest_ip):
+        """
+        执行探测
+
+        Args:
+            destination: 目标主机名
+            dest_ip: 已解析的目标 IP
+
+        Yields:
+            HopRecord，按跳数顺序；到达目标后停止
+        """
+
+    def batch_probes(self, dest_ip, build_packet, port):
+        """
+        生成所有 TTL 的探测包，序列号高 8 位为 TTL、低 8 位为查询序号
+
+        Returns:
+            (ttl, packet, addr, sequence) 列表
+        """
+        probes = []
+        for ttl in range(1, self.max_hops + 1):
+            for query in range(self.queries):
+                sequence = probe_sequence(ttl, query)
+                probes.append((ttl, build_packet(sequence), (dest_ip, port), sequence))
+        return probes
+
+    def collect_batch(self, sender, probes, poll_sock, receivers, match):
+        """
+        批量发送后收集所有响应
+
+        Args:
+            sender: BatchSender
+            probes: batch_probes 的返回值
+            poll_sock: 用于等待可读的套接字
+            receivers: BatchReceiver 列表（每次唤醒依次读空）
+            match: match(receiver, index, data, addr) -> (sequence, ip, 是否到达) 或 None
+
+        Yields:
+            HopRecord
+        """
+        sent = sender.send_all(probes)
+        results = {}
+        dest_ttl = None
+        deadline = time.monotonic() + self.probe_timeout()
+        while len(results) < len(sent):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            ready, _, _ = select.select([poll_sock], [], [], remaining)
+            if not ready:
+                break
+            for receiver in receivers:
+                count = receiver.drain()
+                for index, (data, addr, received) in enumerate(receiver.packets(count)):
+                    matched = match(receiver, index, data, addr)
+                    if not matched:
+                        continue
+                    sequence, ip, reached = matched
+                    if sequence not in sent or sequence in results:
+                        continue
+                    results[sequence] = ((received - sent[sequence]) * 1000, ip)
+                    if reached:
+                        ttl = sequence >> 8
+                        dest_ttl = ttl if dest_ttl is None else min(dest_ttl, ttl)
+            # 已到达目标且更近的跳都有结果时提前结束
+            if dest_ttl is not None and all(
+                    seq in results for seq in sent if seq >> 8 <= dest_ttl):
+                break
+
+        for ttl in range(1, (dest_ttl or self.max_hops) + 1):
+            rtts = []
+            hop_ip = None
+            for query in range(self.queries):
+                result = results.get(probe_sequence(ttl, query))
+                if result:
+                    rtts.append(result[0])
+                    if hop_ip is None:
+                        hop_ip = result[1]
+                else:
+                    rtts.append(None)
+            yield _make_hop(ttl, hop_ip, rtts if hop_ip else [])
+
+
+class RawICMPBackend(ProbeBackend):
+    """原始套接字 ICMP Echo（需要 root / CAP_NET_RAW / 管理员）"""
+
+    name = 'raw'
+    description = '原始 ICMP 套接字'
+    rank = 10
+    supports_batch = True
+    requirement = '需要管理员/root权限或 CAP_NET_RAW'
+
+    def __init__(self, max_hops=30, timeout=2, queries=3, batch=False, tracer=None):
+        """
+        初始化
+
+        Args:
+            tracer: 用于收发探测包的 traceroute.Traceroute 实例（可选，
+                    默认每次追踪新建一个；子类可改写 send_probe）
+            其余参数同 ProbeBackend
+        """
+        super().__init__(max_hops=max_hops, timeout=timeout, queries=queries,
+                         batch=batch)
+        self.tracer = tracer
+
+    @classmethod
+    def available(cls):
+        return _try_socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+
+    def trace(self, destination, dest_ip):
+        tracer = self.tracer
+        if tracer is None:
+            tracer = Traceroute(destination, max_hops=self.max_hops,
+                                timeout=self.timeout, queries=self.queries)
+        tracer.dest_ip = dest_ip
+        if self.batch:
+            yield from self._trace_batch(tracer, dest_ip)
+            return
+        for ttl in range(1, self.max_hops + 1):
+            if self.expired():
+                return
+            rtts = []
+            hop_ip = None
+            reached = False
+            for query in range(self.queries):
+                rtt, ip, is_destination = tracer.send_probe(
+                    ttl, probe_sequence(ttl, query), self.probe_timeout())
+                rtts.append(rtt)
+                if ip and hop_ip is None:
+                    hop_ip = ip
+                reached = reached or is_destination
+            yield _make_hop(ttl, hop_ip, rtts if hop_ip else [])
+            if reached:
+                return
+
+    def _trace_batch(self, tracer, dest_ip):
+        send_socket = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+        recv_socket = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+        try:
+            receiver = BatchReceiver(recv_socket)
+
+            def match(receiver, index, data, addr):
+                info = tracer.parse_icmp_response(data)
+                if not info or info[2] != tracer.identifier:
+                    return None
+                return info[3], addr[0], addr[0] == dest_ip
+
+            probes = self.batch_probes(dest_ip, tracer.create_icmp_packet, 1)
+            yield from self.collect_batch(BatchSender(send_socket), probes,
+                                          recv_socket, [receiver], match)
+        finally:
+            send_socket.close()
+            recv_socket.close()
+
+
+class _ErrorQueueBackend(ProbeBackend):
+    """基于 Linux IP_RECVERR 错误队列的非特权数据报后端"""
+
+    @abc.abstractmethod
+    def open_socket(self):
+        """创建探测套接字"""
+
+    @abc.abstractmethod
+    def send(self, sock, dest_ip, ttl, sequence):
+        """以指定 TTL 发送一个探测包"""
+
+    @abc.abstractmethod
+    def match_reply(self, data, addr, sequence):
+        """判断普通接收到的数据是否为目标对本次探测的响应"""
+
+    @abc.abstractmethod
+    def match_error(self, payload, addr, sequence):
+        """判断错误队列中的报文是否对应本次探测"""
+
+    def read_error(self, sock):
+        """
+        读取一条错误队列消息
+
+        Returns:
+            (响应IP, icmp_type, icmp_code, 原始负载, 原始目的地址) 或 None
+        """
+        try:
+            payload, ancdata, _, addr = sock.recvmsg(2048, 512, MSG_ERRQUEUE)
+        except (BlockingIOError, InterruptedError):
+            return None
+        error = parse_recverr(ancdata)
+        if error is None:
+            return None
+        offender, icmp_type, icmp_code = error
+        return offender, icmp_type, icmp_code, payload, addr
+
+    def probe(self, sock, dest_ip, ttl, sequence):
+        """
+        发送一次探测并等待响应
+
+        Returns:
+            (rtt_ms, 响应IP, 是否到达目标) 或 (None, None, False)
+        """
+        start = time.monotonic()
+        try:
+            self.send(sock, dest_ip, ttl, sequence)
+        except OSError as e:
+            if e.errno != errno.EHOSTUNREACH:
+                return None, None, False
+        deadline = start + self.probe_timeout()
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None, None, False
+            ready, _, _ = select.select([sock], [], [], remaining)
+            if not ready:
+                return None, None, False
+            now = time.monotonic()
+
+            error = self.read_error(sock)
+            if error:
+                offender, _, _, payload, addr = error
+                if self.match_error(payload, addr, sequence):
+                    # 只有目标自己发出的差错（端口不可达等）才算到达；
+                    # 中间路由器的 Time Exceeded 或目的不可达都只是一跳
+                    return (now - start) * 1000, offender, offender == dest_ip
+                continue
+
+            try:
+                data, addr = sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                continue
+            except OSError:
+                # 错误已报告在套接字上，下一轮从错误队列读取
+                continue
+            if self.match_reply(data, addr, sequence):
+                return (now - start) * 1000, addr[0], True
+
+    def trace(self, destination, dest_ip):
+        sock = self.open_socket()
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_IP, IP_RECVERR, 1)
+        if self.batch:
+            try:
+                yield from self._trace_batch(sock, dest_ip)
+            finally:
+                sock.close()
+            return
+        try:
+            sequence = 0
+            for ttl in range(1, self.max_hops + 1):
+                if self.expired():
+                    return
+                rtts = []
+                hop_ip = None
+                reached = False
+                for _ in range(self.queries):
+                    sequence = (sequence + 1) & 0xFFFF
+                    rtt, ip, is_destination = self.probe(sock, dest_ip, ttl, sequence)
+                    rtts.append(rtt)
+                    if ip and hop_ip is None:
+                        hop_ip = ip
+                    reached = reached or is_destination
+                yield _make_hop(ttl, hop_ip, rtts if hop_ip else [])
+                if reached:
+                    return
+        finally:
+            sock.close()
+
+
+class DatagramICMPBackend(_ErrorQueueBackend):
+    """非特权 ICMP 数据报套接字（Linux，受 ping_group_range 控制）"""
+
+    name = 'icmp-dgram'
+    description = '非特权 ICMP 数据报套接字'
+    rank = 20
+    supports_batch = True
+    requirement = '需要 Linux 且当前组在 net.ipv4.ping_group_range 内'
+
+    def __init__(self, max_hops=30, timeout=2, queries=3, batch=False):
+        super().__init__(max_hops=max_hops, timeout=timeout, queries=queries,
+                         batch=batch)
+        self._packer = Traceroute('')
+
+    @classmethod
+    def available(cls):
+        if not sys.platform.startswith('linux'):
+            return False
+        return _try_socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+
+    def open_socket(self):
+        return socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+
+    def send(self, sock, dest_ip, ttl, sequence):
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+        # 内核会改写标识符并重新计算校验和
+        sock.sendto(self._packer.create_icmp_packet(sequence), (dest_ip, 0))
+
+    def match_reply(self, data, addr, sequence):
+        # 数据报 ICMP 套接字收到的数据不含 IP 头部
+        if len(data) < 8 or data[0] != 0:
+            return False
+        return struct.unpack_from('!H', data, 6)[0] == sequence
+
+    def match_error(self, payload, addr, sequence):
+        return len(payload) >= 8 and struct.unpack_from('!H', payload, 6)[0] == sequence
+
+    def _trace_batch(self, sock, dest_ip):
+        replies = BatchReceiver(sock)
+        errors = BatchReceiver(sock, ancbufsize=512, flags=MSG_ERRQUEUE)
+
+        def match(receiver, index, data, addr):
+            if len(data) < 8:
+                return None
+            sequence = struct.unpack_from('!H', data, 6)[0]
+            if receiver is replies:
+                return (sequence, addr[0], True) if data[0] == 0 else None
+            error = parse_recverr(receiver.ancdata[index])
+            if error is None:
+                return None
+            offender, _, _ = error
+            return sequence, offender, offender == dest_ip
+
+        probes = self.batch_probes(dest_ip, self._packer.create_icmp_packet, 0)
+        # 错误队列先读，避免挂起的差错干扰普通读取
+        yield from self.collect_batch(BatchSender(sock), probes, sock,
+                                      [errors, replies], match)
+
+
+class DatagramUDPBackend(_ErrorQueueBackend):
+    """非特权 UDP 探测（Linux，通过错误队列接收 ICMP）"""
+
+    name = 'udp'
+    description = '非特权 UDP 数据报'
+    rank = 30
+    requirement = '需要 Linux'
+
+    @classmethod
+    def available(cls):
+        return sys.platform.startswith('linux')
+
+    def open_socket(self):
+        return socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, sock, dest_ip, ttl, sequence):
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+        # 与传统 traceroute 相同，用目的端口区分探测包
+        port = UDP_BASE_PORT + sequence % 1024
+        sock.sendto(b'\x00' * 32, (dest_ip, port))
+
+    def match_reply(self, data, addr, sequence):
+        return False  # 目标不会对高端口 UDP 做正常应答
+
+    def match_error(self, payload, addr, sequence):
+        return addr is not None and addr[1] == UDP_BASE_PORT + sequence % 1024
+
+
+class SystemBinaryBackend(ProbeBackend):
+    """系统 traceroute/tracert 命令"""
+
+    name = 'system'
+    description = '系统 traceroute/tracert 命令'
+    rank = 40
+    requirement = '需要安装 traceroute 命令，如 sudo apt-get install traceroute'
+
+    @classmethod
+    def available(cls):
+        binary = 'tracert' if sys.platform.startswith('win') else 'traceroute'
+        return shutil.which(binary) is not None
+
+    def plan_rounds(self):
+        # tracert 逐跳串行探测；Linux traceroute 默认同时发出 16 个探测包
+        if sys.platform.startswith('win'):
+            return self.max_hops
+        return -(-self.max_hops * self.queries // 16)
+
+    def trace(self, destination, dest_ip):
+        import queue
+        import subprocess
+        import threading
+
+        tracer = TracerouteNoAdmin(dest_ip, max_hops=self.max_hops,
+                                   timeout=self.timeout, enable_tcp_check=False)
+        command = tracer.build_command(queries=self.queries)
+        process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                   stderr=subprocess.DEVNULL, text=True,
+                                   errors='ignore', bufsize=1)
+
+        # 管道读取在 Windows 上无法 select，使用读取线程 + 队列，总时限到达时不再等待
+        lines = queue.Queue()
+
+        def reader():
+            for line in process.stdout:
+                lines.put(line)
+            lines.put(None)
+
+        threading.Thread(target=reader, daemon=True).start()
+        try:
+            while True:
+                if self.expires is None:
+                    line = lines.get()
+                else:
+                    remaining = self.expires - time.monotonic()
+                    if remaining <= 0:
+                        return
+                    try:
+                        line = lines.get(timeout=remaining)
+                    except queue.Empty:
+                        return
+                if line is None:
+                    return
+                parsed = tracer.parse_traceroute_line(line)
+                if not parsed:
+                    continue
+                hop_num, ips, rtts = parsed
+                ip = ips[0] if ips else None
+                values = []
+                for rtt in rtts:
+                    try:
+                        values.append(float(rtt))
+                    except (TypeError, ValueError):
+                        values.append(None)
+                yield _make_hop(hop_num, ip, values if ip else [])
+                if ip == dest_ip:
+                    return
+        finally:
+            if process.poll() is None:
+                process.terminate()
+            process.wait()
+
+
+class TCPConnectBackend(ProbeBackend):
+    """
+    TCP connect 探测（任何权限下可用）
+
+    普通 TCP 套接字收不到中间路由器的 ICMP 差错，因此只能确定
+    目标所在的跳数和到目标的 RTT，中间跳显示为超时
+    """
+
+    name = 'tcp'
+    description = 'TCP connect（仅目标跳）'
+    rank = 50
+
+    def __init__(self, max_hops=30, timeout=2, queries=3, port=80):
+        super().__init__(max_hops=max_hops, timeout=timeout, queries=queries)
+        self.port = port
+
+    @classmethod
+    def available(cls):
+        return True
+
+    def trace(self, destination, dest_ip):
+        for ttl in range(1, self.max_hops + 1):
+            if self.expired():
+                return
+            rtts = []
+            reached = False
+            for _ in range(self.queries):
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+                sock.settimeout(max(self.probe_timeout(), 0.001))
+                start = time.monotonic()
+                try:
+                    result = sock.connect_ex((dest_ip, self.port))
+                except socket.timeout:
+                    result = errno.ETIMEDOUT
+                finally:
+                    sock.close()
+                if result in (0, errno.ECONNREFUSED):
+                    rtts.append((time.monotonic() - start) * 1000)
+                    reached = True
+                else:
+                    rtts.append(None)
+            yield _make_hop(ttl, dest_ip if reached else None, rtts if reached else [])
+            if reached:
+                return
+
+
+BACKENDS = [RawICMPBackend, DatagramICMPBackend, DatagramUDPBackend,
+            SystemBinaryBackend, TCPConnectBackend]
+BACKENDS_BY_NAME = {backend.name: backend for backend in BACKENDS}
+
+
+def detect_backends():
+    """
+    检测当前环境下可用的后端
+
+    Returns:
+        按速度排序的可用后端类列表
+    """
+    return sorted((b for b in BACKENDS if b.available()), key=lambda b: b.rank)
+
+
+class ProbeEngine:
+    """
+    统一探测引擎
+
+    选择探测后端后，对后端产出的每一跳统一进行 ASN 标注、TCP 端口检测
+    （可共享 TcpCheckCache）、输出、限时和存储；trace.py、traceroute.py
+    和 traceroute_nonadmin.py 都通过它执行追踪
+    """
+
+    def __init__(self, destination, max_hops=30, timeout=2, queries=3,
+                 backend=None, tcp_port=80, batch=False, enable_tcp_check=False,
+                 tcp_cache=None, asn_index=None, output=None):
+        """
+        初始化
+
+        Args:
+            destination: 目标主机名或IP地址
+            max_hops: 最大跳数
+            timeout: 每次查询超时时间（秒）
+            queries: 每一跳的查询次数
+            backend: 后端名称或 ProbeBackend 实例（None 表示自动选择最快的可用后端）
+            tcp_port: TCP 检测端口（也是 TCP 后端使用的端口）
+            batch: 并行发出所有 TTL 的探测并批量接收（raw / icmp-dgram 后端）
+            enable_tcp_check: 是否对每一跳和目标进行 TCP 端口检测
+            tcp_cache: 多个追踪共享的 TCP 检测结果缓存（可选，见 tcp_cache.py）
+            asn_index: 离线 ASN 索引文件路径（可选，见 asn_lookup.py）
+            output: 输出流（默认 sys.stdout）
+
+        Raises:
+            ValueError: 参数超出范围，或指定的后端不存在/不可用
+        """
+        self.destination = destination
+        self.max_hops = max_hops
+        self.timeout = timeout
+        self.queries = queries
+        self.tcp_port = tcp_port
+        self.batch = batch
+        self.enable_tcp_check = enable_tcp_check
+        self.tcp_cache = tcp_cache
+        self.output = output
+        self.dest_ip = None
+        self.hops = []
+        self.route_hops = {}  # 与 TracerouteNoAdmin.route_hops 格式相同
+        self.enricher = None
+        if asn_index:
+            from asn_lookup import HopEnricher
+            self.enricher = HopEnricher(asn_index)
+        self.backend = self.select_backend(backend)
+
+    def select_backend(self, name=None):
+        """
+        选择后端实例
+
+        Raises:
+            ValueError: 指定的后端不存在或不可用
+        """
+        if isinstance(name, ProbeBackend):
+            return name
+        if name is not None:
+            backend_cls = BACKENDS_BY_NAME.get(name)
+            if backend_cls is None:
+                raise ValueError(f"未知的探测后端 '{name}'")
+            if not backend_cls.available():
+                raise ValueError(f"探测后端 '{name}' 在当前权限/平台下不可用"
+                                 f"（{backend_cls.requirement}）")
+        else:
+            available = detect_backends()
+            if not available:
+                raise ValueError("没有可用的探测后端")
+            backend_cls = available[0]
+
+        kwargs = {'max_hops': self.max_hops, 'timeout': self.timeout,
+                  'queries': self.queries}
+        if backend_cls is TCPConnectBackend:
+            kwargs['port'] = self.tcp_port
+        elif backend_cls.supports_batch:
+            kwargs['batch'] = self.batch
+        return backend_cls(**kwargs)
+
+    def resolve_destination(self):
+        """解析目标主机"""
+        try:
+            self.dest_ip = socket.gethostbyname(self.destination)
+            return True
+        except socket.gaierror as e:
+            print(f"错误: 无法解析主机名 '{self.destination}': {e}", file=self.output)
+            return False
+
+    def test_tcp_port(self, ip, timeout=None):
+        """
+        测试 TCP 端口连通性（有共享缓存时经由缓存）
+
+        Returns:
+            (是否可达, 响应时间ms, 状态描述)
+        """
+        from trace import connect_tcp
+
+        if timeout is None:
+            timeout = self.timeout
+        port = self.tcp_port
+        if self.tcp_cache is not None:
+            return self.tcp_cache.get_or_check(
+                ip, port, lambda: connect_tcp(ip, port, timeout), timeout)
+        return connect_tcp(ip, port, timeout)
+
+    def record(self, hop, tcp_timeout=None):
+        """
+        记录一跳：按需进行 ASN 标注和 TCP 检测，写入 hops 和 route_hops
+
+        Args:
+            hop: 后端产出的 HopRecord（原地写入 TCP 结果）
+            tcp_timeout: TCP 检测超时（秒，默认 self.timeout；为 0 时跳过检测）
+
+        Returns:
+            route_hops 中该跳的条目
+        """
+        entry = {'ip': hop.ip,
+                 'rtts': [None if r != r else round(r, 3) for r in hop.rtts]}
+        if hop.ip and self.enricher:
+            info = self.enricher.annotate(hop.ip)
+            if info:
+                entry['asn'], entry['prefix'], entry['org'] = info
+        if hop.ip and self.enable_tcp_check and tcp_timeout != 0:
+            tcp = self.test_tcp_port(hop.ip, tcp_timeout)
+            entry['tcp'] = tcp
+            hop.tcp_status = TCP_STATUS_CODES.get(tcp[2], TCP_UNREACHABLE)
+            hop.tcp_rtt = tcp[1]
+        self.hops.append(hop)
+        self.route_hops[hop.hop] = entry
+        return entry
+
+    def hop_stream(self):
+        """
+        执行探测并逐跳产出结果（已完成 ASN 标注和 TCP 检测）
+
+        Yields:
+            HopRecord
+        """
+        if self.dest_ip is None and not self.resolve_destination():
+            return
+        self.hops = []
+        self.route_hops = {}
+        for hop in self.backend.trace(self.destination, self.dest_ip):
+            self.record(hop)
+            yield hop
+
+    @property
+    def reached(self):
+        return bool(self.hops) and self.hops[-1].ip == self.dest_ip
+
+    def final_tcp(self, timeout=None):
+        """
+        目标主机的 TCP 检测结果；到达目标时直接复用最后一跳的检测
+
+        Returns:
+            (是否可达, 响应时间ms, 状态描述)
+        """
+        entry = self.route_hops.get(self.hops[-1].hop) if self.reached else None
+        if entry and entry.get('tcp'):
+            return entry['tcp']
+        return self.test_tcp_port(self.dest_ip, timeout)
+
+    def format_hop(self, hop):
+        """格式化一跳（含 ASN 标注和 TCP 检测结果）"""
+        if not hop.ip:
+            return f"{hop.hop:2d}  *  *  *  (请求超时)"
+        rtt_str = '  '.join(f"{r:.2f} ms" if r == r else '*' for r in hop.rtts)
+        line = f"{hop.hop:2d}  {hop.ip:15s}  {rtt_str:30s}"
+        if self.enricher:
+            label = self.enricher.format(hop.ip)
+            if label:
+                line += f"  {label}"
+        tcp = self.route_hops.get(hop.hop, {}).get('tcp')
+        if tcp:
+            reachable, tcp_rtt, status = tcp
+            if reachable:
+                line += f"  | TCP:{self.tcp_port} ✓ {tcp_rtt:.1f}ms"
+            elif status == "关闭":
+                line += f"  | TCP:{self.tcp_port} ✗ 关闭"
+            else:
+                line += f"  | TCP:{self.tcp_port} - {status}"
+        return line.rstrip()
+
+    def trace(self):
+        """
+        执行探测并输出结果
+
+        Returns:
+            是否完成追踪（域名解析失败时为 False）
+        """
+        out = self.output
+        if not self.resolve_destination():
+            return False
+
+        print(f"traceroute to {self.destination} ({self.dest_ip}), "
+              f"{self.max_hops} hops max, 后端: {self.backend.name}"
+              f"{' (并行)' if self.backend.batch else ''}", file=out)
+        if self.enable_tcp_check:
+            print(f"🔌 TCP 端口检测: {self.tcp_port}", file=out)
+        print(file=out)
+
+        for hop in self.hop_stream():
+            print(self.format_hop(hop), file=out, flush=True)
+
+        if self.reached:
+            print(f"\n到达目标: {self.destination} ({self.dest_ip})", file=out)
+        else:
+            print(f"\n未能在 {self.max_hops} 跳内到达目标", file=out)
+
+        if self.enable_tcp_check:
+            reachable, rtt, status = self.final_tcp()
+            print(f"\n🎯 目标主机 TCP 端口测试: {self.dest_ip}:{self.tcp_port}", file=out)
+            if reachable:
+                print(f"   状态: ✅ 端口开放, 响应时间 {rtt:.2f} ms", file=out)
+            elif status == "关闭":
+                print("   状态: ⚠️  端口关闭（但主机可达）", file=out)
+            else:
+                print(f"   状态: ❌ {status}", file=out)
+        return True
+
+    def trace_deadline(self, deadline, min_timeout=0.1):
+        """
+        在总时限内执行追踪，不输出，返回结构化结果
+
+        逐跳探测的后端在每跳开始前按剩余时间重新分配查询次数和超时；
+        一次性发出探测的后端（系统命令、并行模式）按轮数分摊单次超时；
+        每跳的 TCP 检测超时按剩余时间分摊。时间用完时停止后端，
+        保留已得到的跳（同时更新 hops 和 route_hops）
+
+        Args:
+            deadline: 总时限（秒，包括域名解析）
+            min_timeout: 单次探测/TCP 检测超时下限（秒）
+
+        Returns:
+            deadline.PartialTrace
+        """
+        from deadline import PartialTrace, TraceBudget, resolve
+
+        backend = self.backend
+        budget = TraceBudget(deadline, self.timeout, backend.queries, min_timeout)
+        result = PartialTrace(self.destination, deadline=deadline)
+        self.hops = []
+        self.route_hops = {}
+        self.dest_ip = resolve(self.destination, budget)
+        if self.dest_ip is None:
+            result.expired = budget.expired()
+            result.elapsed = budget.elapsed()
+            return result
+        result.dest_ip = self.dest_ip
+
+        full_queries = backend.queries
+        rounds = backend.plan_rounds()
+        backend.expires = budget.expires
+        if rounds is not None:
+            backend.timeout = budget.share(rounds)
+        stream = backend.trace(self.destination, self.dest_ip)
+        try:
+            hops_left = self.max_hops
+            while True:
+                if rounds is None:
+                    plan = budget.plan_hop(hops_left)
+                    if plan is None:
+                        result.expired = True
+                        break
+                    backend.queries, backend.timeout = plan
+                queries, timeout = backend.queries, backend.timeout
+                hop = next(stream, None)
+                if hop is None:
+                    result.expired = budget.expired()
+                    break
+                hops_left = self.max_hops - hop.hop
+
+                # 完整：查询次数未被削减，且每次查询要么有响应，要么等满了正常超时
+                complete = queries == full_queries and (
+                    timeout >= self.timeout or
+                    bool(hop.ip) and all(r == r for r in hop.rtts))
+                tcp_timeout = None
+                if hop.ip and self.enable_tcp_check:
+                    # 余下的跳和最终检测共同分摊剩余时间
+                    tcp_timeout = budget.share(hops_left + 2)
+                    if tcp_timeout <= 0:
+                        complete = False
+                entry = self.record(hop, tcp_timeout)
+                tcp = entry.get('tcp')
+                if tcp and tcp[2] == "超时" and tcp_timeout < self.timeout:
+                    complete = False
+                result.add(hop, complete)
+                if hop.ip == self.dest_ip:
+                    result.reached = True
+                    break
+        except OSError as e:
+            # 没有权限或无法创建套接字：保留已探测的跳，不再继续
+            result.error = str(e)
+        finally:
+            stream.close()
+            backend.expires = None
+            backend.timeout = self.timeout
+            backend.queries = full_queries
+
+        if self.enable_tcp_check and not budget.expired():
+            result.tcp = self.final_tcp(budget.share(1))
+
+        result.elapsed = budget.elapsed()
+        return result
+
+    def save(self, store_path):
+        """将本次结果追加写入历史存储"""
+        store = TraceStore(store_path)
+        try:
+            store.append(self.dest_ip, self.hops)
+        finally:
+            store.close()
+
+
+def print_backends():
+    """打印所有后端及其可用性"""
+    cap = has_cap_net_raw()
+    groups = ping_group_range()
+    print("权限检测:")
+    if cap is not None:
+        print(f"  CAP_NET_RAW: {'有' if cap else '无'}")
+    if groups is not None:
+        print(f"  ping_group_range: {groups[0]} - {groups[1]} (当前 gid: {os.getgid()})")
+    print("\n探测后端（按速度排序）:")
+    for backend in sorted(BACKENDS, key=lambda b: b.rank):
+        mark = "✓" if backend.available() else "✗"
+        print(f"  {mark} {backend.name:12s} {backend.description}")
+
+
+def print_usage():
+    """打印使用说明"""
+    print("用法: python probe_engine.py <目标主机> [选项]")
+    print("\n选项:")
+    print("  -b, --backend <名称>     探测后端: raw, icmp-dgram, udp, system, tcp (默认: 自动)")
+    print("  -m, --max-hops <数字>    最大跳数 (默认: 30, 最大 255)")
+    print("  -t, --timeout <秒数>     超时时间 (默认: 2)")
+    print("  -q, --queries <数字>     每跳查询次数 (默认: 3, 最大 256)")
+    print("  -p, --port <端口>        TCP 检测/TCP 后端端口 (默认: 80)")
+    print("  --tcp-check              对每一跳和目标进行 TCP 端口检测")
+    print("  -d, --deadline <秒数>    总时限，到时返回部分结果（每跳标记是否完整）")
+    print("  --asn <索引文件>         使用离线 ASN 索引标注每一跳")
+    print("  -P, --parallel           一次发出所有 TTL 的探测并批量接收 (raw/icmp-dgram)")
+    print("  --store <目录>           将结果追加写入历史存储目录")
+    print("  --list-backends          列出可用的探测后端")
+    print("  -h, --help               显示此帮助信息")
+    print("\n示例:")
+    print("  python probe_engine.py www.baidu.com")
+    print("  python probe_engine.py 8.8.8.8 -b udp -q 1")
+    print("  python probe_engine.py 8.8.8.8 -P")
+
+
+def main():
+    """主函数"""
+    if len(sys.argv) < 2:
+        print_usage()
+        sys.exit(1)
+
+    destination = None
+    backend = None
+    max_hops = 30
+    timeout = 2
+    queries = 3
+    tcp_port = 80
+    store_path = None
+    batch = False
+    tcp_check = False
+    deadline = None
+    asn_index = None
+
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+
+        if arg in ['-h', '--help']:
+            print_usage()
+            sys.exit(0)
+        elif arg == '--list-backends':
+            print_backends()
+            sys.exit(0)
+        elif arg in ['-P', '--parallel']:
+            batch = True
+            i += 1
+        elif arg == '--tcp-check':
+            tcp_check = True
+            i += 1
+        elif arg in ['-b', '--backend', '--store', '--asn']:
+            if i + 1 >= len(sys.argv):
+                print(f"错误: {arg} 需要一个参数")
+                sys.exit(1)
+            if arg == '--store':
+                store_path = sys.argv[i + 1]
+            elif arg == '--asn':
+                asn_index = sys.argv[i + 1]
+            else:
+                backend = sys.argv[i + 1]
+            i += 2
+        elif arg in ['-d', '--deadline']:
+            try:
+                deadline = float(sys.argv[i + 1])
+                if deadline <= 0:
+                    raise ValueError
+            except (IndexError, ValueError):
+                print(f"错误: {arg} 需要一个正数参数")
+                sys.exit(1)
+            i += 2
+        elif arg in ['-m', '--max-hops', '-q', '--queries', '-p', '--port']:
+            if i + 1 >= len(sys.argv):
+                print(f"错误: {arg} 需要一个参数")
+                sys.exit(1)
+            try:
+                value = int(sys.argv[i + 1])
+                if value < 1:
+                    raise ValueError
+            except ValueError:
+                print(f"错误: 无效的参数值 '{sys.argv[i + 1]}'")
+                sys.exit(1)
+            if arg in ['-m', '--max-hops']:
+                if value > MAX_TTL:
+                    print(f"错误: 无效的最大跳数值 '{value}' (1-{MAX_TTL})")
+                    sys.exit(1)
+                max_hops = value
+            elif arg in ['-q', '--queries']:
+                if value > MAX_QUERIES:
+                    print(f"错误: 无效的查询次数值 '{value}' (1-{MAX_QUERIES})")
+                    sys.exit(1)
+                queries = value
+            else:
+                tcp_port = value
+            i += 2
+        elif arg in ['-t', '--timeout']:
+            if i + 1 < len(sys.argv):
+                try:
+                    timeout = float(sys.argv[i + 1])
+                    i += 2
+                except ValueError:
+                    print(f"错误: 无效的超时值 '{sys.argv[i + 1]}'")
+                    sys.exit(1)
+            else:
+                print("错误: -t/--timeout 需要一个参数")
+                sys.exit(1)
+        elif arg.startswith('-'):
+            print(f"错误: 未知选项 '{arg}'")
+            print_usage()
+            sys.exit(1)
+        else:
+            if destination is None:
+                destination = arg
+                i += 1
+            else:
+                print(f"错误: 多余的参数 '{arg}'")
+                print_usage()
+                sys.exit(1)
+
+    if destination is None:
+        print("错误: 未指定目标主机")
+        print_usage()
+        sys.exit(1)
+
+    try:
+        engine = ProbeEngine(destination, max_hops=max_hops, timeout=timeout,
+                             queries=queries, backend=backend, tcp_port=tcp_port,
+                             batch=batch, enable_tcp_check=tcp_check,
+                             asn_index=asn_index)
+    except ValueError as e:
+        print(f"错误: {e}")
+        sys.exit(1)
+
+    try:
+        if deadline is not None:
+            from deadline import format_partial
+            result = engine.trace_deadline(deadline)
+            print(format_partial(result))
+            success = result.dest_ip is not None and result.error is None
+        else:
+            success = engine.trace()
+        if success and store_path:
+            engine.save(store_path)
+            print(f"💾 结果已保存到: {store_path}")
+        if not success:
+            sys.exit(1)
+    except KeyboardInterrupt:
+        print("\n\n中断: 用户取消操作")
+        sys.exit(0)
+    except Exception as e:
+        print(f"\n错误: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
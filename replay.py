@@ -0,0 +1,550 @@
+#!/usr/bin/env python3
+"""
+Replay - 追踪结果回放与模拟
+不访问网络，将录制的 traceroute 文本或探测日志（JSON Lines）送入
+TracerouteNoAdmin 的解析、TCP 检测（桩）和输出流程，可全速或按录制速度回放；
+并提供合成拓扑生成器，用于生成任意规模的模拟输出、测量各环节的每秒行数
+"""
+
+import io
+import json
+import random
+import sys
+import time
+from contextlib import redirect_stdout
+
+from trace import TracerouteNoAdmin
+
+
+# 默认的 TCP 桩结果（路由器通常不监听业务端口）
+DEFAULT_TCP_RESULT = (False, None, "超时")
+
+
+class ReplayTracer(TracerouteNoAdmin):
+    """使用录制数据代替系统命令和网络连接的 TracerouteNoAdmin"""
+
+    def __init__(self, destination, dest_ip=None, tcp_port=80,
+                 enable_tcp_check=True, tcp_results=None, asn_index=None):
+        """
+        初始化
+
+        Args:
+            destination: 目标主机
+            dest_ip: 录制时解析得到的目标 IP（默认与 destination 相同）
+            tcp_port: TCP 端口（仅用于显示）
+            enable_tcp_check: 是否执行 TCP 检测（桩）
+            tcp_results: {IP: (是否可达, 响应时间ms, 状态描述)} 录制的 TCP 结果
+            asn_index: 离线 ASN 索引文件路径（可选）
+        """
+        super().__init__(destination, tcp_port=tcp_port,
+                         enable_tcp_check=enable_tcp_check, asn_index=asn_index)
+        self.dest_ip = dest_ip or destination
+        # 录制的输出都是 Unix traceroute 格式
+        self.is_windows = False
+        self.tcp_results = tcp_results if tcp_results is not None else {}
+
+    def resolve_destination(self):
+        return True
+
+    def test_tcp_port(self, ip, port=None, timeout=None):
+        """TCP 检测桩：返回录制结果，未录制的 IP 视为超时，不产生网络连接"""
+        return self.tcp_results.get(ip, DEFAULT_TCP_RESULT)
+
+
+def format_hop_line(hop, ip, rtts):
+    """
+    生成 Unix traceroute 格式的一行
+
+    Args:
+        hop: 跳数
+        ip: 响应 IP（None 表示超时）
+        rtts: RTT 列表（毫秒，None 表示该次查询超时）
+    """
+    if ip is None or all(r is None for r in rtts):
+        return f"{hop:2d}  * * *\n"
+    parts = ['*' if r is None else f"{r:.3f} ms" for r in rtts]
+    return f"{hop:2d}  {ip} ({ip})  {'  '.join(parts)}\n"
+
+
+def read_text_traces(stream):
+    """
+    按标题行切分录制的 traceroute 文本
+
+    Yields:
+        (目标, 目标IP, 行列表)
+    """
+    destination = None
+    dest_ip = None
+    lines = []
+    for line in stream:
+        if line.startswith('traceroute to '):
+            if destination is not None:
+                yield destination, dest_ip, lines
+            # "traceroute to host (1.2.3.4), 30 hops max, 60 byte packets"
+            head = line[len('traceroute to '):].split(',', 1)[0]
+            name, _, rest = head.partition(' (')
+            destination = name.strip()
+            dest_ip = rest.rstrip(')').strip() or destination
+            lines = []
+        elif destination is not None:
+            lines.append(line)
+    if destination is not None:
+        yield destination, dest_ip, lines
+
+
+def read_probe_log(stream):
+    """
+    读取录制的探测日志（JSON Lines），每行一跳：
+    {"t": 相对时间秒, "dest": 目标, "dest_ip": IP, "hop": 跳数,
+     "ip": 响应IP或null, "rtts": [毫秒或null], "tcp": [可达, 毫秒, 状态]}
+    同一目标的连续记录组成一次追踪，跳数回到 1 时开始新的追踪
+
+    Yields:
+        (目标, 目标IP, [(时间, 行)], {IP: TCP结果})
+    """
+    current = None
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        dest = record['dest']
+        if current is None or dest != current[0] or record['hop'] <= current[4]:
+            if current is not None:
+                yield current[0], current[1], current[2], current[3]
+            current = [dest, record.get('dest_ip', dest), [], {}, 0]
+        text = format_hop_line(record['hop'], record.get('ip'), record.get('rtts', []))
+        current[2].append((record.get('t'), text))
+        if record.get('ip') and record.get('tcp'):
+            current[3][record['ip']] = tuple(record['tcp'])
+        current[4] = record['hop']
+    if current is not None:
+        yield current[0], current[1], current[2], current[3]
+
+
+class ReplaySession:
+    """回放会话：把录制数据送入解析和输出流程，并统计吞吐量"""
+
+    def __init__(self, sink=None, store=None, enable_tcp_check=True,
+                 speed=None, asn_index=None):
+        """
+        初始化
+
+        Args:
+            sink: 显示输出的目标流（None 表示丢弃）
+            store: TraceStore（可选，每次追踪结束后写入）
+            enable_tcp_check: 是否执行 TCP 检测（桩）
+            speed: 回放速度倍数（None 表示全速；1.0 为录制速度，仅探测日志有时间信息）
+            asn_index: 离线 ASN 索引文件路径（可选）
+        """
+        self.sink = sink if sink is not None else io.StringIO()
+        self.discard = sink is None
+        self.store = store
+        self.enable_tcp_check = enable_tcp_check
+        self.speed = speed
+        self.asn_index = asn_index
+        self.traces = 0
+        self.lines = 0
+        self.hops = 0
+        self.elapsed = 0.0
+
+    def _tracer(self, destination, dest_ip, tcp_results=None):
+        return ReplayTracer(destination, dest_ip, enable_tcp_check=self.enable_tcp_check,
+                            tcp_results=tcp_results, asn_index=self.asn_index)
+
+    def _finish(self, tracer):
+        self.traces += 1
+        if self.store is not None:
+            self.store.append_route_hops(tracer.dest_ip, tracer.route_hops)
+        if self.discard:
+            # 丢弃模式下及时清空缓冲，避免内存随回放量增长
+            self.sink.seek(0)
+            self.sink.truncate()
+
+    def replay_text(self, stream):
+        """回放录制的 traceroute 文本"""
+        start = time.perf_counter()
+        with redirect_stdout(self.sink):
+            for destination, dest_ip, lines in read_text_traces(stream):
+                tracer = self._tracer(destination, dest_ip)
+                for line in lines:
+                    self.lines += 1
+                    if tracer.handle_line(line) is not None:
+                        self.hops += 1
+                self._finish(tracer)
+        self.elapsed += time.perf_counter() - start
+
+    def replay_probe_log(self, stream):
+        """回放录制的探测日志，speed 不为 None 时按记录的时间间隔等待"""
+        start = time.perf_counter()
+        first = None
+        with redirect_stdout(self.sink):
+            for destination, dest_ip, entries, tcp_results in read_probe_log(stream):
+                tracer = self._tracer(destination, dest_ip, tcp_results)
+                for offset, line in entries:
+                    if self.speed and offset is not None:
+                        if first is None:
+                            first = (offset, time.perf_counter())
+                        due = first[1] + (offset - first[0]) / self.speed
+                        delay = due - time.perf_counter()
+                        if delay > 0:
+                            time.sleep(delay)
+                    self.lines += 1
+                    if tracer.handle_line(line) is not None:
+                        self.hops += 1
+                self._finish(tracer)
+        self.elapsed += time.perf_counter() - start
+
+    def summary(self):
+        rate = self.lines / self.elapsed if self.elapsed > 0 else 0
+        return (f"追踪 {self.traces}  行 {self.lines}  跳 {self.hops}  "
+                f"用时 {self.elapsed:.2f} 秒  {rate:,.0f} 行/秒")
+
+
+class SyntheticTopology:
+    """
+    合成拓扑生成器
+
+    分层结构：本地网关 → 汇聚层 → 骨干层（若干跳）→ 目标侧边缘 → 目标。
+    骨干层按树形生长（每台路由器只有一个上游），与按目标路由的真实网络一样，
+    同一路由器出现在相同跳数时其前面的路径也相同；
+    每个目标的路径由随机种子决定，可重复生成任意数量的追踪
+    """
+
+    def __init__(self, destinations=1000, aggregation=8, fanout=4, seed=0,
+                 loss=0.02, silent=0.05, queries=3):
+        """
+        初始化
+
+        Args:
+            destinations: 目标数量
+            aggregation: 汇聚层路由器数量
+            fanout: 骨干层每台路由器的下游分支数
+            seed: 随机种子
+            loss: 单次查询丢失概率
+            silent: 路由器不响应 ICMP（整跳超时）的概率
+            queries: 每跳查询次数
+        """
+        self.rng = random.Random(seed)
+        self.loss = loss
+        self.queries = queries
+        rng = self.rng
+        gateway = '192.168.1.1'
+        aggs = [f"10.{i}.0.1" for i in range(aggregation)]
+        # 每台路由器的基础时延（毫秒），沿路径递增
+        latency = {gateway: rng.uniform(0.3, 1.0)}
+        for ip in aggs:
+            latency[ip] = latency[gateway] + rng.uniform(0.5, 5.0)
+        children = {}  # (上游路由器, 分支) -> 路由器
+        silent_set = set()
+
+        def child(parent, branch):
+            ip = children.get((parent, branch))
+            if ip is None:
+                n = len(children) + 1
+                ip = f"202.{97 + (n >> 16) % 100}.{(n >> 8) % 256}.{n % 256}"
+                children[(parent, branch)] = ip
+                latency[ip] = latency[parent] + rng.uniform(0.5, 15.0)
+                if rng.random() < silent:
+                    silent_set.add(ip)
+            return ip
+
+        self.paths = []
+        for i in range(destinations):
+            dest_ip = f"{100 + i // 65536 % 100}.{i // 256 % 256}.{i % 256}.1"
+            path = [gateway, aggs[i % aggregation]]
+            for _ in range(rng.randint(3, 8)):
+                path.append(child(path[-1], rng.randrange(fanout)))
+            edge = f"{dest_ip[:-2]}.254"
+            latency[edge] = latency[path[-1]] + rng.uniform(0.5, 15.0)
+            latency[dest_ip] = latency[edge] + rng.uniform(0.2, 2.0)
+            path.extend([edge, dest_ip])
+            base = [latency[ip] for ip in path]
+            silent_hops = {j for j, ip in enumerate(path) if ip in silent_set}
+            self.paths.append((dest_ip, path, base, silent_hops))
+
+    def trace_hops(self, index):
+        """
+        生成第 index 个目标的一次追踪
+
+        Returns:
+            (目标IP, [(跳数, IP, rtts)])
+        """
+        dest_ip, path, base, silent_hops = self.paths[index % len(self.paths)]
+        rng = self.rng
+        hops = []
+        for j, ip in enumerate(path):
+            if j in silent_hops:
+                hops.append((j + 1, None, []))
+                continue
+            rtts = [None if rng.random() < self.loss else base[j] * rng.uniform(1.0, 1.3)
+                    for _ in range(self.queries)]
+            hops.append((j + 1, ip, rtts))
+        return dest_ip, hops
+
+    def text_lines(self, traces):
+        """
+        生成 traceroute 文本
+
+        Yields:
+            文本行
+        """
+        for n in range(traces):
+            dest_ip, hops = self.trace_hops(n)
+            yield f"traceroute to {dest_ip} ({dest_ip}), 30 hops max, 60 byte packets\n"
+            for hop, ip, rtts in hops:
+                yield format_hop_line(hop, ip, rtts)
+
+    def probe_log_lines(self, traces, interval=0.01):
+        """
+        生成探测日志（JSON Lines）
+
+        Args:
+            traces: 追踪次数
+            interval: 相邻两跳的录制时间间隔（秒）
+        """
+        t = 0.0
+        for n in range(traces):
+            dest_ip, hops = self.trace_hops(n)
+            for hop, ip, rtts in hops:
+                record = {'t': round(t, 6), 'dest': dest_ip, 'dest_ip': dest_ip,
+                          'hop': hop, 'ip': ip,
+                          'rtts': [None if r is None else round(r, 3) for r in rtts]}
+                if ip == dest_ip:
+                    record['tcp'] = [True, round(base_rtt(rtts), 3), "开放"]
+                yield json.dumps(record) + '\n'
+                t += interval
+
+
+def check_loss(topology, traces):
+    """
+    回放合成追踪，检查解析得到的每次查询丢失与生成时一致
+
+    Args:
+        topology: SyntheticTopology
+        traces: 追踪次数
+
+    Returns:
+        (生成的丢失次数, 回放得到的丢失次数, 不一致的跳数)
+    """
+    generated = replayed = mismatched = 0
+    with redirect_stdout(io.StringIO()) as sink:
+        for n in range(traces):
+            dest_ip, hops = topology.trace_hops(n)
+            tracer = ReplayTracer(dest_ip, enable_tcp_check=False)
+            for hop, ip, rtts in hops:
+                tracer.handle_line(format_hop_line(hop, ip, rtts))
+                entry = tracer.route_hops.get(hop, {})
+                # 全部查询丢失的跳输出为 "* * *"，与整跳超时相同
+                if all(r is None for r in rtts):
+                    ip, rtts = None, []
+                lost = [r is None for r in rtts]
+                got = [r is None for r in entry.get('rtts', [])]
+                generated += sum(lost)
+                replayed += sum(got)
+                if entry.get('ip') != ip or lost != got:
+                    mismatched += 1
+            sink.seek(0)
+            sink.truncate()
+    return generated, replayed, mismatched
+
+
+def base_rtt(rtts):
+    """取第一个有效 RTT，全部丢失时为 0"""
+    for r in rtts:
+        if r is not None:
+            return r
+    return 0.0
+
+
+def benchmark(lines, baseline=None):
+    """
+    分环节测量回放吞吐量
+
+    Args:
+        lines: traceroute 文本行列表
+        baseline: 上一次的结果 {环节: 行/秒}（可选，用于对比）
+
+    Returns:
+        {环节: 行/秒}
+    """
+    import tempfile
+    from trace_store import TraceStore
+
+    results = {}
+
+    parser = ReplayTracer('bench')
+    start = time.perf_counter()
+    for line in lines:
+        parser.parse_traceroute_line(line)
+    results['parse'] = len(lines) / (time.perf_counter() - start)
+
+    session = ReplaySession(enable_tcp_check=False)
+    session.replay_text(lines)
+    results['parse+format'] = session.lines / session.elapsed
+
+    session = ReplaySession()
+    session.replay_text(lines)
+    results['parse+format+tcp'] = session.lines / session.elapsed
+
+    with tempfile.TemporaryDirectory() as path:
+        store = TraceStore(path)
+        session = ReplaySession(store=store)
+        session.replay_text(lines)
+        store.close()
+    results['parse+format+tcp+store'] = session.lines / session.elapsed
+
+    for name, rate in results.items():
+        line = f"{name:26s} {rate:12,.0f} 行/秒"
+        if baseline and baseline.get(name):
+            line += f"  ({rate / baseline[name]:.2f}x 基线)"
+        print(line)
+    return results
+
+
+def print_usage():
+    """打印使用说明"""
+    print("用法: python replay.py <命令> [参数]")
+    print("\n命令:")
+    print("  run <文件> [选项]                 回放录制的 traceroute 文本或探测日志（.jsonl）")
+    print("      --speed <倍数>                按录制速度回放（仅探测日志，默认全速）")
+    print("      --show                        显示输出（默认丢弃）")
+    print("      --store <目录>                将结果写入历史存储")
+    print("      --no-tcp                      不执行 TCP 检测桩")
+    print("      --profile                     用 cProfile 输出耗时最多的函数")
+    print("  generate <追踪数> [选项]          输出合成追踪到标准输出")
+    print("      --jsonl                       输出探测日志格式")
+    print("      -d, --destinations <数量>     目标数量 (默认: 1000)")
+    print("      --seed <数字>                 随机种子 (默认: 0)")
+    print("  check [追踪数]                    检查回放解析出的丢失与合成数据一致 (默认: 20000)")
+    print("  bench [追踪数] [选项]             分环节测量吞吐量 (默认: 20000 次追踪)")
+    print("      --save <文件>                 保存结果为基线")
+    print("      --baseline <文件>             与保存的基线对比")
+    print("\n示例:")
+    print("  python replay.py generate 100000 > traces.txt")
+    print("  python replay.py run traces.txt --store ./traces")
+    print("  python replay.py generate 1000 --jsonl > probes.jsonl")
+    print("  python replay.py run probes.jsonl --speed 1 --show")
+    print("  python replay.py bench --save baseline.json")
+
+
+def _option_value(args, i, name):
+    if i + 1 >= len(args):
+        print(f"错误: {name} 需要一个参数")
+        sys.exit(1)
+    return args[i + 1]
+
+
+def main():
+    """主函数"""
+    args = sys.argv[1:]
+    if not args or args[0] in ['-h', '--help']:
+        print_usage()
+        sys.exit(0 if args else 1)
+
+    command = args[0]
+    positional = []
+    options = {'speed': None, 'show': False, 'store': None, 'tcp': True,
+               'jsonl': False, 'destinations': 1000, 'seed': 0,
+               'save': None, 'baseline': None, 'profile': False}
+    i = 1
+    try:
+        while i < len(args):
+            arg = args[i]
+            if arg == '--speed':
+                options['speed'] = float(_option_value(args, i, arg))
+                i += 2
+            elif arg in ['-d', '--destinations']:
+                options['destinations'] = int(_option_value(args, i, arg))
+                i += 2
+            elif arg == '--seed':
+                options['seed'] = int(_option_value(args, i, arg))
+                i += 2
+            elif arg in ['--store', '--save', '--baseline']:
+                options[arg[2:]] = _option_value(args, i, arg)
+                i += 2
+            elif arg == '--show':
+                options['show'] = True
+                i += 1
+            elif arg == '--no-tcp':
+                options['tcp'] = False
+                i += 1
+            elif arg == '--jsonl':
+                options['jsonl'] = True
+                i += 1
+            elif arg == '--profile':
+                options['profile'] = True
+                i += 1
+            elif arg.startswith('-'):
+                print(f"错误: 未知选项 '{arg}'")
+                sys.exit(1)
+            else:
+                positional.append(arg)
+                i += 1
+    except ValueError as e:
+        print(f"错误: 无效的参数值: {e}")
+        sys.exit(1)
+
+    if command == 'run':
+        if not positional:
+            print("错误: 未指定回放文件")
+            sys.exit(1)
+        store = None
+        if options['store']:
+            from trace_store import TraceStore
+            store = TraceStore(options['store'])
+        session = ReplaySession(sink=sys.stdout if options['show'] else None,
+                                store=store, enable_tcp_check=options['tcp'],
+                                speed=options['speed'])
+        replay = (session.replay_probe_log if positional[0].endswith('.jsonl')
+                  else session.replay_text)
+        with open(positional[0], encoding='utf-8', errors='ignore') as f:
+            if options['profile']:
+                import cProfile
+                import pstats
+                profiler = cProfile.Profile()
+                profiler.runcall(replay, f)
+                pstats.Stats(profiler, stream=sys.stderr).sort_stats('tottime').print_stats(15)
+            else:
+                replay(f)
+        if store is not None:
+            store.close()
+        print(session.summary(), file=sys.stderr)
+    elif command == 'generate':
+        traces = int(positional[0]) if positional else 1000
+        topology = SyntheticTopology(options['destinations'], seed=options['seed'])
+        lines = (topology.probe_log_lines(traces) if options['jsonl']
+                 else topology.text_lines(traces))
+        sys.stdout.writelines(lines)
+    elif command == 'check':
+        traces = int(positional[0]) if positional else 20000
+        topology = SyntheticTopology(options['destinations'], seed=options['seed'])
+        generated, replayed, mismatched = check_loss(topology, traces)
+        print(f"生成丢失 {generated} 次, 回放丢失 {replayed} 次, 不一致的跳 {mismatched}")
+        if mismatched or generated != replayed:
+            print("❌ 回放结果与合成数据不一致")
+            sys.exit(1)
+        print("✅ 回放结果与合成数据一致")
+    elif command == 'bench':
+        traces = int(positional[0]) if positional else 20000
+        topology = SyntheticTopology(options['destinations'], seed=options['seed'])
+        lines = list(topology.text_lines(traces))
+        print(f"合成 {traces} 次追踪, {len(lines)} 行")
+        print("=" * 60)
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as f:
+                baseline = json.load(f)
+        results = benchmark(lines, baseline)
+        if options['save']:
+            with open(options['save'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+            print(f"💾 基线已保存到: {options['save']}")
+    else:
+        print(f"错误: 未知命令 '{command}'")
+        print_usage()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+TCP Cache - 跨追踪共享的 TCP 检测结果缓存
+批量追踪时同一批共享路由器会在几秒内被反复检测同一个端口。
+按 (IP, 端口) 缓存检测结果，开放/关闭/超时/不可达可分别设置有效期；
+"超时"结果记录检测时使用的超时时间，只对不长于它的检测有效；
+并发请求同一个 (IP, 端口) 时只发起一次连接，其余调用等待其结果
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+# 各状态默认的缓存有效期（秒）
+DEFAULT_TTLS = {
+    "开放": 30.0,
+    "关闭": 30.0,
+    "超时": 10.0,
+    "不可达": 10.0,
+}
+
+
+class _InFlight:
+    """正在进行的一次检测"""
+
+    __slots__ = ('done', 'result', 'timeout')
+
+    def __init__(self, timeout):
+        self.done = threading.Event()
+        self.result = None
+        self.timeout = timeout
+
+
+def _covers(result, checked_timeout, timeout):
+    """检测结果能否用于超时为 timeout 的检测（"超时"结果要求当时的超时不短于它）"""
+    if result[2] != "超时" or timeout is None:
+        return True
+    return checked_timeout is not None and checked_timeout >= timeout
+
+
+class TcpCheckCache:
+    """线程安全的 TCP 检测结果缓存"""
+
+    def __init__(self, ttls=None, max_entries=65536, clock=time.monotonic):
+        """
+        初始化
+
+        Args:
+            ttls: {状态描述: 有效期秒数}，未列出的状态使用 DEFAULT_TTLS，
+                  有效期为 0 的状态不缓存
+            max_entries: 最多缓存的条目数（超出时淘汰最久未使用的）
+            clock: 时钟函数
+        """
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()  # (ip, port) -> (过期时间, 结果, 检测超时)
+        self._inflight = {}            # (ip, port) -> _InFlight
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0     # 等待其他线程进行中检测的次数
+
+    def get(self, ip, port, timeout=None):
+        """
+        查询未过期的缓存结果
+
+        Args:
+            ip: 目标 IP
+            port: 端口
+            timeout: 本次检测将使用的超时时间（秒）；缓存的"超时"结果
+                     只有在当时的超时不短于它时才有效，None 表示不限
+
+        Returns:
+            (是否可达, 响应时间ms, 状态描述) 或 None
+        """
+        with self._lock:
+            return self._lookup((ip, port), timeout)
+
+    def _lookup(self, key, timeout):
+        """在持有锁时查询缓存"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, result, checked_timeout = entry
+        if expires <= self.clock():
+            del self._entries[key]
+            return None
+        if not _covers(result, checked_timeout, timeout):
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def put(self, ip, port, result, timeout=None):
+        """
+        按结果状态对应的有效期写入缓存
+
+        Args:
+            ip: 目标 IP
+            port: 端口
+            result: (是否可达, 响应时间ms, 状态描述)
+            timeout: 检测时使用的超时时间（秒）
+        """
+        ttl = self.ttls.get(result[2], 0)
+        if ttl <= 0:
+            return
+        key = (ip, port)
+        with self._lock:
+            self._entries[key] = (self.clock() + ttl, result, timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_check(self, ip, port, check, timeout=None):
+        """
+        返回缓存结果；未命中时调用 check()，并发调用同一 (IP, 端口) 时只执行一次
+
+        Args:
+            ip: 目标 IP
+            port: 端口
+            check: 无参函数，返回 (是否可达, 响应时间ms, 状态描述)
+            timeout: check() 使用的超时时间（秒）
+
+        Returns:
+            (是否可达, 响应时间ms, 状态描述)
+        """
+        key = (ip, port)
+        while True:
+            with self._lock:
+                result = self._lookup(key, timeout)
+                if result is not None:
+                    self.hits += 1
+                    return result
+                flight = self._inflight.get(key)
+                if flight is None:
+                    flight = self._inflight[key] = _InFlight(timeout)
+                    self.misses += 1
+                    break
+
+            flight.done.wait()
+            result = flight.result
+            # 执行检测的线程出错，或其"超时"结果的超时比本次短时重新检测
+            if result is not None and _covers(result, flight.timeout, timeout):
+                with self._lock:
+                    self.waits += 1
+                return result
+
+        try:
+            flight.result = check()
+            self.put(ip, port, flight.result, timeout)
+            return flight.result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def summary(self):
+        total = self.hits + self.misses + self.waits
+        saved = (self.hits + self.waits) / total if total else 0.0
+        return (f"TCP 检测缓存: 命中 {self.hits}, 合并 {self.waits}, "
+                f"实际连接 {self.misses}, 节省 {saved:.0%}")
@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+"""
+TCP Sweep - 批量 TCP 可达性检测
+对大量 host:port 并发进行非阻塞 connect 检测，实时输出结果，
+仅对超时或不可达的目标再运行路由追踪（端口关闭说明路径可达，无需追踪）
+"""
+
+import errno
+import selectors
+import socket
+import sys
+import time
+from collections import deque
+
+from trace import TracerouteNoAdmin, classify_connect_result
+
+
+# 需要路由追踪的检测结果（"关闭"说明已收到目标主机的 RST，路径是通的）
+TRACE_STATUSES = ("超时", "不可达")
+
+# 非阻塞 connect 进行中的错误码（Windows 为 WSAEWOULDBLOCK）
+_IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, 10035)
+
+
+def _is_ip(host):
+    """是否为 IPv4 地址字面量（无需解析）"""
+    try:
+        socket.inet_aton(host)
+    except (OSError, UnicodeError):
+        return False
+    return host.count('.') == 3
+
+
+class SweepResult:
+    """单个目标的检测结果"""
+
+    __slots__ = ('host', 'port', 'ip', 'reachable', 'rtt', 'status')
+
+    def __init__(self, host, port, ip, reachable, rtt, status):
+        self.host = host
+        self.port = port
+        self.ip = ip
+        self.reachable = reachable
+        self.rtt = rtt
+        self.status = status
+
+    def __repr__(self):
+        return (f"SweepResult({self.host}:{self.port}, ip={self.ip!r}, "
+                f"status={self.status!r}, rtt={self.rtt})")
+
+
+def parse_target(line, default_port=80):
+    """
+    解析目标行
+
+    支持 "host:port"、"host port" 和 "host"（使用默认端口）
+
+    Returns:
+        (host, port) 或 None（空行/注释）
+    """
+    line = line.split('#', 1)[0].strip()
+    if not line:
+        return None
+    if ' ' in line or '\t' in line:
+        host, port = line.split(None, 1)
+    elif ':' in line:
+        host, port = line.rsplit(':', 1)
+    else:
+        return line, default_port
+    port = int(port)
+    if not (1 <= port <= 65535):
+        raise ValueError(f"无效的端口号 '{port}'")
+    return host, port
+
+
+class TcpSweeper:
+    """基于 selectors 的非阻塞 TCP connect 检测引擎"""
+
+    def __init__(self, timeout=2, concurrency=256, per_host=8, resolvers=16):
+        """
+        初始化
+
+        Args:
+            timeout: 单次连接超时时间（秒）
+            concurrency: 同时进行的连接数上限
+            per_host: 同一 IP 同时进行的连接数上限
+            resolvers: 并发解析主机名的线程数
+        """
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.resolvers = resolvers
+        self._dns_cache = {}
+
+    @staticmethod
+    def _lookup(host):
+        try:
+            return socket.gethostbyname(host)
+        except (socket.gaierror, UnicodeError):
+            return None
+
+    def resolve(self, host):
+        """解析主机名（带缓存），失败返回 None"""
+        if host not in self._dns_cache:
+            self._dns_cache[host] = self._lookup(host)
+        return self._dns_cache[host]
+
+    def sweep(self, targets):
+        """
+        并发检测所有目标
+
+        目标按需读取：IP 地址直接进入连接队列，主机名交给解析线程池，
+        解析完成后唤醒事件循环，解析与连接同时进行
+
+        Args:
+            targets: (host, port) 可迭代对象
+
+        Yields:
+            SweepResult，按完成顺序
+        """
+        targets = iter(targets)
+        exhausted = False
+        queues = {}      # ip -> deque[(host, port)]
+        hosts = deque()  # 有待检测目标的 IP（轮询顺序）
+        queued = 0       # 已解析、等待连接的目标数
+        waiting = {}     # 正在解析的主机名 -> [port]
+        resolved = deque()   # 解析线程完成的 (主机名, IP)
+        executor = None
+        lookups = set()  # 未完成的解析任务（提前结束时取消尚未开始的）
+
+        selector = selectors.DefaultSelector()
+        # 解析线程完成时写入一个字节唤醒 select
+        wake_r, wake_w = socket.socketpair()
+        wake_r.setblocking(False)
+        wake_w.setblocking(False)
+        selector.register(wake_r, selectors.EVENT_READ, None)
+        per_host = {}    # ip -> 进行中的连接数
+        active = 0
+
+        def enqueue(host, port, ip):
+            nonlocal queued
+            if ip not in queues:
+                queues[ip] = deque()
+                hosts.append(ip)
+            queues[ip].append((host, port))
+            queued += 1
+
+        def done(host, future):
+            lookups.discard(future)
+            if future.cancelled():
+                return
+            resolved.append((host, future.result()))
+            try:
+                wake_w.send(b'\0')
+            except OSError:
+                pass
+
+        try:
+            while True:
+                # 按需读取目标，预读量与并发上限相当
+                while not exhausted and queued + len(waiting) < self.concurrency * 2:
+                    try:
+                        host, port = next(targets)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    if host in waiting:
+                        waiting[host].append(port)
+                        continue
+                    if host in self._dns_cache:
+                        ip = self._dns_cache[host]
+                    elif _is_ip(host):
+                        ip = self._dns_cache[host] = host
+                    else:
+                        if executor is None:
+                            from concurrent.futures import ThreadPoolExecutor
+                            executor = ThreadPoolExecutor(self.resolvers,
+                                                          thread_name_prefix='sweep-dns')
+                        waiting[host] = [port]
+                        future = executor.submit(self._lookup, host)
+                        lookups.add(future)
+                        future.add_done_callback(
+                            lambda future, host=host: done(host, future))
+                        continue
+                    if ip is None:
+                        yield SweepResult(host, port, None, False, None, "不可达")
+                    else:
+                        enqueue(host, port, ip)
+
+                # 解析完成的主机名进入连接队列
+                while resolved:
+                    host, ip = resolved.popleft()
+                    self._dns_cache[host] = ip
+                    for port in waiting.pop(host):
+                        if ip is None:
+                            yield SweepResult(host, port, None, False, None, "不可达")
+                        else:
+                            enqueue(host, port, ip)
+
+                if exhausted and not hosts and not active and not waiting:
+                    break
+
+                # 轮询各 IP 发起新连接，遵守总并发和单 IP 并发上限
+                for _ in range(len(hosts)):
+                    if active >= self.concurrency:
+                        break
+                    ip = hosts[0]
+                    if per_host.get(ip, 0) >= self.per_host:
+                        hosts.rotate(-1)
+                        continue
+                    host, port = queues[ip].popleft()
+                    queued -= 1
+                    if not queues[ip]:
+                        hosts.popleft()
+                        del queues[ip]
+                    else:
+                        hosts.rotate(-1)
+
+                    result = self._start(selector, host, port, ip)
+                    if result is not None:
+                        yield result
+                    else:
+                        active += 1
+                        per_host[ip] = per_host.get(ip, 0) + 1
+
+                if not active and not waiting:
+                    continue
+
+                timeout = None
+                now = time.monotonic()
+                if active:
+                    next_deadline = min(key.data[4] for key in selector.get_map().values()
+                                        if key.data is not None)
+                    timeout = max(0.0, next_deadline - now)
+                events = selector.select(timeout)
+                now = time.monotonic()
+
+                finished = []
+                finished_socks = set()
+                for key, _ in events:
+                    if key.data is None:
+                        try:
+                            while wake_r.recv(4096):
+                                pass
+                        except (BlockingIOError, InterruptedError):
+                            pass
+                        continue
+                    finished.append(key)
+                    finished_socks.add(key.fileobj)
+                for key in list(selector.get_map().values()):
+                    if (key.data is not None and key.fileobj not in finished_socks and
+                            key.data[4] <= now):
+                        finished.append(key)
+
+                for key in finished:
+                    sock = key.fileobj
+                    host, port, ip, start, _ = key.data
+                    selector.unregister(sock)
+                    result = self._finish(sock, host, port, ip, start, now,
+                                          sock in finished_socks)
+                    sock.close()
+                    active -= 1
+                    per_host[ip] -= 1
+                    yield result
+        finally:
+            if executor is not None:
+                for future in list(lookups):
+                    future.cancel()
+                executor.shutdown(wait=False)
+            for key in list(selector.get_map().values()):
+                key.fileobj.close()
+            selector.close()
+            wake_w.close()
+
+    def _start(self, selector, host, port, ip):
+        """发起非阻塞连接，立即完成时直接返回结果"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        start = time.monotonic()
+        err = sock.connect_ex((ip, port))
+        if err in _IN_PROGRESS:
+            selector.register(sock, selectors.EVENT_WRITE,
+                              (host, port, ip, start, start + self.timeout))
+            return None
+        rtt = (time.monotonic() - start) * 1000
+        sock.close()
+        return SweepResult(host, port, ip, *classify_connect_result(err, rtt, self.timeout))
+
+    def _finish(self, sock, host, port, ip, start, now, ready):
+        """连接完成或超时后生成结果"""
+        if not ready:
+            return SweepResult(host, port, ip, False, None, "超时")
+        err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        rtt = (now - start) * 1000
+        return SweepResult(host, port, ip, *classify_connect_result(err, rtt, self.timeout))
+
+
+def trace_results(results, max_hops=30, timeout=2, workers=8):
+    """
+    并发追踪超时或不可达的目标，共享 TCP 检测缓存（并发检测同一路由器时只连接一次）
+
+    Args:
+        results: SweepResult 列表，只追踪状态属于 TRACE_STATUSES 且已解析出 IP 的目标
+        max_hops: 最大跳数
+        timeout: 超时时间（秒）
+        workers: 同时进行的追踪数
+
+    Yields:
+        每条追踪完成后的完整输出文本（按完成顺序）
+    """
+    import io
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+    from tcp_cache import TcpCheckCache
+
+    tcp_cache = TcpCheckCache()
+
+    def run(result):
+        output = io.StringIO()
+        tracer = TracerouteNoAdmin(result.host, max_hops=max_hops, timeout=timeout,
+                                   tcp_port=result.port, tcp_cache=tcp_cache)
+        try:
+            tracer.engine(output=output).trace()
+        except ValueError as e:
+            print(f"\n❌ 错误: {e}", file=output)
+        return output.getvalue()
+
+    pending = deque(result for result in results
+                    if result.ip is not None and result.status in TRACE_STATUSES)
+    running = set()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        while pending or running:
+            while pending and len(running) < workers:
+                running.add(executor.submit(run, pending.popleft()))
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+        if tcp_cache.hits or tcp_cache.waits:
+            yield tcp_cache.summary() + "\n"
+    finally:
+        for future in running:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def format_result(result):
+    """格式化单条检测结果"""
+    target = f"{result.host}:{result.port}"
+    ip = result.ip or '-'
+    if result.reachable:
+        status = f"✓ {result.rtt:.1f}ms"
+    elif result.status == "关闭":
+        status = "✗ 关闭"
+    else:
+        status = f"- {result.status}"
+    return f"{target:30s} {ip:15s}  {status}"
+
+
+def read_targets(source, default_port):
+    """从文件或标准输入读取目标列表"""
+    stream = sys.stdin if source == '-' else open(source, encoding='utf-8')
+    try:
+        for line_no, line in enumerate(stream, 1):
+            try:
+                target = parse_target(line, default_port)
+            except ValueError:
+                print(f"警告: 第 {line_no} 行格式无效，已跳过: {line.strip()}")
+                continue
+            if target:
+                yield target
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def print_usage():
+    """打印使用说明"""
+    print("TCP Sweep - 批量 TCP 可达性检测")
+    print("\n用法: python tcp_sweep.py <目标文件|-> [选项]")
+    print("\n目标文件每行一个目标: host:port、host port 或 host")
+    print("\n选项:")
+    print("  -p, --port <端口>         未指定端口时的默认端口 (默认: 80)")
+    print("  -t, --timeout <秒数>      连接超时时间 (默认: 2)")
+    print("  -c, --concurrency <数字>  最大并发连接数 (默认: 256)")
+    print("  --per-host <数字>         单个 IP 最大并发连接数 (默认: 8)")
+    print("  -m, --max-hops <数字>     超时/不可达目标路由追踪的最大跳数 (默认: 30)")
+    print("  -w, --trace-workers <数字> 同时进行的路由追踪数 (默认: 8)")
+    print("  --no-trace                不对超时/不可达目标进行路由追踪")
+    print("  -h, --help                显示此帮助信息")
+    print("\n示例:")
+    print("  python tcp_sweep.py targets.txt")
+    print("  cat targets.txt | python tcp_sweep.py - -c 500 -t 1")
+
+
+def main():
+    """主函数"""
+    if len(sys.argv) < 2:
+        print_usage()
+        sys.exit(1)
+
+    source = None
+    tcp_port = 80
+    timeout = 2
+    concurrency = 256
+    per_host = 8
+    max_hops = 30
+    trace_workers = 8
+    trace_failed = True
+
+    int_options = {
+        '-c': 'concurrency', '--concurrency': 'concurrency',
+        '--per-host': 'per_host',
+        '-m': 'max_hops', '--max-hops': 'max_hops',
+        '-w': 'trace_workers', '--trace-workers': 'trace_workers',
+    }
+    values = {'concurrency': concurrency, 'per_host': per_host, 'max_hops': max_hops,
+              'trace_workers': trace_workers}
+
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+
+        if arg in ['-h', '--help']:
+            print_usage()
+            sys.exit(0)
+        elif arg in int_options:
+            if i + 1 < len(sys.argv):
+                try:
+                    values[int_options[arg]] = int(sys.argv[i + 1])
+                    if values[int_options[arg]] < 1:
+                        raise ValueError
+                    i += 2
+                except ValueError:
+                    print(f"错误: 无效的参数值 '{sys.argv[i + 1]}'")
+                    sys.exit(1)
+            else:
+                print(f"错误: {arg} 需要一个参数")
+                sys.exit(1)
+        elif arg in ['-t', '--timeout']:
+            if i + 1 < len(sys.argv):
+                try:
+                    timeout = float(sys.argv[i + 1])
+                    i += 2
+                except ValueError:
+                    print(f"错误: 无效的超时值 '{sys.argv[i + 1]}'")
+                    sys.exit(1)
+            else:
+                print("错误: -t/--timeout 需要一个参数")
+                sys.exit(1)
+        elif arg in ['-p', '--port']:
+            if i + 1 < len(sys.argv):
+                try:
+                    tcp_port = int(sys.argv[i + 1])
+                    if not (1 <= tcp_port <= 65535):
+                        raise ValueError
+                    i += 2
+                except ValueError:
+                    print(f"错误: 无效的端口号 '{sys.argv[i + 1]}'")
+                    sys.exit(1)
+            else:
+                print("错误: -p/--port 需要一个参数")
+                sys.exit(1)
+        elif arg == '--no-trace':
+            trace_failed = False
+            i += 1
+        elif arg.startswith('-') and arg != '-':
+            print(f"错误: 未知选项 '{arg}'")
+            print_usage()
+            sys.exit(1)
+        else:
+            if source is None:
+                source = arg
+                i += 1
+            else:
+                print(f"错误: 多余的参数 '{arg}'")
+                print_usage()
+                sys.exit(1)
+
+    if source is None:
+        print("错误: 未指定目标文件")
+        print_usage()
+        sys.exit(1)
+
+    sweeper = TcpSweeper(timeout=timeout, concurrency=values['concurrency'],
+                         per_host=values['per_host'])
+    failed = []
+    total = 0
+    start = time.monotonic()
+
+    try:
+        for result in sweeper.sweep(read_targets(source, tcp_port)):
+            total += 1
+            print(format_result(result), flush=True)
+            if not result.reachable:
+                failed.append(result)
+    except FileNotFoundError:
+        print(f"错误: 找不到目标文件 '{source}'")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("\n\n⚠️  用户中断操作")
+        sys.exit(0)
+
+    elapsed = time.monotonic() - start
+    print()
+    print("=" * 80)
+    closed = sum(1 for result in failed if result.status == "关闭")
+    print(f"📊 共 {total} 个目标, 开放 {total - len(failed)}, 关闭 {closed}, "
+          f"失败 {len(failed) - closed}, 用时 {elapsed:.2f} 秒")
+
+    if not trace_failed:
+        return
+
+    # 仅对超时/不可达的目标并发进行路由追踪，共同经过的路由器只检测一次
+    try:
+        for text in trace_results(failed, max_hops=values['max_hops'], timeout=timeout,
+                                  workers=values['trace_workers']):
+            print()
+            print(text, end='', flush=True)
+    except KeyboardInterrupt:
+        print("\n\n⚠️  用户中断操作")
+        sys.exit(0)
+
+if __name__ == "__main__":
+    main()
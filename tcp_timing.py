@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+TCP Timing - TCP 握手分阶段计时
+分别测量 TCP 连接、TLS 握手和 HTTP 首字节时间（均使用单调时钟），
+用于区分网络路径延迟与服务端处理延迟，支持对多个目标或每一跳并发测量
+"""
+
+import socket
+import ssl
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+
+from trace import TracerouteNoAdmin, classify_connect_result
+
+
+# 默认使用 TLS 的端口
+TLS_PORTS = {443, 465, 636, 853, 993, 995, 8443}
+
+
+class PhaseTiming:
+    """分阶段计时结果（时间单位: 毫秒，未测量的阶段为 None）"""
+
+    __slots__ = ('host', 'ip', 'port', 'status', 'connect', 'tls', 'ttfb',
+                 'tls_version', 'error')
+
+    def __init__(self, host, ip, port):
+        self.host = host
+        self.ip = ip
+        self.port = port
+        self.status = None
+        self.connect = None
+        self.tls = None
+        self.ttfb = None
+        self.tls_version = None
+        self.error = None
+
+    def __repr__(self):
+        return (f"PhaseTiming({self.host}:{self.port}, status={self.status!r}, "
+                f"connect={self.connect}, tls={self.tls}, ttfb={self.ttfb})")
+
+    @property
+    def total(self):
+        """各阶段耗时之和"""
+        phases = [p for p in (self.connect, self.tls, self.ttfb) if p is not None]
+        return sum(phases) if phases else None
+
+
+def measure_phases(host, port, ip=None, timeout=2, tls=None, http=False,
+                   path='/'):
+    """
+    分阶段测量到目标的连接延迟
+
+    Args:
+        host: 目标主机名（用于 SNI 和 HTTP Host 头）
+        port: 目标端口
+        ip: 目标 IP（默认解析 host）
+        timeout: 每个阶段的超时时间（秒）
+        tls: 是否进行 TLS 握手（None 表示根据端口自动判断）
+        http: 是否测量 HTTP 首字节时间
+        path: HTTP 请求路径
+
+    Returns:
+        PhaseTiming
+    """
+    if ip is None:
+        try:
+            ip = socket.gethostbyname(host)
+        except socket.gaierror as e:
+            result = PhaseTiming(host, None, port)
+            result.status = "不可达"
+            result.error = str(e)
+            return result
+    if tls is None:
+        tls = port in TLS_PORTS
+
+    result = PhaseTiming(host, ip, port)
+
+    # 套接字创建不计入连接时间
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        start = time.perf_counter()
+        try:
+            err = sock.connect_ex((ip, port))
+        except socket.timeout:
+            result.status = "超时"
+            return result
+        rtt = (time.perf_counter() - start) * 1000
+
+        reachable, result.connect, result.status = classify_connect_result(err, rtt, timeout)
+        if not reachable:
+            return result
+
+        if tls:
+            context = ssl.create_default_context()
+            # 只测量握手延迟，不校验证书（中间跳通常没有有效证书）
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            server_name = host if host != ip else None
+            sock = context.wrap_socket(sock, server_hostname=server_name,
+                                       do_handshake_on_connect=False)
+            start = time.perf_counter()
+            sock.do_handshake()
+            result.tls = (time.perf_counter() - start) * 1000
+            result.tls_version = sock.version()
+
+        if http:
+            request = (f"HEAD {path} HTTP/1.1\r\nHost: {host}\r\n"
+                       f"User-Agent: pytracer\r\nConnection: close\r\n\r\n")
+            start = time.perf_counter()
+            sock.sendall(request.encode('ascii'))
+            first = sock.recv(1)
+            if first:
+                result.ttfb = (time.perf_counter() - start) * 1000
+            else:
+                result.error = "服务端关闭了连接"
+    except socket.timeout:
+        result.error = "阶段超时"
+    except (ssl.SSLError, OSError) as e:
+        result.error = str(e)
+    finally:
+        sock.close()
+
+    return result
+
+
+def _measure_keyed(items, workers=32, **kwargs):
+    """
+    并发测量，按需读取工作项，进行中的测量不超过 workers 的两倍
+
+    Args:
+        items: (键, host, port, ip) 可迭代对象
+        workers: 并发线程数
+        **kwargs: 传给 measure_phases 的参数
+
+    Yields:
+        (键, PhaseTiming)，按完成顺序
+    """
+    items = iter(items)
+    running = {}    # future -> 键
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            for key, host, port, ip in islice(items, workers * 2 - len(running)):
+                future = executor.submit(measure_phases, host, port, ip, **kwargs)
+                running[future] = key
+            if not running:
+                return
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield running.pop(future), future.result()
+
+
+def measure_many(targets, workers=32, **kwargs):
+    """
+    并发测量多个目标（目标按需读取，适合大量目标）
+
+    Args:
+        targets: (host, port) 或 (host, port, ip) 可迭代对象
+        workers: 并发线程数
+        **kwargs: 传给 measure_phases 的参数
+
+    Yields:
+        PhaseTiming，按完成顺序
+    """
+    items = ((None, target[0], target[1], target[2] if len(target) > 2 else None)
+             for target in targets)
+    for _, timing in _measure_keyed(items, workers=workers, **kwargs):
+        yield timing
+
+
+def measure_hops(route_hops, port, workers=32, **kwargs):
+    """
+    并发测量 TracerouteNoAdmin.route_hops 中每一跳
+
+    同一路由器出现在多跳时（如路由环路）每一跳各测量一次
+
+    Returns:
+        {hop: PhaseTiming}
+    """
+    items = [(hop_num, info['ip'], port, info['ip'])
+             for hop_num, info in route_hops.items() if info.get('ip')]
+    return dict(_measure_keyed(items, workers=workers, **kwargs))
+
+
+def format_timing(timing):
+    """格式化单条计时结果"""
+    if timing.connect is None:
+        return f"TCP:{timing.port} - {timing.status}"
+    if timing.status == "关闭":
+        return f"TCP:{timing.port} ✗ 关闭"
+    parts = [f"connect {timing.connect:.1f}ms"]
+    if timing.tls is not None:
+        parts.append(f"tls {timing.tls:.1f}ms ({timing.tls_version})")
+    if timing.ttfb is not None:
+        parts.append(f"ttfb {timing.ttfb:.1f}ms")
+    text = f"TCP:{timing.port} ✓ " + " | ".join(parts)
+    if timing.error:
+        text += f"  ({timing.error})"
+    return text
+
+
+def print_usage():
+    """打印使用说明"""
+    print("TCP Timing - TCP 握手分阶段计时")
+    print("\n用法: python tcp_timing.py <目标主机[:端口]> ... [选项]")
+    print("\n选项:")
+    print("  -p, --port <端口>         默认端口 (默认: 443)")
+    print("  -t, --timeout <秒数>      每个阶段的超时时间 (默认: 2)")
+    print("  -w, --workers <数字>      并发线程数 (默认: 32)")
+    print("  --tls / --no-tls          强制开启/关闭 TLS 握手 (默认: 根据端口判断)")
+    print("  --http                    测量 HTTP 首字节时间")
+    print("  --hops                    先进行路由追踪，再对每一跳并发测量")
+    print("  -h, --help                显示此帮助信息")
+    print("\n示例:")
+    print("  python tcp_timing.py www.baidu.com github.com:443 --http")
+    print("  python tcp_timing.py www.google.com --hops -p 443")
+
+
+def main():
+    """主函数"""
+    if len(sys.argv) < 2:
+        print_usage()
+        sys.exit(1)
+
+    hosts = []
+    tcp_port = 443
+    timeout = 2
+    workers = 32
+    tls = None
+    http = False
+    per_hop = False
+
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+
+        if arg in ['-h', '--help']:
+            print_usage()
+            sys.exit(0)
+        elif arg in ['-p', '--port']:
+            if i + 1 < len(sys.argv):
+                try:
+                    tcp_port = int(sys.argv[i + 1])
+                    if not (1 <= tcp_port <= 65535):
+                        raise ValueError
+                    i += 2
+                except ValueError:
+                    print(f"错误: 无效的端口号 '{sys.argv[i + 1]}'")
+                    sys.exit(1)
+            else:
+                print("错误: -p/--port 需要一个参数")
+                sys.exit(1)
+        elif arg in ['-t', '--timeout']:
+            if i + 1 < len(sys.argv):
+                try:
+                    timeout = float(sys.argv[i + 1])
+                    i += 2
+                except ValueError:
+                    print(f"错误: 无效的超时值 '{sys.argv[i + 1]}'")
+                    sys.exit(1)
+            else:
+                print("错误: -t/--timeout 需要一个参数")
+                sys.exit(1)
+        elif arg in ['-w', '--workers']:
+            if i + 1 < len(sys.argv):
+                try:
+                    workers = int(sys.argv[i + 1])
+                    if workers < 1:
+                        raise ValueError
+                    i += 2
+                except ValueError:
+                    print(f"错误: 无效的线程数 '{sys.argv[i + 1]}'")
+                    sys.exit(1)
+            else:
+                print("错误: -w/--workers 需要一个参数")
+                sys.exit(1)
+        elif arg == '--tls':
+            tls = True
+            i += 1
+        elif arg == '--no-tls':
+            tls = False
+            i += 1
+        elif arg == '--http':
+            http = True
+            i += 1
+        elif arg == '--hops':
+            per_hop = True
+            i += 1
+        elif arg.startswith('-'):
+            print(f"错误: 未知选项 '{arg}'")
+            print_usage()
+            sys.exit(1)
+        else:
+            hosts.append(arg)
+            i += 1
+
+    if not hosts:
+        print("错误: 未指定目标主机")
+        print_usage()
+        sys.exit(1)
+
+    targets = []
+    for host in hosts:
+        port = tcp_port
+        if host.count(':') == 1:
+            host, port_str = host.split(':')
+            try:
+                port = int(port_str)
+            except ValueError:
+                print(f"错误: 无效的端口号 '{port_str}'")
+                sys.exit(1)
+        targets.append((host, port))
+
+    options = {'timeout': timeout, 'tls': tls, 'http': http}
+
+    try:
+        if not per_hop:
+            for timing in measure_many(targets, workers=workers, **options):
+                print(f"{timing.host:30s} {timing.ip or '-':15s}  {format_timing(timing)}",
+                      flush=True)
+            return
+
+        for host, port in targets:
+            tracer = TracerouteNoAdmin(host, timeout=timeout, tcp_port=port,
+                                       enable_tcp_check=False)
+            if not tracer.trace():
+                continue
+            print(f"⏱  逐跳分阶段计时: {host}:{port}")
+            results = measure_hops(tracer.route_hops, port, workers=workers, **options)
+            for hop_num in sorted(results):
+                timing = results[hop_num]
+                print(f"{hop_num:2d}  {timing.ip:15s}  {format_timing(timing)}")
+            final = measure_phases(host, port, tracer.dest_ip, **options)
+            print(f"🎯  {final.ip:15s}  {format_timing(final)}")
+            print()
+    except KeyboardInterrupt:
+        print("\n\n⚠️  用户中断操作")
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
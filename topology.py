@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Topology - 路由拓扑聚合
+将大量追踪结果增量合并为一张邻接图：节点为响应的路由器，边为相邻两跳，
+边上累计 RTT 增量与丢包统计；节点使用紧凑的整数 ID，
+每次合并的开销与路径长度成正比。支持导出 GraphML / DOT / JSON
+"""
+
+import json
+import sys
+from xml.sax.saxutils import escape
+
+from trace_store import HOP_TIMEOUT, TraceStore, hops_from_route_hops
+
+# 支持的导出格式
+EXPORT_FORMATS = ('json', 'dot', 'graphml')
+
+
+class EdgeStats:
+    """一条边（相邻两跳）的累计统计"""
+
+    __slots__ = ('count', 'gap', 'rtt_count', 'rtt_sum', 'rtt_min', 'rtt_max',
+                 'probes', 'lost')
+
+    def __init__(self):
+        self.count = 0          # 经过该边的路径次数
+        self.gap = 0            # 两端之间出现过的最大匿名跳数（超时跳）
+        self.rtt_count = 0
+        self.rtt_sum = 0.0      # 远端相对近端的 RTT 增量之和（毫秒）
+        self.rtt_min = None
+        self.rtt_max = None
+        self.probes = 0         # 远端收到的查询总数
+        self.lost = 0           # 远端丢失的查询数
+
+    def add(self, gap, delta, probes, lost):
+        self.count += 1
+        if gap > self.gap:
+            self.gap = gap
+        if delta is not None:
+            self.rtt_count += 1
+            self.rtt_sum += delta
+            if self.rtt_min is None or delta < self.rtt_min:
+                self.rtt_min = delta
+            if self.rtt_max is None or delta > self.rtt_max:
+                self.rtt_max = delta
+        self.probes += probes
+        self.lost += lost
+
+    @property
+    def rtt_avg(self):
+        return self.rtt_sum / self.rtt_count if self.rtt_count else None
+
+    @property
+    def loss(self):
+        return self.lost / self.probes if self.probes else 0.0
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'gap': self.gap,
+            'rtt_avg': self.rtt_avg,
+            'rtt_min': self.rtt_min,
+            'rtt_max': self.rtt_max,
+            'loss': self.loss,
+        }
+
+
+def _hop_stats(hop):
+    """
+    提取单跳的 (RTT 中位数, 查询数, 丢失数)
+
+    Args:
+        hop: HopRecord
+    """
+    valid = sorted(r for r in hop.rtts if r == r)
+    total = len(hop.rtts)
+    median = valid[len(valid) // 2] if valid else None
+    return median, total, total - len(valid)
+
+
+class TopologyGraph:
+    """增量构建的路由拓扑图"""
+
+    def __init__(self):
+        """初始化"""
+        self.node_ids = {}        # IP -> 节点 ID
+        self.nodes = []           # 节点 ID -> IP
+        self.node_seen = []       # 节点 ID -> 出现次数
+        self.node_dests = []      # 节点 ID -> 经过该节点的目标 ID 集合
+        self.dest_ids = {}        # 目标 IP -> 目标 ID
+        self.dests = []           # 目标 ID -> 目标 IP
+        self.edges = {}           # (近端 ID, 远端 ID) -> EdgeStats
+        self.adjacency = []       # 节点 ID -> 下一跳节点 ID 集合
+        self.traces = 0
+
+    def _node(self, ip):
+        node_id = self.node_ids.get(ip)
+        if node_id is None:
+            node_id = len(self.nodes)
+            self.node_ids[ip] = node_id
+            self.nodes.append(ip)
+            self.node_seen.append(0)
+            self.node_dests.append(set())
+            self.adjacency.append(set())
+        return node_id
+
+    def _dest(self, ip):
+        dest_id = self.dest_ids.get(ip)
+        if dest_id is None:
+            dest_id = len(self.dests)
+            self.dest_ids[ip] = dest_id
+            self.dests.append(ip)
+        return dest_id
+
+    def add_trace(self, destination, hops):
+        """
+        合并一条路径
+
+        Args:
+            destination: 目标 IP
+            hops: HopRecord 序列（按跳数排序）
+        """
+        dest_id = self._dest(destination)
+        prev_id = None
+        prev_rtt = None
+        gap = 0
+        for hop in hops:
+            if hop.status == HOP_TIMEOUT or not hop.ip:
+                gap += 1
+                continue
+            node_id = self._node(hop.ip)
+            median, probes, lost = _hop_stats(hop)
+            self.node_seen[node_id] += 1
+            self.node_dests[node_id].add(dest_id)
+            if prev_id is not None and prev_id != node_id:
+                key = (prev_id, node_id)
+                edge = self.edges.get(key)
+                if edge is None:
+                    edge = self.edges[key] = EdgeStats()
+                    self.adjacency[prev_id].add(node_id)
+                delta = None
+                if median is not None and prev_rtt is not None:
+                    delta = median - prev_rtt
+                edge.add(gap, delta, probes, lost)
+            prev_id = node_id
+            prev_rtt = median
+            gap = 0
+        self.traces += 1
+
+    def add_route_hops(self, destination, route_hops):
+        """合并 TracerouteNoAdmin.route_hops 格式的结果"""
+        self.add_trace(destination, hops_from_route_hops(route_hops))
+
+    def add_store(self, store, destination=None, start=None, end=None):
+        """
+        合并历史存储中的结果
+
+        Returns:
+            合并的路径数
+        """
+        count = 0
+        for record in store.query(destination, start, end):
+            self.add_trace(record.dest_ip, record.hops)
+            count += 1
+        return count
+
+    def destinations_via(self, ip):
+        """
+        经过某个路由器的目标
+
+        Returns:
+            目标 IP 列表（路由器未出现过时为空）
+        """
+        node_id = self.node_ids.get(ip)
+        if node_id is None:
+            return []
+        return sorted(self.dests[d] for d in self.node_dests[node_id])
+
+    def routers_toward(self, destination):
+        """到某个目标的路径上出现过的路由器"""
+        dest_id = self.dest_ids.get(destination)
+        if dest_id is None:
+            return []
+        return [self.nodes[n] for n in range(len(self.nodes))
+                if dest_id in self.node_dests[n]]
+
+    def neighbors(self, ip):
+        """某个路由器的下一跳"""
+        node_id = self.node_ids.get(ip)
+        if node_id is None:
+            return []
+        return sorted(self.nodes[n] for n in self.adjacency[node_id])
+
+    def edge(self, near_ip, far_ip):
+        """两个路由器之间的边统计，不存在返回 None"""
+        near = self.node_ids.get(near_ip)
+        far = self.node_ids.get(far_ip)
+        if near is None or far is None:
+            return None
+        return self.edges.get((near, far))
+
+    def to_dict(self):
+        """导出为可 JSON 序列化的字典"""
+        return {
+            'nodes': [
+                {'id': i, 'ip': ip, 'seen': self.node_seen[i],
+                 'destinations': len(self.node_dests[i])}
+                for i, ip in enumerate(self.nodes)
+            ],
+            'edges': [
+                dict(source=near, target=far, **edge.to_dict())
+                for (near, far), edge in self.edges.items()
+            ],
+            'traces': self.traces,
+        }
+
+    def write_json(self, stream):
+        json.dump(self.to_dict(), stream, ensure_ascii=False, indent=2)
+        stream.write('\n')
+
+    def write_dot(self, stream):
+        stream.write('digraph topology {\n')
+        stream.write('  rankdir=LR;\n')
+        for i, ip in enumerate(self.nodes):
+            stream.write(f'  n{i} [label="{ip}"];\n')
+        for (near, far), edge in self.edges.items():
+            label = f"{edge.count}"
+            if edge.rtt_avg is not None:
+                label += f" / {edge.rtt_avg:.1f}ms"
+            style = ' style=dashed' if edge.gap else ''
+            stream.write(f'  n{near} -> n{far} [label="{label}"{style}];\n')
+        stream.write('}\n')
+
+    def write_graphml(self, stream):
+        stream.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        stream.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+        keys = [
+            ('ip', 'node', 'string'), ('seen', 'node', 'int'),
+            ('destinations', 'node', 'int'),
+            ('count', 'edge', 'int'), ('gap', 'edge', 'int'),
+            ('rtt_avg', 'edge', 'double'), ('rtt_min', 'edge', 'double'),
+            ('rtt_max', 'edge', 'double'), ('loss', 'edge', 'double'),
+        ]
+        for name, domain, kind in keys:
+            stream.write(f'  <key id="{name}" for="{domain}" '
+                         f'attr.name="{name}" attr.type="{kind}"/>\n')
+        stream.write('  <graph id="topology" edgedefault="directed">\n')
+        for i, ip in enumerate(self.nodes):
+            stream.write(f'    <node id="n{i}">'
+                         f'<data key="ip">{escape(ip)}</data>'
+                         f'<data key="seen">{self.node_seen[i]}</data>'
+                         f'<data key="destinations">{len(self.node_dests[i])}</data>'
+                         f'</node>\n')
+        for (near, far), edge in self.edges.items():
+            data = ''.join(f'<data key="{k}">{v}</data>'
+                           for k, v in edge.to_dict().items() if v is not None)
+            stream.write(f'    <edge source="n{near}" target="n{far}">{data}</edge>\n')
+        stream.write('  </graph>\n')
+        stream.write('</graphml>\n')
+
+    def export(self, fmt, stream):
+        """
+        导出拓扑
+
+        Args:
+            fmt: EXPORT_FORMATS 之一（'json'、'dot' 或 'graphml'）
+            stream: 可写文本流
+
+        Raises:
+            ValueError: 不支持的格式
+        """
+        writers = {'json': self.write_json, 'dot': self.write_dot,
+                   'graphml': self.write_graphml}
+        if fmt not in writers:
+            raise ValueError(f"不支持的导出格式 '{fmt}'")
+        writers[fmt](stream)
+
+
+def print_usage():
+    """打印使用说明"""
+    print("用法: python topology.py <存储目录> [选项]")
+    print("\n选项:")
+    print("  -f, --format <格式>      导出格式: json, dot, graphml (默认: 仅打印摘要)")
+    print("  -o, --output <文件>      导出到文件 (默认: 标准输出)")
+    print("  --via <IP>               列出经过该路由器的目标")
+    print("  --dest <IP>              只合并该目标的历史结果")
+    print("  -h, --help               显示此帮助信息")
+    print("\n示例:")
+    print("  python topology.py ./traces")
+    print("  python topology.py ./traces -f dot -o topology.dot")
+    print("  python topology.py ./traces --via 202.97.12.34")
+
+
+def main():
+    """主函数"""
+    if len(sys.argv) < 2:
+        print_usage()
+        sys.exit(1)
+
+    store_path = None
+    fmt = None
+    output = None
+    via = None
+    destination = None
+
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+        if arg in ['-h', '--help']:
+            print_usage()
+            sys.exit(0)
+        elif arg in ['-f', '--format', '-o', '--output', '--via', '--dest']:
+            if i + 1 >= len(sys.argv):
+                print(f"错误: {arg} 需要一个参数")
+                sys.exit(1)
+            value = sys.argv[i + 1]
+            if arg in ['-f', '--format']:
+                fmt = value
+            elif arg in ['-o', '--output']:
+                output = value
+            elif arg == '--via':
+                via = value
+            else:
+                destination = value
+            i += 2
+        elif arg.startswith('-'):
+            print(f"错误: 未知选项 '{arg}'")
+            print_usage()
+            sys.exit(1)
+        elif store_path is None:
+            store_path = arg
+            i += 1
+        else:
+            print(f"错误: 多余的参数 '{arg}'")
+            print_usage()
+            sys.exit(1)
+
+    if store_path is None:
+        print("错误: 未指定存储目录")
+        print_usage()
+        sys.exit(1)
+
+    # 在打开（截断）输出文件之前检查格式
+    if fmt is not None and fmt not in EXPORT_FORMATS:
+        print(f"错误: 不支持的导出格式 '{fmt}' (可选: {', '.join(EXPORT_FORMATS)})")
+        sys.exit(1)
+
+    store = TraceStore(store_path)
+    graph = TopologyGraph()
+    graph.add_store(store, destination)
+    store.close()
+
+    if via is not None:
+        dests = graph.destinations_via(via)
+        print(f"经过 {via} 的目标 ({len(dests)} 个):")
+        for dest in dests:
+            print(f"  {dest}")
+        return
+
+    if fmt is None:
+        print(f"合并路径: {graph.traces}")
+        print(f"节点: {len(graph.nodes)}  边: {len(graph.edges)}  目标: {len(graph.dests)}")
+        busiest = sorted(range(len(graph.nodes)),
+                         key=lambda n: len(graph.node_dests[n]), reverse=True)[:10]
+        if busiest:
+            print("\n经过目标最多的路由器:")
+            for n in busiest:
+                print(f"  {graph.nodes[n]:15s}  {len(graph.node_dests[n])} 个目标")
+        return
+
+    try:
+        if output:
+            with open(output, 'w', encoding='utf-8') as f:
+                graph.export(fmt, f)
+            print(f"💾 拓扑已导出到: {output}")
+        else:
+            graph.export(fmt, sys.stdout)
+    except ValueError as e:
+        print(f"错误: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
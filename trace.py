@@ -5,20 +5,73 @@ Python Traceroute - 非管理员版本
 同时显示路由跟踪和端口连通性
 """
 
+import errno
 import socket
-import subprocess
 import sys
 import time
 import re
-import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+# 路由不可达类错误码（含 Windows WSAENETDOWN/WSAENETUNREACH/WSAEHOSTDOWN/WSAEHOSTUNREACH）
+_UNREACHABLE_ERRORS = {errno.ENETUNREACH, errno.EHOSTUNREACH, errno.ENETDOWN,
+                       getattr(errno, 'EHOSTDOWN', errno.EHOSTUNREACH),
+                       10050, 10051, 10064, 10065}
+
+
+def classify_connect_result(result, rtt, timeout):
+    """
+    根据 connect 结果判定 TCP 端口状态
+    
+    Args:
+        result: connect_ex 返回的错误码（0 表示成功）
+        rtt: 连接耗时（毫秒）
+        timeout: 超时时间（秒）
+        
+    Returns:
+        (是否可达, 响应时间ms, 状态描述)
+    """
+    if result == 0:
+        return True, rtt, "开放"
+    # 网络/主机不可达（ICMP 不可达或本地无路由）
+    if result in _UNREACHABLE_ERRORS:
+        return False, None, "不可达"
+    # 连接被拒绝也说明主机可达
+    if rtt < timeout * 1000:
+        return False, rtt, "关闭"
+    return False, None, "超时"
+
+
+def connect_tcp(ip, port, timeout):
+    """
+    发起一次 TCP 连接并判定端口状态（不经过缓存）
+    
+    Returns:
+        (是否可达, 响应时间ms, 状态描述)
+    """
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        
+        start_time = time.time()
+        result = sock.connect_ex((ip, port))
+        end_time = time.time()
+        
+        sock.close()
+        
+        rtt = (end_time - start_time) * 1000
+        
+        return classify_connect_result(result, rtt, timeout)
+    except socket.timeout:
+        return False, None, "超时"
+    except Exception:
+        return False, None, "不可达"
 
 
 class TracerouteNoAdmin:
     """非管理员权限的 Traceroute 实现"""
     
     def __init__(self, destination, max_hops=30, timeout=2, tcp_port=80, 
-                 enable_tcp_check=True):
+                 enable_tcp_check=True, asn_index=None, tcp_cache=None):
         """
         初始化
         
@@ -28,6 +81,8 @@ class TracerouteNoAdmin:
             timeout: 超时时间
             tcp_port: TCP 端口
             enable_tcp_check: 是否启用 TCP 连通性检测
+            asn_index: 离线 ASN 索引文件路径（可选，见 asn_lookup.py）
+            tcp_cache: 多个追踪共享的 TCP 检测结果缓存（可选，见 tcp_cache.py）
         """
         self.destination = destination
         self.max_hops = max_hops
@@ -37,6 +92,12 @@ class TracerouteNoAdmin:
         self.dest_ip = None
         self.route_hops = {}  # 存储路由信息
         self.is_windows = sys.platform.startswith('win')
+        self.tcp_cache = tcp_cache
+        self.asn_index = asn_index
+        self.enricher = None
+        if asn_index:
+            from asn_lookup import HopEnricher
+            self.enricher = HopEnricher(asn_index)
         
     def resolve_destination(self):
         """解析目标主机"""
@@ -47,238 +108,204 @@ class TracerouteNoAdmin:
             print(f"错误: 无法解析主机名 '{self.destination}': {e}")
             return False
     
-    def test_tcp_port(self, ip, port=None):
+    def test_tcp_port(self, ip, port=None, timeout=None):
         """
         测试 TCP 端口连通性
         
         Args:
             ip: 目标 IP
             port: 端口（默认使用 self.tcp_port）
+            timeout: 超时时间（默认使用 self.timeout）
             
         Returns:
             (是否可达, 响应时间ms, 状态描述)
         """
         if port is None:
             port = self.tcp_port
+        if timeout is None:
+            timeout = self.timeout
         
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(self.timeout)
-            
-            start_time = time.time()
-            result = sock.connect_ex((ip, port))
-            end_time = time.time()
-            
-            sock.close()
-            
-            rtt = (end_time - start_time) * 1000
-            
-            if result == 0:
-                return True, rtt, "开放"
-            else:
-                # 连接被拒绝也说明主机可达
-                if rtt < self.timeout * 1000:
-                    return False, rtt, "关闭"
-                else:
-                    return False, None, "超时"
-        except socket.timeout:
-            return False, None, "超时"
-        except Exception as e:
-            return False, None, "不可达"
+        if self.tcp_cache is not None:
+            return self.tcp_cache.get_or_check(
+                ip, port, lambda: self.connect_tcp_port(ip, port, timeout), timeout)
+        return self.connect_tcp_port(ip, port, timeout)
+    
+    def connect_tcp_port(self, ip, port, timeout):
+        """
+        实际发起一次 TCP 连接（不经过缓存）
+        
+        Returns:
+            (是否可达, 响应时间ms, 状态描述)
+        """
+        return connect_tcp(ip, port, timeout)
     
     def parse_traceroute_line(self, line):
         """
         解析 traceroute 输出行
         
         Returns:
-            (hop_number, ip_addresses, rtts) 或 None
+            (hop_number, ip_addresses, rtts) 或 None；
+            rtts 按查询顺序排列，"*" 对应 None，整跳超时时三者均为空
         """
         line = line.strip()
         
-        if self.is_windows:
-            # Windows tracert 格式: "  1    <1 ms    <1 ms    <1 ms  192.168.1.1"
-            match = re.match(r'\s*(\d+)\s+(.+)', line)
-            if match:
-                hop_num = int(match.group(1))
-                rest = match.group(2)
-                
-                # 提取 IP 地址
-                ip_match = re.findall(r'\b(?:\d{1,3}\.){3}\d{1,3}\b', rest)
-                
-                # 提取时间
-                time_matches = re.findall(r'(\d+)\s*ms', rest)
-                
-                # 检查超时
-                if '*' in rest or 'Request timed out' in rest or '请求超时' in rest:
-                    return hop_num, [], []
-                
-                return hop_num, ip_match, time_matches
-        else:
-            # Unix traceroute 格式: " 1  192.168.1.1 (192.168.1.1)  1.234 ms  1.123 ms  1.056 ms"
-            match = re.match(r'\s*(\d+)\s+(.+)', line)
-            if match:
-                hop_num = int(match.group(1))
-                rest = match.group(2)
-                
-                # 提取 IP 地址
-                ip_match = re.findall(r'\b(?:\d{1,3}\.){3}\d{1,3}\b', rest)
-                
-                # 提取时间
-                time_matches = re.findall(r'([\d.]+)\s*ms', rest)
-                
-                # 检查超时
-                if '*' in rest:
-                    return hop_num, [], []
-                
-                return hop_num, ip_match, time_matches
-        
-        return None
-    
-    def run_traceroute(self):
-        """运行 traceroute 命令并实时解析"""
-        print(f"🔍 开始路由追踪: {self.destination} ({self.dest_ip})")
-        print(f"📊 最大跳数: {self.max_hops}, 超时: {self.timeout}秒")
-        
-        if self.enable_tcp_check:
-            print(f"🔌 TCP 端口检测: {self.tcp_port}")
+        match = re.match(r'\s*(\d+)\s+(.+)', line)
+        if not match:
+            return None
+        hop_num = int(match.group(1))
+        rest = match.group(2)
         
-        print("=" * 80)
-        print()
+        # 提取 IP 地址
+        ip_match = re.findall(r'\b(?:\d{1,3}\.){3}\d{1,3}\b', rest)
+        if not ip_match:
+            # 请求超时（Windows: "Request timed out." / "请求超时"）
+            return hop_num, [], []
         
-        # 构建命令
+        # 按顺序提取时间和 "*"（单次查询丢失），保留每次查询的结果
         if self.is_windows:
-            cmd = ['tracert', '-h', str(self.max_hops), 
-                   '-w', str(int(self.timeout * 1000)), self.destination]
+            # Windows tracert 格式: "  1    <1 ms    *    2 ms  192.168.1.1"
+            pattern = r'<?(\d+)\s*ms|(?<!\S)(\*)(?!\S)'
         else:
-            cmd = ['traceroute', '-m', str(self.max_hops), 
-                   '-w', str(self.timeout), '-q', '3', self.destination]
+            # Unix traceroute 格式: " 1  192.168.1.1 (192.168.1.1)  1.234 ms  *  1.056 ms"
+            pattern = r'([\d.]+)\s*ms|(?<!\S)(\*)(?!\S)'
+        rtts = [None if star else value for value, star in re.findall(pattern, rest)]
         
-        print(f"执行: {' '.join(cmd)}\n")
+        return hop_num, ip_match, rtts
+    
+    def build_command(self, wait=None, queries=3):
+        """
+        构建系统 traceroute 命令
         
-        try:
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                bufsize=1,
-                universal_newlines=True
-            )
+        Args:
+            wait: 单次探测等待时间（秒，默认使用 self.timeout）
+            queries: 每跳查询次数（tracert 不支持，固定为 3）
             
-            # 实时读取输出
-            for line in iter(process.stdout.readline, ''):
-                if not line:
-                    break
-                
-                parsed = self.parse_traceroute_line(line)
-                if parsed:
-                    hop_num, ips, rtts = parsed
-                    
-                    if ips:
-                        # 存储路由信息
-                        self.route_hops[hop_num] = {
-                            'ip': ips[0] if ips else None,
-                            'rtts': rtts
-                        }
-                        
-                        # 显示路由信息
-                        print(f"{hop_num:2d}  ", end='', flush=True)
-                        
-                        if ips:
-                            print(f"{ips[0]:15s}  ", end='', flush=True)
-                            
-                            # 显示 RTT
-                            if rtts:
-                                rtt_str = '  '.join([f"{r} ms" for r in rtts[:3]])
-                                print(f"{rtt_str:30s}", end='', flush=True)
-                            
-                            # TCP 端口检测
-                            if self.enable_tcp_check:
-                                reachable, tcp_rtt, status = self.test_tcp_port(ips[0])
-                                
-                                if reachable:
-                                    print(f"  | TCP:{self.tcp_port} ✓ {tcp_rtt:.1f}ms", end='')
-                                elif status == "关闭":
-                                    print(f"  | TCP:{self.tcp_port} ✗ 关闭", end='')
-                                else:
-                                    print(f"  | TCP:{self.tcp_port} - {status}", end='')
-                            
-                            print(flush=True)
-                        else:
-                            print("*  *  *", flush=True)
-                    else:
-                        # 超时的跳
-                        print(f"{hop_num:2d}  *  *  *  (请求超时)", flush=True)
-                else:
-                    # 显示其他信息行
-                    if line.strip() and not line.startswith('traceroute'):
-                        if 'Tracing' in line or '通过' in line or 'traceroute to' in line:
-                            continue  # 跳过标题行
-                        # print(line.strip())
+        Returns:
+            命令列表
+        """
+        if wait is None:
+            wait = self.timeout
+        if self.is_windows:
+            return ['tracert', '-h', str(self.max_hops), 
+                    '-w', str(int(wait * 1000)), self.destination]
+        if sys.platform == 'darwin':
+            # macOS traceroute 的 -w 只接受整数秒
+            wait = max(1, round(wait))
+        return ['traceroute', '-m', str(self.max_hops), 
+                '-w', f"{wait:g}", '-q', str(queries), self.destination]
+    
+    def handle_line(self, line):
+        """
+        处理一行 traceroute 输出：解析、记录到 route_hops、显示，
+        并按需进行 ASN 标注和 TCP 检测
+        
+        Args:
+            line: 一行输出文本
             
-            process.wait()
+        Returns:
+            解析出的跳数，非跳信息行（标题等）返回 None
+        """
+        parsed = self.parse_traceroute_line(line)
+        if not parsed:
+            return None
+        
+        hop_num, ips, rtts = parsed
+        
+        if not ips:
+            # 超时的跳
+            self.route_hops[hop_num] = {'ip': None, 'rtts': []}
+            print(f"{hop_num:2d}  *  *  *  (请求超时)", flush=True)
+            return hop_num
+        
+        # 存储路由信息
+        self.route_hops[hop_num] = {
+            'ip': ips[0],
+            'rtts': rtts
+        }
+        
+        # 显示路由信息
+        print(f"{hop_num:2d}  ", end='', flush=True)
+        print(f"{ips[0]:15s}  ", end='', flush=True)
+        
+        # 显示 RTT
+        if rtts:
+            rtt_str = '  '.join(['*' if r is None else f"{r} ms" for r in rtts[:3]])
+            print(f"{rtt_str:30s}", end='', flush=True)
+        
+        # ASN 标注
+        if self.enricher:
+            info = self.enricher.annotate(ips[0])
+            if info:
+                entry = self.route_hops[hop_num]
+                entry['asn'], entry['prefix'], entry['org'] = info
+                print(f"  {self.enricher.format(ips[0])}", end='', flush=True)
+        
+        # TCP 端口检测
+        if self.enable_tcp_check:
+            reachable, tcp_rtt, status = self.test_tcp_port(ips[0])
+            self.route_hops[hop_num]['tcp'] = (reachable, tcp_rtt, status)
             
-        except FileNotFoundError:
-            print("\n❌ 错误: 找不到系统 traceroute 命令")
-            if self.is_windows:
-                print("Windows 应该自带 tracert 命令")
+            if reachable:
+                print(f"  | TCP:{self.tcp_port} ✓ {tcp_rtt:.1f}ms", end='')
+            elif status == "关闭":
+                print(f"  | TCP:{self.tcp_port} ✗ 关闭", end='')
             else:
-                print("请安装 traceroute:")
-                print("  Ubuntu/Debian: sudo apt-get install traceroute")
-                print("  CentOS/RHEL: sudo yum install traceroute")
-                print("  macOS: 系统自带")
-            return False
-        except KeyboardInterrupt:
-            print("\n\n⚠️  用户中断操作")
-            process.terminate()
-            return False
-        except Exception as e:
-            print(f"\n❌ 错误: {e}")
-            return False
+                print(f"  | TCP:{self.tcp_port} - {status}", end='')
         
-        print()
-        print("=" * 80)
-        return True
+        print(flush=True)
+        return hop_num
     
-    def run_final_tcp_test(self):
-        """对目标主机进行最终的 TCP 端口测试"""
-        if not self.enable_tcp_check:
-            return
-        
-        print(f"\n🎯 目标主机 TCP 端口测试:")
-        print(f"   主机: {self.destination} ({self.dest_ip})")
-        print(f"   端口: {self.tcp_port}")
-        
-        reachable, rtt, status = self.test_tcp_port(self.dest_ip, self.tcp_port)
-        
-        if reachable:
-            print(f"   状态: ✅ 端口开放")
-            print(f"   响应时间: {rtt:.2f} ms")
-        elif status == "关闭":
-            print(f"   状态: ⚠️  端口关闭（但主机可达）")
-        else:
-            print(f"   状态: ❌ {status}")
+    def engine(self, backend='system', output=None):
+        """
+        构建使用相同参数的 probe_engine.ProbeEngine
+        
+        Args:
+            backend: 探测后端名称（默认系统命令，None 表示自动选择）
+            output: 输出流（默认 sys.stdout）
+            
+        Raises:
+            ValueError: 指定的后端不存在或不可用
+        """
+        from probe_engine import ProbeEngine
+        
+        return ProbeEngine(self.destination, max_hops=self.max_hops,
+                           timeout=self.timeout, backend=backend,
+                           tcp_port=self.tcp_port,
+                           enable_tcp_check=self.enable_tcp_check,
+                           tcp_cache=self.tcp_cache, asn_index=self.asn_index,
+                           output=output)
+    
+    def _adopt(self, engine):
+        """取回引擎的解析结果和逐跳记录"""
+        self.dest_ip = engine.dest_ip
+        self.route_hops = engine.route_hops
     
     def trace(self):
-        """执行完整的追踪"""
-        if not self.resolve_destination():
+        """执行完整的追踪（经由 ProbeEngine 的系统命令后端）"""
+        try:
+            engine = self.engine()
+        except ValueError as e:
+            print(f"\n❌ 错误: {e}")
             return False
-        
-        print("\n" + "=" * 80)
-        print("  Python Traceroute - 非管理员模式")
-        print("  路由追踪 + TCP 端口检测")
-        print("=" * 80)
-        print()
-        
-        # 运行 traceroute
-        success = self.run_traceroute()
-        
-        if success:
-            # 最终测试
-            self.run_final_tcp_test()
-        
-        print()
+        success = engine.trace()
+        self._adopt(engine)
         return success
+    
+    def trace_deadline(self, deadline, min_timeout=0.1):
+        """
+        在总时限内执行追踪，不输出，返回结构化结果（见 ProbeEngine.trace_deadline，
+        同时更新 self.route_hops）
+        
+        Returns:
+            deadline.PartialTrace
+            
+        Raises:
+            ValueError: 系统 traceroute 命令不可用
+        """
+        engine = self.engine()
+        result = engine.trace_deadline(deadline, min_timeout)
+        self._adopt(engine)
+        return result
 
 
 def print_usage():
@@ -289,7 +316,13 @@ def print_usage():
     print("  -m, --max-hops <数字>    最大跳数 (默认: 30)")
     print("  -t, --timeout <秒数>     超时时间 (默认: 2)")
     print("  -p, --port <端口>        TCP 检测端口 (默认: 80)")
+    print("  -b, --backend <名称>     探测后端: system, raw, icmp-dgram, udp, tcp, auto (默认: system)")
     print("  --no-tcp                 禁用 TCP 端口检测")
+    print("  --store <目录>           将结果追加写入历史存储目录")
+    print("  --asn <索引文件>         使用离线 ASN 索引标注每一跳")
+    print("  -d, --deadline <秒数>    总时限，到时返回部分结果（每跳标记是否完整）")
+    print("  --batch                  从标准输入逐行读取参数，单进程批量执行")
+    print("                           （同时给出的其他选项作为每行的默认值）")
     print("  -h, --help               显示此帮助信息")
     print("\n功能说明:")
     print("  • 使用系统 traceroute/tracert 命令进行路由追踪（ICMP）")
@@ -310,95 +343,238 @@ def print_usage():
     print("  python trace.py target.com -p 80 -m 20 -t 3")
 
 
-def main():
-    """主函数"""
-    if len(sys.argv) < 2:
-        print_usage()
-        sys.exit(1)
+def parse_args(argv):
+    """
+    解析命令行参数（不导入 argparse，避免额外的启动开销）
     
-    destination = None
-    max_hops = 30
-    timeout = 2
-    tcp_port = 80
-    enable_tcp = True
+    Args:
+        argv: 参数列表（不含程序名）
+        
+    Returns:
+        参数字典，请求帮助时返回 None
+        
+    Raises:
+        ValueError: 参数无效，异常信息为错误描述
+    """
+    options = {
+        'destination': None,
+        'max_hops': 30,
+        'timeout': 2,
+        'tcp_port': 80,
+        'enable_tcp': True,
+        'store_path': None,
+        'asn_index': None,
+        'deadline': None,
+        'backend': 'system',
+    }
     
-    i = 1
-    while i < len(sys.argv):
-        arg = sys.argv[i]
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
         
         if arg in ['-h', '--help']:
-            print_usage()
-            sys.exit(0)
+            return None
+        elif arg in ['-b', '--backend']:
+            if i + 1 >= len(argv):
+                raise ValueError("-b/--backend 需要一个参数")
+            # 后端名称在创建 ProbeEngine 时校验，避免在此导入探测模块
+            options['backend'] = None if argv[i + 1] == 'auto' else argv[i + 1]
+            i += 2
         elif arg in ['-m', '--max-hops']:
-            if i + 1 < len(sys.argv):
-                try:
-                    max_hops = int(sys.argv[i + 1])
-                    i += 2
-                except ValueError:
-                    print(f"错误: 无效的最大跳数值 '{sys.argv[i + 1]}'")
-                    sys.exit(1)
-            else:
-                print("错误: -m/--max-hops 需要一个参数")
-                sys.exit(1)
+            if i + 1 >= len(argv):
+                raise ValueError("-m/--max-hops 需要一个参数")
+            try:
+                options['max_hops'] = int(argv[i + 1])
+                # IP TTL 为 8 位
+                if not (1 <= options['max_hops'] <= 255):
+                    raise ValueError
+            except ValueError:
+                raise ValueError(f"无效的最大跳数值 '{argv[i + 1]}' (1-255)")
+            i += 2
         elif arg in ['-t', '--timeout']:
-            if i + 1 < len(sys.argv):
-                try:
-                    timeout = float(sys.argv[i + 1])
-                    i += 2
-                except ValueError:
-                    print(f"错误: 无效的超时值 '{sys.argv[i + 1]}'")
-                    sys.exit(1)
-            else:
-                print("错误: -t/--timeout 需要一个参数")
-                sys.exit(1)
+            if i + 1 >= len(argv):
+                raise ValueError("-t/--timeout 需要一个参数")
+            try:
+                options['timeout'] = float(argv[i + 1])
+            except ValueError:
+                raise ValueError(f"无效的超时值 '{argv[i + 1]}'")
+            i += 2
         elif arg in ['-p', '--port']:
-            if i + 1 < len(sys.argv):
-                try:
-                    tcp_port = int(sys.argv[i + 1])
-                    if not (1 <= tcp_port <= 65535):
-                        raise ValueError
-                    i += 2
-                except ValueError:
-                    print(f"错误: 无效的端口号 '{sys.argv[i + 1]}'")
-                    sys.exit(1)
-            else:
-                print("错误: -p/--port 需要一个参数")
-                sys.exit(1)
+            if i + 1 >= len(argv):
+                raise ValueError("-p/--port 需要一个参数")
+            try:
+                options['tcp_port'] = int(argv[i + 1])
+                if not (1 <= options['tcp_port'] <= 65535):
+                    raise ValueError
+            except ValueError:
+                raise ValueError(f"无效的端口号 '{argv[i + 1]}'")
+            i += 2
+        elif arg in ['-d', '--deadline']:
+            if i + 1 >= len(argv):
+                raise ValueError("-d/--deadline 需要一个参数")
+            try:
+                options['deadline'] = float(argv[i + 1])
+                if options['deadline'] <= 0:
+                    raise ValueError
+            except ValueError:
+                raise ValueError(f"无效的时限值 '{argv[i + 1]}'")
+            i += 2
         elif arg == '--no-tcp':
-            enable_tcp = False
+            options['enable_tcp'] = False
             i += 1
+        elif arg == '--store':
+            if i + 1 >= len(argv):
+                raise ValueError("--store 需要一个参数")
+            options['store_path'] = argv[i + 1]
+            i += 2
+        elif arg == '--asn':
+            if i + 1 >= len(argv):
+                raise ValueError("--asn 需要一个参数")
+            options['asn_index'] = argv[i + 1]
+            i += 2
         elif arg.startswith('-'):
-            print(f"错误: 未知选项 '{arg}'")
-            print_usage()
-            sys.exit(1)
+            raise ValueError(f"未知选项 '{arg}'")
+        elif options['destination'] is None:
+            options['destination'] = arg
+            i += 1
         else:
-            if destination is None:
-                destination = arg
-                i += 1
-            else:
-                print(f"错误: 多余的参数 '{arg}'")
+            raise ValueError(f"多余的参数 '{arg}'")
+    
+    if options['destination'] is None:
+        raise ValueError("未指定目标主机")
+    return options
+
+
+def run(options, tcp_cache=None):
+    """
+    按解析后的参数执行一次追踪
+    
+    Args:
+        options: parse_args 返回的参数字典
+        tcp_cache: 共享的 TCP 检测结果缓存（可选）
+    
+    Returns:
+        是否成功
+        
+    Raises:
+        ValueError: 指定的探测后端不存在或不可用
+    """
+    from probe_engine import ProbeEngine
+    
+    engine = ProbeEngine(
+        options['destination'],
+        max_hops=options['max_hops'],
+        timeout=options['timeout'],
+        backend=options['backend'],
+        tcp_port=options['tcp_port'],
+        enable_tcp_check=options['enable_tcp'],
+        tcp_cache=tcp_cache,
+        asn_index=options['asn_index']
+    )
+    
+    if options['deadline'] is not None:
+        from deadline import format_partial
+        result = engine.trace_deadline(options['deadline'])
+        print(format_partial(result))
+        success = result.dest_ip is not None and result.error is None
+    else:
+        success = engine.trace()
+    
+    if success and options['store_path']:
+        engine.save(options['store_path'])
+        print(f"💾 结果已保存到: {options['store_path']}")
+    
+    return success
+
+
+def run_batch(stream, defaults=()):
+    """
+    批量模式：从输入流逐行读取参数并在同一进程中依次执行
+    
+    每行格式与命令行参数相同，如 "www.baidu.com -p 443 -m 20"，
+    空行和 # 开头的行被忽略；各次追踪共享 TCP 检测结果缓存，
+    共同经过的路由器在有效期内不会被重复检测
+    
+    Args:
+        stream: 输入流
+        defaults: 每行之前附加的默认选项（行内选项优先）
+    
+    Returns:
+        失败的行数
+    """
+    import shlex
+    from tcp_cache import TcpCheckCache
+    
+    tcp_cache = TcpCheckCache()
+    failures = 0
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            options = parse_args(list(defaults) + shlex.split(line))
+            if options is None:
+                raise ValueError("批量模式不支持 -h/--help")
+        except ValueError as e:
+            print(f"错误: 第 {line_no} 行: {e}")
+            failures += 1
+            continue
+        
+        try:
+            if not run(options, tcp_cache):
+                failures += 1
+        except Exception as e:
+            print(f"\n❌ 错误: {e}")
+            failures += 1
+        sys.stdout.flush()
+    
+    if tcp_cache.hits or tcp_cache.waits:
+        print(tcp_cache.summary())
+    return failures
+
+
+def main():
+    """主函数"""
+    if len(sys.argv) < 2:
+        print_usage()
+        sys.exit(1)
+    
+    if '--batch' in sys.argv[1:]:
+        defaults = [arg for arg in sys.argv[1:] if arg != '--batch']
+        try:
+            # 默认选项中不能包含目标主机
+            if parse_args(['_'] + defaults) is None:
                 print_usage()
-                sys.exit(1)
+                sys.exit(0)
+        except ValueError as e:
+            print(f"错误: {e}（--batch 模式下命令行只能包含选项）")
+            sys.exit(1)
+        try:
+            failures = run_batch(sys.stdin, defaults)
+        except KeyboardInterrupt:
+            print("\n\n⚠️  用户中断操作")
+            sys.exit(0)
+        sys.exit(1 if failures else 0)
     
-    if destination is None:
-        print("错误: 未指定目标主机")
+    try:
+        options = parse_args(sys.argv[1:])
+    except ValueError as e:
+        print(f"错误: {e}")
         print_usage()
         sys.exit(1)
     
-    # 创建并运行 traceroute
-    tracer = TracerouteNoAdmin(
-        destination=destination,
-        max_hops=max_hops,
-        timeout=timeout,
-        tcp_port=tcp_port,
-        enable_tcp_check=enable_tcp
-    )
+    if options is None:
+        print_usage()
+        sys.exit(0)
     
     try:
-        tracer.trace()
+        run(options)
     except KeyboardInterrupt:
         print("\n\n⚠️  用户中断操作")
         sys.exit(0)
+    except ValueError as e:
+        print(f"❌ 错误: {e}")
+        sys.exit(1)
     except Exception as e:
         print(f"\n❌ 错误: {e}")
         import traceback
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Trace Result Store - 历史追踪结果的紧凑存储
+将每次追踪的跳信息以定长二进制记录追加写入分块文件：
+IP 打包为 16 字节整数（IPv4 使用 IPv4-mapped 形式），RTT 使用 float32，
+状态使用单字节枚举；读取时通过 mmap 按需解析，支持按目标和时间范围查询
+
+每个存储目录只允许一个写入者。写入中断留下的不完整记录会在下次追加前截掉；
+记录不带校验和，分块中间的位损坏无法检测
+"""
+
+import os
+import mmap
+import socket
+import struct
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+# 跳状态
+HOP_REPLY = 0       # 有响应
+HOP_TIMEOUT = 1     # 请求超时 (* * *)
+
+# TCP 检测状态
+TCP_NONE = 0        # 未检测
+TCP_OPEN = 1        # 开放
+TCP_CLOSED = 2      # 关闭
+TCP_TIMEOUT = 3     # 超时
+TCP_UNREACHABLE = 4 # 不可达
+
+TCP_STATUS_CODES = {
+    "开放": TCP_OPEN,
+    "关闭": TCP_CLOSED,
+    "超时": TCP_TIMEOUT,
+    "不可达": TCP_UNREACHABLE,
+}
+TCP_STATUS_NAMES = {code: name for name, code in TCP_STATUS_CODES.items()}
+
+# 记录头: 负载长度(4) + 时间戳(8) + 目标IP(16) + 跳数(2)
+TRACE_HEADER = struct.Struct('<Id16sH')
+# 跳记录: 跳数(1) + IP(16) + 跳状态(1) + TCP状态(1) + RTT个数(1) + TCP RTT(4)
+HOP_HEADER = struct.Struct('<B16sBBBf')
+
+# IP TTL 为 8 位，跳数不会超过 255
+MAX_HOP = 255
+
+_V4_PREFIX = b'\x00' * 10 + b'\xff\xff'
+_EMPTY_IP = b'\x00' * 16
+
+CHUNK_PREFIX = 'chunk-'
+CHUNK_SUFFIX = '.bin'
+
+
+def pack_ip(ip):
+    """
+    将 IP 地址字符串打包为 16 字节
+
+    Args:
+        ip: IPv4/IPv6 地址字符串，None 表示无响应
+
+    Returns:
+        16 字节 bytes
+    """
+    if not ip:
+        return _EMPTY_IP
+    if ':' in ip:
+        return socket.inet_pton(socket.AF_INET6, ip)
+    return _V4_PREFIX + socket.inet_aton(ip)
+
+
+def unpack_ip(packed):
+    """
+    将 16 字节还原为 IP 地址字符串
+
+    Args:
+        packed: 16 字节 bytes
+
+    Returns:
+        IP 地址字符串或 None
+    """
+    if packed == _EMPTY_IP:
+        return None
+    if packed[:12] == _V4_PREFIX:
+        return socket.inet_ntoa(packed[12:])
+    return socket.inet_ntop(socket.AF_INET6, packed)
+
+
+class HopRecord:
+    """单跳记录"""
+
+    __slots__ = ('hop', 'ip', 'status', 'tcp_status', 'tcp_rtt', 'rtts')
+
+    def __init__(self, hop, ip=None, rtts=(), status=None,
+                 tcp_status=TCP_NONE, tcp_rtt=None):
+        """
+        初始化
+
+        Args:
+            hop: 跳数
+            ip: 响应 IP，None 表示超时
+            rtts: RTT 列表（毫秒，None 表示该次查询超时）
+            status: 跳状态，默认根据 ip 推断
+            tcp_status: TCP 检测状态码
+            tcp_rtt: TCP 连接时间（毫秒）
+        """
+        self.hop = hop
+        self.ip = ip
+        self.rtts = array('f', [float('nan') if r is None else float(r)
+                                for r in rtts])
+        if status is None:
+            status = HOP_REPLY if ip else HOP_TIMEOUT
+        self.status = status
+        self.tcp_status = tcp_status
+        self.tcp_rtt = tcp_rtt
+
+    def __repr__(self):
+        return (f"HopRecord(hop={self.hop}, ip={self.ip!r}, "
+                f"rtts={list(self.rtts)}, status={self.status}, "
+                f"tcp_status={self.tcp_status}, tcp_rtt={self.tcp_rtt})")
+
+    def pack(self):
+        """
+        序列化为 bytes
+
+        Raises:
+            ValueError: 跳数超过 255
+        """
+        if not 0 <= self.hop <= MAX_HOP:
+            raise ValueError(f"跳数 {self.hop} 超出范围 (最大 {MAX_HOP})")
+        tcp_rtt = float('nan') if self.tcp_rtt is None else self.tcp_rtt
+        rtts = self.rtts[:255]
+        return HOP_HEADER.pack(self.hop, pack_ip(self.ip), self.status,
+                               self.tcp_status, len(rtts), tcp_rtt) + rtts.tobytes()
+
+    @classmethod
+    def unpack_from(cls, buffer, offset):
+        """
+        从缓冲区反序列化
+
+        Returns:
+            (HopRecord, 下一条记录偏移)
+        """
+        hop, ip, status, tcp_status, count, tcp_rtt = HOP_HEADER.unpack_from(buffer, offset)
+        offset += HOP_HEADER.size
+        record = cls.__new__(cls)
+        record.hop = hop
+        record.ip = unpack_ip(ip)
+        record.status = status
+        record.tcp_status = tcp_status
+        record.tcp_rtt = None if tcp_rtt != tcp_rtt else tcp_rtt
+        record.rtts = array('f')
+        record.rtts.frombytes(buffer[offset:offset + count * 4])
+        return record, offset + count * 4
+
+
+class TraceRecord:
+    """一次追踪的结果"""
+
+    __slots__ = ('timestamp', 'dest_ip', 'hops')
+
+    def __init__(self, timestamp, dest_ip, hops):
+        self.timestamp = timestamp
+        self.dest_ip = dest_ip
+        self.hops = hops
+
+    def __repr__(self):
+        return (f"TraceRecord(timestamp={self.timestamp}, "
+                f"dest_ip={self.dest_ip!r}, hops={len(self.hops)})")
+
+
+def hops_from_route_hops(route_hops):
+    """
+    将 TracerouteNoAdmin.route_hops 转换为 HopRecord 列表
+
+    Args:
+        route_hops: {hop: {'ip': str, 'rtts': [str], 'tcp': (reachable, rtt, status)}}
+
+    Returns:
+        按跳数排序的 HopRecord 列表
+    """
+    hops = []
+    for hop_num in sorted(route_hops):
+        info = route_hops[hop_num]
+        rtts = []
+        for r in info.get('rtts', []):
+            try:
+                rtts.append(float(r))
+            except (TypeError, ValueError):
+                rtts.append(None)
+        tcp_status = TCP_NONE
+        tcp_rtt = None
+        tcp = info.get('tcp')
+        if tcp:
+            _, tcp_rtt, status = tcp
+            tcp_status = TCP_STATUS_CODES.get(status, TCP_UNREACHABLE)
+        hops.append(HopRecord(hop_num, info.get('ip'), rtts,
+                              tcp_status=tcp_status, tcp_rtt=tcp_rtt))
+    return hops
+
+
+class TraceStore:
+    """分块二进制追踪结果存储"""
+
+    def __init__(self, path, chunk_size=64 * 1024 * 1024):
+        """
+        初始化
+
+        Args:
+            path: 存储目录
+            chunk_size: 单个分块文件的最大字节数
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self._index = None   # {dest_ip: ([timestamp], [(chunk_id, offset)])}
+        self._maps = {}      # chunk_id -> (file, mmap, size)
+        self._current_chunk = None
+        os.makedirs(path, exist_ok=True)
+
+    def _chunk_path(self, chunk_id):
+        return os.path.join(self.path, f"{CHUNK_PREFIX}{chunk_id:06d}{CHUNK_SUFFIX}")
+
+    def _chunk_ids(self):
+        ids = []
+        for name in os.listdir(self.path):
+            if name.startswith(CHUNK_PREFIX) and name.endswith(CHUNK_SUFFIX):
+                try:
+                    ids.append(int(name[len(CHUNK_PREFIX):-len(CHUNK_SUFFIX)]))
+                except ValueError:
+                    continue
+        return sorted(ids)
+
+    def _add_to_index(self, dest_ip, timestamp, chunk_id, offset):
+        times, locations = self._index.setdefault(dest_ip, ([], []))
+        if not times or timestamp >= times[-1]:
+            times.append(timestamp)
+            locations.append((chunk_id, offset))
+        else:
+            # 时间乱序时保持有序插入
+            pos = bisect_right(times, timestamp)
+            times.insert(pos, timestamp)
+            locations.insert(pos, (chunk_id, offset))
+
+    def _load_index(self):
+        """扫描所有分块的记录头建立索引（仅首次查询时执行）"""
+        if self._index is not None:
+            return
+        self._index = {}
+        for chunk_id in self._chunk_ids():
+            buffer = self._map_chunk(chunk_id)
+            if buffer is None:
+                continue
+            offset = 0
+            size = len(buffer)
+            while offset + TRACE_HEADER.size <= size:
+                length, timestamp, dest, _ = TRACE_HEADER.unpack_from(buffer, offset)
+                if offset + TRACE_HEADER.size + length > size:
+                    break  # 末尾不完整的记录（写入中断）
+                self._add_to_index(unpack_ip(dest), timestamp, chunk_id, offset)
+                offset += TRACE_HEADER.size + length
+
+    def _map_chunk(self, chunk_id):
+        """以只读方式 mmap 分块文件，文件增长后重新映射"""
+        path = self._chunk_path(chunk_id)
+        size = os.path.getsize(path)
+        cached = self._maps.get(chunk_id)
+        if cached and cached[2] == size:
+            return cached[1]
+        if cached:
+            cached[1].close()
+            cached[0].close()
+        if size == 0:
+            return None
+        f = open(path, 'rb')
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps[chunk_id] = (f, m, size)
+        return m
+
+    def append(self, dest_ip, hops, timestamp=None):
+        """
+        追加一次追踪结果
+
+        Args:
+            dest_ip: 目标 IP
+            hops: HopRecord 列表
+            timestamp: 时间戳（默认当前时间）
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        payload = b''.join(hop.pack() for hop in hops)
+        record = TRACE_HEADER.pack(len(payload), timestamp,
+                                   pack_ip(dest_ip), len(hops)) + payload
+
+        if self._current_chunk is None:
+            ids = self._chunk_ids()
+            self._current_chunk = ids[-1] if ids else 0
+            if ids:
+                self._repair_tail(self._current_chunk)
+        chunk_id = self._current_chunk
+        path = self._chunk_path(chunk_id)
+        if os.path.exists(path) and os.path.getsize(path) + len(record) > self.chunk_size:
+            chunk_id = self._current_chunk = chunk_id + 1
+            path = self._chunk_path(chunk_id)
+
+        with open(path, 'ab') as f:
+            offset = f.tell()
+            f.write(record)
+
+        if self._index is not None:
+            self._add_to_index(dest_ip, timestamp, chunk_id, offset)
+
+    def _repair_tail(self, chunk_id):
+        """
+        截掉分块末尾写入中断留下的不完整记录
+
+        不截掉的话，之后追加的记录会跟在半条记录后面，扫描时整个分块的
+        后续记录都无法读取
+        """
+        path = self._chunk_path(chunk_id)
+        size = os.path.getsize(path)
+        end = 0
+        with open(path, 'rb') as f:
+            while end + TRACE_HEADER.size <= size:
+                f.seek(end)
+                length = TRACE_HEADER.unpack(f.read(TRACE_HEADER.size))[0]
+                if end + TRACE_HEADER.size + length > size:
+                    break
+                end += TRACE_HEADER.size + length
+        if end < size:
+            os.truncate(path, end)
+
+    def append_route_hops(self, dest_ip, route_hops, timestamp=None):
+        """追加 TracerouteNoAdmin.route_hops 格式的结果"""
+        self.append(dest_ip, hops_from_route_hops(route_hops), timestamp)
+
+    def _read(self, chunk_id, offset):
+        buffer = self._map_chunk(chunk_id)
+        _, timestamp, dest, count = TRACE_HEADER.unpack_from(buffer, offset)
+        offset += TRACE_HEADER.size
+        hops = []
+        for _ in range(count):
+            hop, offset = HopRecord.unpack_from(buffer, offset)
+            hops.append(hop)
+        return TraceRecord(timestamp, unpack_ip(dest), hops)
+
+    def destinations(self):
+        """返回存储中的所有目标 IP"""
+        self._load_index()
+        return list(self._index)
+
+    def query(self, dest_ip=None, start=None, end=None):
+        """
+        按目标和时间范围查询
+
+        Args:
+            dest_ip: 目标 IP（None 表示所有目标）
+            start: 起始时间戳（含）
+            end: 结束时间戳（含）
+
+        Returns:
+            按时间排序的 TraceRecord 列表
+        """
+        self._load_index()
+        dests = [dest_ip] if dest_ip is not None else list(self._index)
+        results = []
+        for dest in dests:
+            entry = self._index.get(dest)
+            if not entry:
+                continue
+            times, locations = entry
+            lo = 0 if start is None else bisect_left(times, start)
+            hi = len(times) if end is None else bisect_right(times, end)
+            for chunk_id, offset in locations[lo:hi]:
+                results.append(self._read(chunk_id, offset))
+        if dest_ip is None:
+            results.sort(key=lambda r: r.timestamp)
+        return results
+
+    def close(self):
+        """释放所有 mmap"""
+        for f, m, _ in self._maps.values():
+            m.close()
+            f.close()
+        self._maps = {}
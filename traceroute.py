@@ -13,6 +13,25 @@ import os
 import select
 
 
+# ICMP 序列号只有 16 位：高 8 位放 TTL，低 8 位放查询序号
+MAX_TTL = 255
+MAX_QUERIES = 256
+
+
+def probe_sequence(ttl, query):
+    """
+    计算探测包的 ICMP 序列号
+    
+    Args:
+        ttl: Time To Live 值（1-255）
+        query: 该跳内的查询序号（0-255）
+        
+    Returns:
+        16 位序列号
+    """
+    return (ttl << 8) | query
+
+
 class Traceroute:
     """Traceroute 实现类"""
     
@@ -25,7 +44,14 @@ class Traceroute:
             max_hops: 最大跳数，默认30
             timeout: 每次查询超时时间（秒），默认2
             queries: 每一跳的查询次数，默认3
+            
+        Raises:
+            ValueError: 跳数或查询次数超出序列号能表示的范围
         """
+        if not 1 <= max_hops <= MAX_TTL:
+            raise ValueError(f"最大跳数 {max_hops} 超出范围 (1-{MAX_TTL})")
+        if not 1 <= queries <= MAX_QUERIES:
+            raise ValueError(f"查询次数 {queries} 超出范围 (1-{MAX_QUERIES})")
         self.destination = destination
         self.max_hops = max_hops
         self.timeout = timeout
@@ -60,12 +86,13 @@ class Traceroute:
         # 取反
         return ~checksum & 0xFFFF
     
-    def create_icmp_packet(self, sequence):
+    def create_icmp_packet(self, sequence, payload_size=8):
         """
         创建 ICMP Echo Request 数据包
         
         Args:
             sequence: 序列号
+            payload_size: 数据部分字节数（默认8，即时间戳）
             
         Returns:
             ICMP数据包（bytes）
@@ -81,13 +108,17 @@ class Traceroute:
         
         # 添加时间戳作为数据部分
         data = struct.pack('!d', time.time())
+        if payload_size > len(data):
+            data += b'\x00' * (payload_size - len(data))
+        else:
+            data = data[:payload_size]
         
         # 计算校验和
         icmp_checksum = self.checksum(header + data)
         
-        # 重新打包，包含正确的校验和
+        # 重新打包，包含正确的校验和（checksum 已按网络字节序计算）
         header = struct.pack('!BBHHH', icmp_type, icmp_code, 
-                            socket.htons(icmp_checksum), self.identifier, sequence)
+                            icmp_checksum, self.identifier, sequence)
         
         return header + data
     
@@ -114,6 +145,48 @@ class Traceroute:
         
         return icmp_type, icmp_code, packet_id, sequence
     
+    def parse_icmp_response(self, data):
+        """
+        解析 ICMP 响应，对差错报文提取被引用的原始探测包
+        
+        Args:
+            data: 接收到的数据包（含IP头部）
+            
+        Returns:
+            (icmp_type, icmp_code, 探测包ID, 探测包序列号, 下一跳MTU) 或 None
+            （下一跳MTU 仅在 Fragmentation Needed 报文中有效，否则为0）
+        """
+        if len(data) < 20:
+            return None
+        ihl = (data[0] & 0x0F) * 4
+        if len(data) < ihl + 8:
+            return None
+        
+        icmp_type, icmp_code, _, rest_hi, rest_lo = struct.unpack_from(
+            '!BBHHH', data, ihl
+        )
+        
+        # Echo Reply: ID 和序列号在外层 ICMP 头部
+        if icmp_type == 0:
+            return icmp_type, icmp_code, rest_hi, rest_lo, 0
+        
+        # Destination Unreachable (3) / Time Exceeded (11):
+        # 数据部分为原始 IP 头部 + 原始 ICMP 头部前8字节
+        if icmp_type in (3, 11):
+            inner = ihl + 8
+            if len(data) < inner + 20:
+                return None
+            inner_ihl = (data[inner] & 0x0F) * 4
+            if len(data) < inner + inner_ihl + 8:
+                return None
+            _, _, _, packet_id, sequence = struct.unpack_from(
+                '!BBHHH', data, inner + inner_ihl
+            )
+            next_hop_mtu = rest_lo if icmp_type == 3 and icmp_code == 4 else 0
+            return icmp_type, icmp_code, packet_id, sequence, next_hop_mtu
+        
+        return None
+    
     def get_hostname(self, ip_address):
         """
         获取IP地址的主机名（反向DNS查询）
@@ -141,38 +214,47 @@ class Traceroute:
             print(f"错误: 无法解析主机名 '{self.destination}': {e}")
             return False
     
-    def send_probe(self, ttl, sequence):
+    def send_probe(self, ttl, sequence, timeout=None):
         """
         发送一个探测包
         
         Args:
             ttl: Time To Live 值
             sequence: 序列号
+            timeout: 本次超时时间（秒），默认使用 self.timeout
             
         Returns:
             (响应时间(ms), 响应IP地址, 是否到达目标) 或 (None, None, False)
+            
+        Raises:
+            PermissionError: 没有创建原始套接字的权限
+            OSError: 无法创建套接字
         """
         # 创建发送和接收socket
         try:
             # Windows使用IPPROTO_ICMP，Linux/Mac使用IPPROTO_ICMP也可以
             send_socket = socket.socket(socket.AF_INET, socket.SOCK_RAW, 
                                        socket.IPPROTO_ICMP)
+        except PermissionError as e:
+            raise PermissionError("需要管理员/root权限来创建原始套接字"
+                                  "（Windows: 请以管理员身份运行; Linux/Mac: 请使用 sudo 运行）") from e
+        except OSError as e:
+            raise OSError(f"无法创建套接字: {e}") from e
+        try:
             recv_socket = socket.socket(socket.AF_INET, socket.SOCK_RAW, 
                                        socket.IPPROTO_ICMP)
-        except PermissionError:
-            print("\n错误: 需要管理员/root权限来创建原始套接字")
-            print("Windows: 请以管理员身份运行")
-            print("Linux/Mac: 请使用 sudo 运行")
-            sys.exit(1)
         except OSError as e:
-            print(f"\n错误: 无法创建套接字: {e}")
-            sys.exit(1)
+            send_socket.close()
+            raise OSError(f"无法创建套接字: {e}") from e
         
         # 设置TTL
         send_socket.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
         
+        if timeout is None:
+            timeout = self.timeout
+        
         # 设置接收超时
-        recv_socket.settimeout(self.timeout)
+        recv_socket.settimeout(timeout)
         
         # 创建并发送ICMP包
         packet = self.create_icmp_packet(sequence)
@@ -188,7 +270,7 @@ class Traceroute:
         # 等待响应
         try:
             # 使用select进行超时控制（跨平台）
-            ready = select.select([recv_socket], [], [], self.timeout)
+            ready = select.select([recv_socket], [], [], timeout)
             
             if ready[0]:
                 data, addr = recv_socket.recvfrom(1024)
@@ -233,70 +315,205 @@ class Traceroute:
             recv_socket.close()
             return None, None, False
     
+    def engine(self, batch=False):
+        """
+        构建以本实例收发探测包的 probe_engine.ProbeEngine（原始 ICMP 后端）
+        
+        Args:
+            batch: 并行发出所有 TTL 的探测并批量接收
+        """
+        from probe_engine import ProbeEngine, RawICMPBackend
+        
+        backend = RawICMPBackend(max_hops=self.max_hops, timeout=self.timeout,
+                                 queries=self.queries, batch=batch, tracer=self)
+        return ProbeEngine(self.destination, max_hops=self.max_hops,
+                           timeout=self.timeout, queries=self.queries,
+                           backend=backend)
+    
     def trace(self):
-        """执行 traceroute"""
-        if not self.resolve_destination():
-            return
+        """
+        执行 traceroute（经由 ProbeEngine 输出）
+        
+        Raises:
+            PermissionError: 没有创建原始套接字的权限
+            OSError: 无法创建套接字
+        """
+        engine = self.engine()
+        success = engine.trace()
+        self.dest_ip = engine.dest_ip
+        return success
+    
+    def trace_deadline(self, deadline, min_timeout=0.1):
+        """
+        在总时限内执行 traceroute，不输出，返回结构化结果
         
-        reached_destination = False
+        由 ProbeEngine.trace_deadline 在每一跳开始前按剩余时间重新分摊预算：
+        快速响应省下的时间留给后面的跳，预算不足时减少查询次数并缩短超时；
+        无法创建套接字时保留已探测的跳并记录在 result.error 中
         
-        for ttl in range(1, self.max_hops + 1):
-            # 打印跳数
-            print(f"{ttl:2d}  ", end='', flush=True)
-            
-            responses = []
-            current_ip = None
-            
-            # 发送多次查询
-            for query in range(self.queries):
-                sequence = ttl * 1000 + query
-                rtt, ip_addr, is_destination = self.send_probe(ttl, sequence)
-                
-                if rtt is not None and ip_addr is not None:
-                    responses.append(rtt)
-                    if current_ip is None:
-                        current_ip = ip_addr
-                    
-                    if is_destination:
-                        reached_destination = True
-                else:
-                    responses.append(None)
+        Args:
+            deadline: 总时限（秒，包括域名解析）
+            min_timeout: 单次查询超时下限（秒）
             
-            # 输出结果
-            if current_ip:
-                hostname = self.get_hostname(current_ip)
-                print(f"{hostname}  ", end='')
-                
-                for rtt in responses:
-                    if rtt is not None:
-                        print(f"{rtt:.2f} ms  ", end='')
-                    else:
-                        print("*  ", end='')
-                print()
-                
-                if reached_destination:
-                    print(f"\n到达目标: {self.destination} ({self.dest_ip})")
-                    break
-            else:
-                # 所有查询都超时
-                print("*  *  *  (请求超时)")
-        
-        if not reached_destination:
-            print(f"\n未能在 {self.max_hops} 跳内到达目标")
+        Returns:
+            deadline.PartialTrace
+        """
+        engine = self.engine()
+        result = engine.trace_deadline(deadline, min_timeout)
+        self.dest_ip = engine.dest_ip
+        return result
 
 
 def print_usage():
     """打印使用说明"""
     print("用法: python traceroute.py <目标主机> [选项]")
     print("\n选项:")
-    print("  -m, --max-hops <数字>    最大跳数 (默认: 30)")
+    print("  -m, --max-hops <数字>    最大跳数 (默认: 30, 最大 255)")
     print("  -t, --timeout <秒数>     超时时间 (默认: 2)")
-    print("  -q, --queries <数字>     每跳查询次数 (默认: 3)")
+    print("  -q, --queries <数字>     每跳查询次数 (默认: 3, 最大 256)")
+    print("  -d, --deadline <秒数>    总时限，到时返回部分结果")
+    print("  --batch                  从标准输入逐行读取参数，单进程批量执行")
+    print("                           （同时给出的其他选项作为每行的默认值）")
     print("  -h, --help               显示此帮助信息")
     print("\n示例:")
     print("  python traceroute.py www.google.com")
     print("  python traceroute.py 8.8.8.8 -m 20 -t 3")
     print("  python traceroute.py baidu.com --max-hops 15 --queries 2")
+    print("  python traceroute.py 8.8.8.8 -d 5")
+
+
+def parse_args(argv):
+    """
+    解析命令行参数
+    
+    Args:
+        argv: 参数列表（不含程序名）
+        
+    Returns:
+        参数字典，请求帮助时返回 None
+        
+    Raises:
+        ValueError: 参数无效，异常信息为错误描述
+    """
+    options = {
+        'destination': None,
+        'max_hops': 30,
+        'timeout': 2,
+        'queries': 3,
+        'deadline': None,
+    }
+    
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        
+        if arg in ['-h', '--help']:
+            return None
+        elif arg in ['-m', '--max-hops']:
+            if i + 1 >= len(argv):
+                raise ValueError("-m/--max-hops 需要一个参数")
+            try:
+                options['max_hops'] = int(argv[i + 1])
+                if not 1 <= options['max_hops'] <= MAX_TTL:
+                    raise ValueError
+            except ValueError:
+                raise ValueError(f"无效的最大跳数值 '{argv[i + 1]}' (1-{MAX_TTL})")
+            i += 2
+        elif arg in ['-t', '--timeout']:
+            if i + 1 >= len(argv):
+                raise ValueError("-t/--timeout 需要一个参数")
+            try:
+                options['timeout'] = float(argv[i + 1])
+            except ValueError:
+                raise ValueError(f"无效的超时值 '{argv[i + 1]}'")
+            i += 2
+        elif arg in ['-q', '--queries']:
+            if i + 1 >= len(argv):
+                raise ValueError("-q/--queries 需要一个参数")
+            try:
+                options['queries'] = int(argv[i + 1])
+                if not 1 <= options['queries'] <= MAX_QUERIES:
+                    raise ValueError
+            except ValueError:
+                raise ValueError(f"无效的查询次数值 '{argv[i + 1]}' (1-{MAX_QUERIES})")
+            i += 2
+        elif arg in ['-d', '--deadline']:
+            if i + 1 >= len(argv):
+                raise ValueError("-d/--deadline 需要一个参数")
+            try:
+                options['deadline'] = float(argv[i + 1])
+                if options['deadline'] <= 0:
+                    raise ValueError
+            except ValueError:
+                raise ValueError(f"无效的时限值 '{argv[i + 1]}'")
+            i += 2
+        elif arg.startswith('-'):
+            raise ValueError(f"未知选项 '{arg}'")
+        elif options['destination'] is None:
+            options['destination'] = arg
+            i += 1
+        else:
+            raise ValueError(f"多余的参数 '{arg}'")
+    
+    if options['destination'] is None:
+        raise ValueError("未指定目标主机")
+    return options
+
+
+def run(options):
+    """
+    按解析后的参数执行一次追踪
+    
+    Returns:
+        限时模式下因错误提前结束时返回 False，否则返回 True
+    """
+    tracer = Traceroute(options['destination'], max_hops=options['max_hops'], 
+                       timeout=options['timeout'], queries=options['queries'])
+    if options['deadline'] is not None:
+        from deadline import format_partial
+        result = tracer.trace_deadline(options['deadline'])
+        print(format_partial(result))
+        return result.error is None
+    tracer.trace()
+    return True
+
+
+def run_batch(stream, defaults=()):
+    """
+    批量模式：从输入流逐行读取参数并在同一进程中依次执行
+    
+    Args:
+        stream: 输入流，每行格式与命令行参数相同
+        defaults: 每行之前附加的默认选项（行内选项优先）
+    
+    Returns:
+        失败的行数
+    """
+    import shlex
+    
+    failures = 0
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            options = parse_args(list(defaults) + shlex.split(line))
+            if options is None:
+                raise ValueError("批量模式不支持 -h/--help")
+        except ValueError as e:
+            print(f"错误: 第 {line_no} 行: {e}")
+            failures += 1
+            continue
+        
+        try:
+            if not run(options):
+                failures += 1
+        except Exception as e:
+            print(f"\n错误: {e}")
+            failures += 1
+        print()
+        sys.stdout.flush()
+    return failures
 
 
 def main():
@@ -309,80 +526,39 @@ def main():
         print_usage()
         sys.exit(1)
     
-    destination = None
-    max_hops = 30
-    timeout = 2
-    queries = 3
-    
-    i = 1
-    while i < len(sys.argv):
-        arg = sys.argv[i]
+    batch = '--batch' in sys.argv[1:]
+    if batch:
+        defaults = [arg for arg in sys.argv[1:] if arg != '--batch']
+        try:
+            # 默认选项中不能包含目标主机
+            if parse_args(['_'] + defaults) is None:
+                print_usage()
+                sys.exit(0)
+        except ValueError as e:
+            print(f"错误: {e}（--batch 模式下命令行只能包含选项）")
+            sys.exit(1)
+    else:
+        try:
+            options = parse_args(sys.argv[1:])
+        except ValueError as e:
+            print(f"错误: {e}")
+            print_usage()
+            sys.exit(1)
         
-        if arg in ['-h', '--help']:
+        if options is None:
             print_usage()
             sys.exit(0)
-        elif arg in ['-m', '--max-hops']:
-            if i + 1 < len(sys.argv):
-                try:
-                    max_hops = int(sys.argv[i + 1])
-                    i += 2
-                except ValueError:
-                    print(f"错误: 无效的最大跳数值 '{sys.argv[i + 1]}'")
-                    sys.exit(1)
-            else:
-                print("错误: -m/--max-hops 需要一个参数")
-                sys.exit(1)
-        elif arg in ['-t', '--timeout']:
-            if i + 1 < len(sys.argv):
-                try:
-                    timeout = float(sys.argv[i + 1])
-                    i += 2
-                except ValueError:
-                    print(f"错误: 无效的超时值 '{sys.argv[i + 1]}'")
-                    sys.exit(1)
-            else:
-                print("错误: -t/--timeout 需要一个参数")
-                sys.exit(1)
-        elif arg in ['-q', '--queries']:
-            if i + 1 < len(sys.argv):
-                try:
-                    queries = int(sys.argv[i + 1])
-                    i += 2
-                except ValueError:
-                    print(f"错误: 无效的查询次数值 '{sys.argv[i + 1]}'")
-                    sys.exit(1)
-            else:
-                print("错误: -q/--queries 需要一个参数")
-                sys.exit(1)
-        elif arg.startswith('-'):
-            print(f"错误: 未知选项 '{arg}'")
-            print_usage()
-            sys.exit(1)
-        else:
-            if destination is None:
-                destination = arg
-                i += 1
-            else:
-                print(f"错误: 多余的参数 '{arg}'")
-                print_usage()
-                sys.exit(1)
-    
-    if destination is None:
-        print("错误: 未指定目标主机")
-        print_usage()
-        sys.exit(1)
     
     # Windows权限提示
     if is_windows:
         print("提示: 在Windows上运行需要管理员权限")
         print("如果出现权限错误，请以管理员身份运行命令提示符\n")
     
-    # 创建并运行 traceroute
-    tracer = Traceroute(destination, max_hops=max_hops, 
-                       timeout=timeout, queries=queries)
-    
     try:
-        tracer.trace()
+        if batch:
+            sys.exit(1 if run_batch(sys.stdin, defaults) else 0)
+        if not run(options):
+            sys.exit(1)
     except KeyboardInterrupt:
         print("\n\n中断: 用户取消操作")
         sys.exit(0)
@@ -393,4 +569,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
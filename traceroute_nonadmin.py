@@ -2,12 +2,10 @@
 """
 Python Traceroute Implementation (Non-Admin Version)
 无需管理员权限的 Traceroute 实现
-通过调用系统命令并解析输出来实现跨平台支持
+通过 probe_engine 的系统命令后端调用 tracert/traceroute 实现跨平台支持
 """
 
-import subprocess
 import sys
-import re
 import platform
 
 
@@ -30,153 +28,23 @@ class TracerouteNonAdmin:
         self.queries = queries
         self.os_type = platform.system().lower()
         
-    def build_command(self):
+    def trace(self):
         """
-        根据操作系统构建 traceroute 命令
+        执行 traceroute（实时输出，经由 ProbeEngine 的系统命令后端）
         
         Returns:
-            命令列表
-        """
-        if self.os_type == 'windows':
-            # Windows: tracert
-            cmd = ['tracert']
-            cmd.extend(['-h', str(self.max_hops)])  # 最大跳数
-            cmd.extend(['-w', str(self.timeout * 1000)])  # 超时（毫秒）
-            cmd.append(self.destination)
-            return cmd
-        
-        elif self.os_type in ['linux', 'darwin']:
-            # Linux/macOS: traceroute
-            cmd = ['traceroute']
-            cmd.extend(['-m', str(self.max_hops)])  # 最大跳数
-            cmd.extend(['-w', str(self.timeout)])  # 超时（秒）
-            cmd.extend(['-q', str(self.queries)])  # 查询次数
-            cmd.append(self.destination)
-            return cmd
-        
-        else:
-            raise OSError(f"不支持的操作系统: {self.os_type}")
-    
-    def process_line_realtime(self, line, is_first_line):
-        """
-        实时处理输出行
-        
-        Args:
-            line: 输出行
-            is_first_line: 是否是第一行
+            是否完成追踪
         """
-        line = line.strip()
+        from probe_engine import ProbeEngine
         
-        # 跳过空行
-        if not line:
-            return
-        
-        if self.os_type == 'windows':
-            # Windows tracert 输出处理
-            if line.startswith('Tracing') or line.startswith('通过') or line.startswith('跟踪'):
-                # 显示目标信息
-                print(line)
-                print("=" * 70)
-            elif line.startswith('over') or line.startswith('最多') or '跃点' in line:
-                # 跳过 "over a maximum of" 行
-                return
-            elif line.startswith('Trace complete') or line.startswith('跟踪完成'):
-                # 完成信息
-                print("=" * 70)
-                print(line)
-            else:
-                # 解析跳数行
-                # 格式: "  1    <1 ms    <1 ms    <1 ms  192.168.1.1"
-                # 或: "  2     *        *        *     Request timed out."
-                hop_match = re.match(r'\s*(\d+)', line)
-                if hop_match:
-                    print(line)
-        else:
-            # Unix traceroute 输出处理
-            if is_first_line:
-                print("=" * 70)
-            print(line)
-    
-    def trace(self):
-        """执行 traceroute（实时输出）"""
         try:
-            # 构建命令
-            cmd = self.build_command()
-            
-            print(f"\n执行命令: {' '.join(cmd)}")
-            print(f"目标: {self.destination}")
-            print(f"最大跳数: {self.max_hops}, 超时: {self.timeout}秒")
-            print()
-            
-            # 使用 Popen 实现实时输出
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                encoding='utf-8' if self.os_type == 'windows' else None,
-                errors='ignore',  # 忽略编码错误
-                bufsize=1,  # 行缓冲
-                universal_newlines=True
-            )
-            
-            is_first_line = True
-            
-            # 实时读取并显示输出
-            while True:
-                line = process.stdout.readline()
-                
-                if not line:
-                    # 没有更多输出，检查进程是否结束
-                    if process.poll() is not None:
-                        break
-                    continue
-                
-                # 实时处理并显示每一行
-                self.process_line_realtime(line, is_first_line)
-                is_first_line = False
-            
-            # 等待进程结束
-            process.wait()
-            
-            # 如果没有 stdout 输出，检查 stderr
-            if is_first_line:
-                stderr_output = process.stderr.read()
-                if stderr_output:
-                    print("错误输出:")
-                    print(stderr_output)
-                else:
-                    print("错误: 没有收到输出")
-                return
-            
-            # Unix 系统在最后添加分隔线
-            if self.os_type != 'windows':
-                print("=" * 70)
-            
-            # 检查返回码
-            if process.returncode not in [0, 1]:
-                print(f"\n警告: 命令返回码 {process.returncode}")
-            
-        except FileNotFoundError:
-            print(f"\n错误: 找不到 traceroute 命令")
-            if self.os_type == 'windows':
-                print("请确保系统已安装 tracert 命令（Windows 自带）")
-            else:
-                print("请安装 traceroute:")
-                print("  Ubuntu/Debian: sudo apt-get install traceroute")
-                print("  CentOS/RHEL: sudo yum install traceroute")
-                print("  macOS: 系统自带，如缺失请使用 brew install traceroute")
-        
-        except KeyboardInterrupt:
-            print("\n\n用户中断操作")
-            if 'process' in locals():
-                process.terminate()
-                process.wait()
-        
-        except Exception as e:
+            engine = ProbeEngine(self.destination, max_hops=self.max_hops,
+                                 timeout=self.timeout, queries=self.queries,
+                                 backend='system')
+        except ValueError as e:
             print(f"\n错误: {e}")
-            import traceback
-            traceback.print_exc()
+            return False
+        return engine.trace()
 
 
 def print_usage():
@@ -277,7 +145,8 @@ def main():
                                 timeout=timeout, queries=queries)
     
     try:
-        tracer.trace()
+        if not tracer.trace():
+            sys.exit(1)
     except KeyboardInterrupt:
         print("\n\n中断: 用户取消操作")
         sys.exit(0)
@@ -0,0 +1,860 @@
+#!/usr/bin/env python3
+"""
+Vantage - 多探测点代理与集中收集
+每个探测点运行一个代理：调用追踪类执行追踪，把逐跳结果缓存成批，
+压缩后通过一条长连接发给收集器，收到确认后才丢弃；收集器不可达时
+批次落盘暂存，恢复连接后按顺序补发，暂存达到上限时停止接收新结果
+（追踪线程阻塞，形成背压）。收集器基于 asyncio，可同时接入数千个代理，
+按代理分别写入历史存储
+
+帧格式: 4 字节长度（网络字节序） + zlib 压缩的 JSON
+"""
+
+import asyncio
+import json
+import os
+import queue
+import re
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+from trace_store import (TCP_NONE, TCP_STATUS_CODES, TCP_UNREACHABLE,
+                         HopRecord, TraceStore)
+
+
+PROTOCOL_VERSION = 1
+DEFAULT_PORT = 9870
+FRAME_HEADER = struct.Struct('!I')
+MAX_FRAME = 16 * 1024 * 1024
+SPOOL_SUFFIX = '.frame'
+
+
+def encode_frame(message, level=6):
+    """
+    编码一帧
+
+    Args:
+        message: 可 JSON 序列化的对象
+        level: zlib 压缩级别
+
+    Returns:
+        (帧字节, 压缩前字节数)
+    """
+    raw = json.dumps(message, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    body = zlib.compress(raw, level)
+    return FRAME_HEADER.pack(len(body)) + body, len(raw)
+
+
+def decode_body(body):
+    """解码帧体（不含长度头）"""
+    return json.loads(zlib.decompress(body))
+
+
+def hops_to_wire(route_hops):
+    """
+    将 TracerouteNoAdmin.route_hops 转换为传输格式
+
+    Returns:
+        [[跳数, IP, [rtt 毫秒或 None], [是否可达, 响应时间ms, 状态描述] 或 None]]
+    """
+    hops = []
+    for hop_num in sorted(route_hops):
+        info = route_hops[hop_num]
+        rtts = []
+        for r in info.get('rtts', []):
+            try:
+                rtts.append(round(float(r), 3))
+            except (TypeError, ValueError):
+                rtts.append(None)
+        tcp = info.get('tcp')
+        hops.append([hop_num, info.get('ip'), rtts, list(tcp) if tcp else None])
+    return hops
+
+
+def hop_records_from_wire(hops):
+    """将传输格式的逐跳结果转换为 HopRecord 列表"""
+    records = []
+    for hop_num, ip, rtts, tcp in hops:
+        tcp_status = TCP_NONE
+        tcp_rtt = None
+        if tcp:
+            _, tcp_rtt, status = tcp
+            tcp_status = TCP_STATUS_CODES.get(status, TCP_UNREACHABLE)
+        records.append(HopRecord(hop_num, ip, rtts, tcp_status=tcp_status, tcp_rtt=tcp_rtt))
+    return records
+
+
+def safe_name(agent_id):
+    """把代理标识转换为可用作目录名的字符串"""
+    return re.sub(r'[^\w.-]', '_', agent_id) or '_'
+
+
+def parse_address(text, default_host='127.0.0.1'):
+    """
+    解析 "主机:端口"、"主机" 或 ":端口"
+
+    Returns:
+        (主机, 端口)
+    """
+    host, sep, port = text.rpartition(':')
+    if not sep:
+        return text or default_host, DEFAULT_PORT
+    return host or default_host, int(port)
+
+
+def trace_record(destination, max_hops=30, timeout=2, tcp_port=80,
+                 enable_tcp_check=True, tcp_cache=None):
+    """
+    用 ProbeEngine 的系统命令后端追踪一个目标，返回结构化结果（不输出到控制台）
+
+    Returns:
+        结果字典，域名解析失败时返回 None
+
+    Raises:
+        ValueError: 系统 traceroute 命令不可用
+    """
+    from probe_engine import ProbeEngine
+
+    with open(os.devnull, 'w') as devnull:
+        engine = ProbeEngine(destination, max_hops=max_hops, timeout=timeout,
+                             backend='system', tcp_port=tcp_port,
+                             enable_tcp_check=enable_tcp_check,
+                             tcp_cache=tcp_cache, output=devnull)
+        if not engine.resolve_destination():
+            return None
+        started = time.time()
+        for _ in engine.hop_stream():
+            pass
+        # 到达目标时复用最后一跳对目标端口的检测
+        final = list(engine.final_tcp()) if enable_tcp_check else None
+    return {
+        'destination': destination,
+        'dest_ip': engine.dest_ip,
+        'time': started,
+        'port': tcp_port,
+        'hops': hops_to_wire(engine.route_hops),
+        'final_tcp': final,
+    }
+
+
+class Spool:
+    """未确认批次的磁盘暂存（每批一个文件，按文件名顺序补发）"""
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024):
+        """
+        初始化
+
+        Args:
+            path: 暂存目录
+            max_bytes: 暂存上限，达到后代理停止接收新结果
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+        self._names = sorted(name for name in os.listdir(path)
+                             if name.endswith(SPOOL_SUFFIX))
+        self.bytes = sum(os.path.getsize(os.path.join(path, name))
+                         for name in self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    @property
+    def full(self):
+        return self.bytes >= self.max_bytes
+
+    def push(self, name, frame):
+        """写入一帧（先写临时文件再改名，中断时不会留下半帧）"""
+        name += SPOOL_SUFFIX
+        target = os.path.join(self.path, name)
+        with open(target + '.tmp', 'wb') as f:
+            f.write(frame)
+        os.replace(target + '.tmp', target)
+        self._names.append(name)
+        self.bytes += len(frame)
+
+    def oldest(self):
+        """
+        Returns:
+            (名称, 帧字节) 或 None
+        """
+        if not self._names:
+            return None
+        name = self._names[0]
+        with open(os.path.join(self.path, name), 'rb') as f:
+            return name[:-len(SPOOL_SUFFIX)], f.read()
+
+    def remove(self, name):
+        path = os.path.join(self.path, name + SPOOL_SUFFIX)
+        self.bytes -= os.path.getsize(path)
+        os.remove(path)
+        self._names.remove(name + SPOOL_SUFFIX)
+
+
+class VantageAgent:
+    """探测点代理：缓存追踪结果，成批压缩后发往收集器"""
+
+    def __init__(self, collector, agent_id=None, spool_dir=None, batch_size=100,
+                 flush_interval=2.0, queue_size=1000, max_spool_bytes=256 * 1024 * 1024,
+                 connect_timeout=5.0, ack_timeout=30.0, max_backoff=30.0):
+        """
+        初始化并启动发送线程
+
+        Args:
+            collector: 收集器地址 (主机, 端口)
+            agent_id: 代理标识（默认主机名）
+            spool_dir: 暂存目录（默认系统临时目录下 vantage-spool/<代理标识>）
+            batch_size: 每批最多包含的追踪数
+            flush_interval: 不满一批时最长等待秒数
+            queue_size: 内存中最多缓存的追踪数，满后 submit 阻塞
+            max_spool_bytes: 暂存上限（字节）
+            connect_timeout: 连接超时（秒）
+            ack_timeout: 等待确认的超时（秒）
+            max_backoff: 重连间隔上限（秒）
+        """
+        self.collector = collector
+        self.agent_id = agent_id or socket.gethostname()
+        if spool_dir is None:
+            spool_dir = os.path.join(tempfile.gettempdir(), 'vantage-spool',
+                                     safe_name(self.agent_id))
+        self.spool = Spool(spool_dir, max_spool_bytes)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.connect_timeout = connect_timeout
+        self.ack_timeout = ack_timeout
+        self.max_backoff = max_backoff
+        # 每次启动使用新的运行编号，收集器按 (代理, 运行编号, 序号) 去重
+        self.run_id = time.time_ns()
+        self.seq = 0
+        self.submitted = 0
+        self.frames_sent = 0
+        self.frames_spooled = 0
+        self.bytes_raw = 0
+        self.bytes_sent = 0
+        self.reconnects = 0
+        self._queue = queue.Queue(queue_size)
+        self._sock = None
+        self._backoff = 0.5
+        self._retry_at = 0.0
+        self._closing = threading.Event()
+        self._close_deadline = None
+        self._thread = threading.Thread(target=self._run, name='vantage-sender',
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, record, timeout=None):
+        """
+        提交一次追踪结果；内存队列已满时阻塞（背压）
+
+        Args:
+            record: 结果字典（见 trace_record）
+            timeout: 最长等待秒数（None 表示一直等待）
+
+        Returns:
+            是否已提交
+        """
+        try:
+            self._queue.put(record, timeout=timeout)
+        except queue.Full:
+            return False
+        self.submitted += 1
+        return True
+
+    def trace(self, destination, **kwargs):
+        """
+        追踪一个目标并提交结果
+
+        Args:
+            destination: 目标主机
+            **kwargs: 传给 trace_record 的参数
+
+        Returns:
+            结果字典，域名解析失败时返回 None
+        """
+        record = trace_record(destination, **kwargs)
+        if record is not None:
+            self.submit(record)
+        return record
+
+    def close(self, timeout=30.0):
+        """
+        发送剩余结果并停止；超时后未确认的批次留在暂存目录，下次启动时补发
+
+        Returns:
+            是否全部送达
+        """
+        self._close_deadline = time.monotonic() + timeout
+        self._closing.set()
+        self._thread.join(timeout + self.ack_timeout)
+        self._disconnect()
+        return self._queue.empty() and len(self.spool) == 0
+
+    def summary(self):
+        ratio = self.bytes_raw / self.bytes_sent if self.bytes_sent else 0
+        return (f"代理 {self.agent_id}: 提交 {self.submitted}, 发送 {self.frames_sent} 帧, "
+                f"落盘 {self.frames_spooled} 帧, 待补发 {len(self.spool)} 帧, "
+                f"重连 {self.reconnects}, 压缩比 {ratio:.1f}x")
+
+    def _run(self):
+        batch = []
+        batch_started = None
+        while True:
+            closing = self._closing.is_set()
+            if len(self.spool) and not self._drain_spool():
+                if closing and time.monotonic() >= self._close_deadline:
+                    if batch:
+                        self._ship(batch)
+                    while not self._queue.empty():
+                        self._ship(self._take(self.batch_size))
+                    return
+                if self.spool.full and not closing:
+                    # 暂存已满：不再从队列取结果，队列满后追踪线程阻塞
+                    time.sleep(min(max(self._retry_at - time.monotonic(), 0.05), 1.0))
+                    continue
+
+            wait = self.flush_interval
+            if batch_started is not None:
+                wait = max(batch_started + self.flush_interval - time.monotonic(), 0)
+            try:
+                batch.append(self._queue.get(timeout=min(wait, 0.5)))
+                if batch_started is None:
+                    batch_started = time.monotonic()
+                # 队列中已积压的结果一次取出，发送慢时批次自然变大
+                batch.extend(self._take(self.batch_size - len(batch)))
+            except queue.Empty:
+                pass
+
+            due = batch_started is not None and \
+                time.monotonic() >= batch_started + self.flush_interval
+            if batch and (len(batch) >= self.batch_size or due or closing):
+                self._ship(batch)
+                batch = []
+                batch_started = None
+            if closing and not batch and self._queue.empty() and \
+                    (not len(self.spool) or time.monotonic() >= self._close_deadline):
+                return
+
+    def _take(self, count):
+        items = []
+        while len(items) < count:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _ship(self, batch):
+        """编码一批结果并发送，失败或有更早的暂存批次时落盘"""
+        if not batch:
+            return
+        self.seq += 1
+        message = {'v': PROTOCOL_VERSION, 'agent': self.agent_id,
+                   'run': self.run_id, 'seq': self.seq, 'traces': batch}
+        frame, raw_size = encode_frame(message)
+        self.bytes_raw += raw_size
+        name = f"{self.run_id:020d}-{self.seq:010d}"
+        # 暂存非空时新批次排在其后，保证收集器按序号接收
+        if len(self.spool) or not self._send(frame, self.run_id, self.seq):
+            self.spool.push(name, frame)
+            self.frames_spooled += 1
+
+    def _drain_spool(self):
+        """按顺序补发暂存的批次，全部送达时返回 True"""
+        while len(self.spool):
+            name, frame = self.spool.oldest()
+            run_id, seq = (int(part) for part in name.split('-'))
+            if not self._send(frame, run_id, seq):
+                return False
+            self.spool.remove(name)
+        return True
+
+    def _connect(self):
+        if self._sock is not None:
+            return True
+        if time.monotonic() < self._retry_at:
+            return False
+        try:
+            self._sock = socket.create_connection(self.collector, self.connect_timeout)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._sock.settimeout(self.ack_timeout)
+        except OSError:
+            self._fail()
+            return False
+        self.reconnects += 1
+        return True
+
+    def _disconnect(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+    def _fail(self):
+        """连接失败：断开并按指数退避安排下次重连"""
+        self._disconnect()
+        self._retry_at = time.monotonic() + self._backoff
+        self._backoff = min(self._backoff * 2, self.max_backoff)
+
+    def _recv_exact(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self._sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("收集器关闭了连接")
+            data += chunk
+        return bytes(data)
+
+    def _send(self, frame, run_id, seq):
+        """发送一帧并等待确认"""
+        if not self._connect():
+            return False
+        try:
+            self._sock.sendall(frame)
+            while True:
+                length, = FRAME_HEADER.unpack(self._recv_exact(FRAME_HEADER.size))
+                reply = decode_body(self._recv_exact(length))
+                if reply.get('run') == run_id and reply.get('ack', 0) >= seq:
+                    break
+        except (OSError, ValueError, zlib.error):
+            self._fail()
+            return False
+        self._backoff = 0.5
+        self.frames_sent += 1
+        self.bytes_sent += len(frame)
+        return True
+
+
+class Collector:
+    """汇总多个代理结果的 asyncio 收集器"""
+
+    def __init__(self, store_dir=None, output=None, max_frame=MAX_FRAME):
+        """
+        初始化
+
+        Args:
+            store_dir: 历史存储根目录（可选，每个代理一个子目录）
+            output: 追加写入 JSON Lines 的文件路径（可选）
+            max_frame: 允许的最大帧字节数
+        """
+        self.store_dir = store_dir
+        self.output = open(output, 'a', encoding='utf-8') if output else None
+        self.max_frame = max_frame
+        self.stores = {}       # 代理标识 -> TraceStore
+        self.last_seq = {}     # (代理标识, 运行编号) -> 已确认的最大序号
+        self.connected = 0
+        self.agents = set()
+        self.frames = 0
+        self.duplicates = 0
+        self.traces = 0
+        self.hops = 0
+        self.bytes_received = 0
+        self.errors = 0
+        # 解压和写存储放在单独的线程中顺序执行，事件循环只负责收发
+        from concurrent.futures import ThreadPoolExecutor
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='vantage-writer')
+
+    def record(self, body):
+        """
+        解码并保存一帧
+
+        Returns:
+            确认消息
+        """
+        message = decode_body(body)
+        agent_id = str(message['agent'])
+        key = (agent_id, message['run'])
+        seq = message['seq']
+        self.agents.add(agent_id)
+        if seq <= self.last_seq.get(key, 0):
+            # 确认丢失后代理重发的批次
+            self.duplicates += 1
+            return {'ack': seq, 'run': message['run']}
+
+        store = None
+        if self.store_dir is not None:
+            store = self.stores.get(agent_id)
+            if store is None:
+                store = self.stores[agent_id] = TraceStore(
+                    os.path.join(self.store_dir, safe_name(agent_id)))
+        for trace in message['traces']:
+            if store is not None:
+                store.append(trace['dest_ip'], hop_records_from_wire(trace['hops']),
+                             trace.get('time'))
+            if self.output is not None:
+                self.output.write(json.dumps(dict(trace, agent=agent_id),
+                                             ensure_ascii=False) + '\n')
+            self.traces += 1
+            self.hops += len(trace['hops'])
+        if self.output is not None:
+            self.output.flush()
+        self.last_seq[key] = seq
+        self.frames += 1
+        return {'ack': seq, 'run': message['run']}
+
+    async def handle(self, reader, writer):
+        """处理一个代理连接"""
+        loop = asyncio.get_running_loop()
+        self.connected += 1
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(FRAME_HEADER.size)
+                except asyncio.IncompleteReadError:
+                    break
+                length, = FRAME_HEADER.unpack(header)
+                if length > self.max_frame:
+                    self.errors += 1
+                    break
+                body = await reader.readexactly(length)
+                self.bytes_received += FRAME_HEADER.size + length
+                try:
+                    ack = await loop.run_in_executor(self._writer, self.record, body)
+                except (ValueError, KeyError, TypeError, zlib.error):
+                    # 无法解析的帧：断开连接，不确认
+                    self.errors += 1
+                    break
+                frame, _ = encode_frame(ack, level=1)
+                writer.write(frame)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connected -= 1
+            writer.close()
+
+    async def serve(self, host='0.0.0.0', port=DEFAULT_PORT, stats_interval=10.0,
+                    ready=None, backlog=4096):
+        """
+        运行收集器直到被取消
+
+        Args:
+            host: 监听地址
+            port: 监听端口
+            stats_interval: 打印统计的间隔秒数（0 表示不打印）
+            ready: 开始监听后调用的函数（参数为实际端口）
+            backlog: 监听队列长度
+        """
+        raise_fd_limit()
+        server = await asyncio.start_server(self.handle, host, port, backlog=backlog)
+        port = server.sockets[0].getsockname()[1]
+        print(f"📡 收集器监听 {host}:{port}")
+        sys.stdout.flush()
+        if ready is not None:
+            ready(port)
+        async with server:
+            if stats_interval:
+                while True:
+                    await asyncio.sleep(stats_interval)
+                    print(self.summary())
+                    sys.stdout.flush()
+            else:
+                await server.serve_forever()
+
+    def summary(self):
+        return (f"在线 {self.connected}  代理 {len(self.agents)}  帧 {self.frames}  "
+                f"重复 {self.duplicates}  追踪 {self.traces}  跳 {self.hops}  "
+                f"接收 {self.bytes_received / 1024:.0f} KB  错误 {self.errors}")
+
+    def close(self):
+        self._writer.shutdown(wait=True)
+        for store in self.stores.values():
+            store.close()
+        if self.output is not None:
+            self.output.close()
+
+
+def raise_fd_limit():
+    """将打开文件数软限制提高到硬限制（数千个连接时需要）"""
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or hard > soft:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+
+def simulated_records(agent_id, count, destinations=200):
+    """
+    用合成拓扑生成追踪结果（不访问网络，用于本地测试）
+
+    Yields:
+        结果字典
+    """
+    from replay import SyntheticTopology
+
+    topology = SyntheticTopology(destinations, seed=zlib.crc32(agent_id.encode('utf-8')))
+    for n in range(count):
+        dest_ip, hops = topology.trace_hops(n)
+        yield {
+            'destination': dest_ip,
+            'dest_ip': dest_ip,
+            'time': time.time(),
+            'port': 80,
+            'hops': [[hop, ip, [None if r is None else round(r, 3) for r in rtts], None]
+                     for hop, ip, rtts in hops],
+            'final_tcp': None,
+        }
+
+
+def print_usage():
+    """打印使用说明"""
+    print("用法: python vantage.py <命令> [参数]")
+    print("\n命令:")
+    print("  collector [选项]                  运行收集器")
+    print("      -l, --listen <地址:端口>      监听地址 (默认: 0.0.0.0:%d)" % DEFAULT_PORT)
+    print("      --store <目录>                写入历史存储（每个代理一个子目录）")
+    print("      -o, --output <文件>           追加写入 JSON Lines")
+    print("      --stats <秒数>                统计输出间隔 (默认: 10)")
+    print("  agent <收集器地址:端口> [目标...] [选项]")
+    print("      -f, --file <文件>             从文件读取目标列表（每行一个）")
+    print("      --id <标识>                   代理标识 (默认: 主机名)")
+    print("      --spool <目录>                暂存目录")
+    print("      -b, --batch <数量>            每批追踪数 (默认: 100)")
+    print("      --flush <秒数>                不满一批时的最长等待 (默认: 2)")
+    print("      -r, --rounds <次数>           追踪轮数，0 表示一直运行 (默认: 1)")
+    print("      -i, --interval <秒数>         每轮间隔 (默认: 60)")
+    print("      -p, --port <端口>             TCP 检测端口 (默认: 80)")
+    print("      -m, --max-hops <数量>         最大跳数 (默认: 30)")
+    print("      -t, --timeout <秒数>          超时时间 (默认: 2)")
+    print("      --no-tcp                      不进行 TCP 检测")
+    print("      --simulate <数量>             每轮发送合成追踪结果，不访问网络")
+    print("  demo [选项]                       本地收集器 + 多个代理进程的端到端测试")
+    print("      -n, --agents <数量>           代理进程数 (默认: 4)")
+    print("      --simulate <数量>             每个代理的追踪数 (默认: 2000)")
+    print("      --outage <秒数>               收集器延迟启动，验证落盘与补发 (默认: 0)")
+    print("      （任一检查失败时退出码为 1，可用作回归检查）")
+    print("\n示例:")
+    print("  python vantage.py collector --store ./traces")
+    print("  python vantage.py agent collector.example.com:%d -f targets.txt -r 0 -i 300" % DEFAULT_PORT)
+    print("  python vantage.py demo -n 8 --outage 3")
+
+
+def _option_value(args, i, name):
+    if i + 1 >= len(args):
+        print(f"错误: {name} 需要一个参数")
+        sys.exit(1)
+    return args[i + 1]
+
+
+def parse_options(args):
+    """
+    解析命令参数
+
+    Returns:
+        (选项字典, 位置参数列表)
+    """
+    options = {'listen': f"0.0.0.0:{DEFAULT_PORT}", 'store': None, 'output': None,
+               'stats': 10.0, 'file': None, 'id': None, 'spool': None,
+               'batch': 100, 'flush': 2.0, 'rounds': 1, 'interval': 60.0,
+               'port': 80, 'max_hops': 30, 'timeout': 2.0, 'tcp': True,
+               'simulate': None, 'agents': 4, 'outage': 0.0}
+    names = {'-l': 'listen', '--listen': 'listen', '--store': 'store',
+             '-o': 'output', '--output': 'output', '--stats': 'stats',
+             '-f': 'file', '--file': 'file', '--id': 'id', '--spool': 'spool',
+             '-b': 'batch', '--batch': 'batch', '--flush': 'flush',
+             '-r': 'rounds', '--rounds': 'rounds', '-i': 'interval',
+             '--interval': 'interval', '-p': 'port', '--port': 'port',
+             '-m': 'max_hops', '--max-hops': 'max_hops', '-t': 'timeout',
+             '--timeout': 'timeout', '--simulate': 'simulate',
+             '-n': 'agents', '--agents': 'agents', '--outage': 'outage'}
+    integers = {'batch', 'rounds', 'port', 'max_hops', 'simulate', 'agents'}
+    floats = {'stats', 'flush', 'interval', 'timeout', 'outage'}
+    positional = []
+    i = 0
+    try:
+        while i < len(args):
+            arg = args[i]
+            if arg in names:
+                key = names[arg]
+                value = _option_value(args, i, arg)
+                if key in integers:
+                    value = int(value)
+                elif key in floats:
+                    value = float(value)
+                options[key] = value
+                i += 2
+            elif arg == '--no-tcp':
+                options['tcp'] = False
+                i += 1
+            elif arg.startswith('-') and arg != '-':
+                print(f"错误: 未知选项 '{arg}'")
+                sys.exit(1)
+            else:
+                positional.append(arg)
+                i += 1
+    except ValueError as e:
+        print(f"错误: 无效的参数值: {e}")
+        sys.exit(1)
+    return options, positional
+
+
+def run_collector(options):
+    host, port = parse_address(options['listen'], '0.0.0.0')
+    collector = Collector(options['store'], options['output'])
+    try:
+        asyncio.run(collector.serve(host, port, options['stats']))
+    except KeyboardInterrupt:
+        print("\n⚠️  收集器停止")
+    finally:
+        collector.close()
+        print(collector.summary())
+
+
+def run_agent(options, positional):
+    if not positional:
+        print("错误: 未指定收集器地址")
+        sys.exit(1)
+    targets = positional[1:]
+    if options['file']:
+        with open(options['file'], encoding='utf-8') as f:
+            targets.extend(line.strip() for line in f
+                           if line.strip() and not line.startswith('#'))
+    if not targets and options['simulate'] is None:
+        print("错误: 未指定追踪目标")
+        sys.exit(1)
+
+    agent = VantageAgent(parse_address(positional[0]), agent_id=options['id'],
+                         spool_dir=options['spool'], batch_size=options['batch'],
+                         flush_interval=options['flush'])
+    if len(agent.spool):
+        print(f"📦 {agent.agent_id}: 待补发 {len(agent.spool)} 帧", file=sys.stderr)
+
+    tcp_cache = None
+    if options['tcp'] and targets:
+        from tcp_cache import TcpCheckCache
+        tcp_cache = TcpCheckCache()
+
+    round_num = 0
+    try:
+        while options['rounds'] == 0 or round_num < options['rounds']:
+            if round_num:
+                time.sleep(options['interval'])
+            round_num += 1
+            if options['simulate'] is not None:
+                for record in simulated_records(agent.agent_id, options['simulate']):
+                    agent.submit(record)
+                continue
+            for target in targets:
+                agent.trace(target, max_hops=options['max_hops'],
+                            timeout=options['timeout'], tcp_port=options['port'],
+                            enable_tcp_check=options['tcp'], tcp_cache=tcp_cache)
+    except KeyboardInterrupt:
+        print(f"\n⚠️  {agent.agent_id}: 用户中断，发送剩余结果", file=sys.stderr)
+
+    delivered = agent.close()
+    print(agent.summary(), file=sys.stderr)
+    if not delivered:
+        print(f"⚠️  收集器不可达，未送达的结果保存在 {agent.spool.path}", file=sys.stderr)
+        sys.exit(2)
+
+
+def count_spooled(path):
+    """统计目录树下暂存的批次文件数"""
+    return sum(1 for _, _, names in os.walk(path)
+               for name in names if name.endswith(SPOOL_SUFFIX))
+
+
+def run_demo(options):
+    """
+    启动本地收集器和多个代理进程，检查所有结果都被收到且没有重复写入；
+    指定 --outage 时还检查停机期间确有批次落盘，并在结束时全部补发。
+    任一检查失败时以状态码 1 退出
+    """
+    import subprocess
+
+    count = options['simulate'] or 2000
+    workdir = tempfile.mkdtemp(prefix='vantage-demo-')
+    # 先占一个空闲端口，收集器延迟启动时代理连接会被拒绝并落盘
+    probe = socket.socket()
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+
+    collector = Collector(os.path.join(workdir, 'store'))
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(collector.serve('127.0.0.1', port, stats_interval=0))
+
+    def serve():
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+
+    print(f"🧪 {options['agents']} 个代理 × {count} 次追踪, 工作目录 {workdir}")
+    started = time.perf_counter()
+    agents = [subprocess.Popen([sys.executable, os.path.abspath(__file__), 'agent',
+                                f"127.0.0.1:{port}", '--id', f"agent-{n}",
+                                '--spool', os.path.join(workdir, 'spool', f"agent-{n}"),
+                                '--simulate', str(count), '--flush', '0.5'])
+              for n in range(options['agents'])]
+    spool_root = os.path.join(workdir, 'spool')
+    spooled = 0
+    if options['outage']:
+        time.sleep(options['outage'])
+        spooled = count_spooled(spool_root)
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+
+    failed = sum(1 for p in agents if p.wait() != 0)
+    elapsed = time.perf_counter() - started
+    loop.call_soon_threadsafe(task.cancel)
+    thread.join(5)
+    collector.close()
+
+    expected = options['agents'] * count
+    print("=" * 60)
+    print(collector.summary())
+    print(f"耗时 {elapsed:.2f}s, {collector.traces / elapsed:,.0f} 追踪/秒")
+    stored = sum(sum(1 for _ in TraceStore(os.path.join(workdir, 'store', name)).query())
+                 for name in os.listdir(os.path.join(workdir, 'store')))
+    leftover = count_spooled(spool_root)
+    if failed or collector.traces != expected or stored != expected:
+        print(f"❌ 期望 {expected} 次追踪，收到 {collector.traces}，"
+              f"存储 {stored}，失败代理 {failed}")
+        sys.exit(1)
+    if options['outage'] and not spooled:
+        print(f"❌ 收集器停机 {options['outage']:g} 秒期间没有批次落盘")
+        sys.exit(1)
+    if leftover:
+        print(f"❌ 结束后仍有 {leftover} 帧留在暂存目录")
+        sys.exit(1)
+    if options['outage']:
+        print(f"✅ 停机期间落盘 {spooled} 帧，恢复后全部补发")
+    print(f"✅ {expected} 次追踪全部送达并写入存储")
+
+
+def main():
+    """主函数"""
+    args = sys.argv[1:]
+    if not args or args[0] in ['-h', '--help']:
+        print_usage()
+        sys.exit(0 if args else 1)
+
+    command = args[0]
+    options, positional = parse_options(args[1:])
+    if command == 'collector':
+        run_collector(options)
+    elif command == 'agent':
+        run_agent(options, positional)
+    elif command == 'demo':
+        run_demo(options)
+    else:
+        print(f"错误: 未知命令 '{command}'")
+        print_usage()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()